@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de firma/verificación ES256: PEM por llamada vs CredentialSigner
+Reproduce los payloads del flujo OpenID4VC (access token y VC JWT) y mide el costo
+por token con ``jwt.encode``/``jwt.decode`` sobre cadenas PEM (comportamiento anterior)
+frente a las claves pre-parseadas de CredentialSigner, y la firma concurrente de VCs
+con SigningExecutor.sign (inline vs pool de hilos vs pool de procesos)
+
+Uso:
+    python benchmarks/benchmark_jwt_signing.py --iterations 2000 --batch 2000 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "controller"))
+
+from credential_signer import CredentialSigner  # noqa: E402
+from signing_executor import SigningExecutor  # noqa: E402
+
+ISSUER_URL = "https://utnpf.site"
+
+
+def generate_pem_pair():
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode("utf-8")
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode("utf-8")
+    return private_pem, public_pem
+
+
+def payloads():
+    now = int(time.time())
+    access_token = {
+        "iss": ISSUER_URL,
+        "aud": ISSUER_URL,
+        "sub": "12345",
+        "exp": now + 3600,
+        "iat": now,
+        "pre_authorized_code": f"pre_auth_12345_{now}_1234",
+        "scope": "UniversityCredential",
+    }
+    vc = {
+        "iss": ISSUER_URL,
+        "sub": "did:key:z6MkhaXgBZDvotDkL5257faiztiGiC2QtKLGpbnnEGta2doK",
+        "nbf": now,
+        "exp": now + 365 * 24 * 3600,
+        "vc": {
+            "@context": ["https://www.w3.org/2018/credentials/v1"],
+            "type": ["VerifiableCredential", "UniversityCredential"],
+            "credentialSubject": {
+                "id": "did:key:z6MkhaXgBZDvotDkL5257faiztiGiC2QtKLGpbnnEGta2doK",
+                "student_id": "12345",
+                "student_name": "Ana Pérez",
+                "student_email": "ana@universidad.edu",
+                "course_name": "Introducción a Blockchain",
+                "completion_date": "2025-08-03T10:30:00Z",
+                "grade": "A",
+            },
+        },
+    }
+    return {"access_token": access_token, "vc_jwt": vc}
+
+
+def per_token_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def bulk_sign(signer: CredentialSigner, payload, batch: int, workers: int):
+    """VCs/s firmando un lote de VCs concurrentes: inline en el event loop vs SigningExecutor en cada pool"""
+    payloads = [dict(payload, jti=f"urn:uuid:{i}") for i in range(batch)]
+
+    start = time.perf_counter()
+    inline = [signer.sign(p) for p in payloads]
+    results = {"inline": (time.perf_counter() - start, inline)}
+
+    for kind in ("thread", "process"):
+        executor = SigningExecutor(
+            signer, executor_kind=kind, max_workers=workers, max_in_flight=workers * 2, max_queue=batch
+        )
+        # arrancar el pool fuera de la medición
+        await asyncio.gather(*(executor.sign(p) for p in payloads[:workers]))
+        start = time.perf_counter()
+        tokens = await asyncio.gather(*(executor.sign(p) for p in payloads))
+        results[kind] = (time.perf_counter() - start, tokens)
+        await executor.close()
+
+    print(f"\n📦 SigningExecutor.sign: {batch} VCs concurrentes, {workers} workers")
+    for kind, (elapsed, tokens) in results.items():
+        assert len(tokens) == batch
+        print(f"  {kind:<10}{elapsed:8.2f} s {batch / elapsed:10.1f} VC/s")
+    # Mismo orden en todos los modos (ES256 no es determinista: se compara el payload)
+    for _, tokens in results.values():
+        assert [signer.verify(t)["jti"] for t in tokens[:10]] == [p["jti"] for p in payloads[:10]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de CredentialSigner")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    private_pem, public_pem = generate_pem_pair()
+    signer = CredentialSigner.from_pem(private_pem, public_pem)
+
+    print(f"🔏 ES256, {args.iterations} iteraciones por caso (µs por token)\n")
+    print(f"{'payload':<14}{'operación':<10}{'PEM':>10}{'signer':>10}{'mejora':>9}")
+    for name, payload in payloads().items():
+        token = signer.sign(payload)
+        decode_kwargs = {"audience": ISSUER_URL} if "aud" in payload else {}
+
+        sign_before = per_token_us(lambda: jwt.encode(payload, private_pem, algorithm="ES256"), args.iterations)
+        sign_after = per_token_us(lambda: signer.sign(payload), args.iterations)
+        verify_before = per_token_us(
+            lambda: jwt.decode(token, public_pem, algorithms=["ES256"], **decode_kwargs), args.iterations
+        )
+        verify_after = per_token_us(lambda: signer.verify(token, **decode_kwargs), args.iterations)
+
+        for operation, before, after in (("sign", sign_before, sign_after), ("verify", verify_before, verify_after)):
+            print(f"{name:<14}{operation:<10}{before:>10.1f}{after:>10.1f}{before / after:>8.2f}x")
+
+    asyncio.run(bulk_sign(signer, payloads()["vc_jwt"], args.batch, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark de renderizado de QR para una cohorte: serial vs QRRenderService con pool
+de hilos vs pool de procesos (caché vacío: mide el primer render de cada imagen)
+Usa payloads con el tamaño real de los flujos del Controller:
+- Invitación out-of-band de ACA-Py (invitation_url con ?oob=<base64url>)
+- Credential Offer OpenID4VC por valor (openid-credential-offer://?credential_offer=...)
+
+Uso:
+    python benchmarks/benchmark_qr_generation.py --count 200 --workers 4
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+import uuid
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "controller"))
+
+from qr_generator import render_qr_png  # noqa: E402
+from qr_render import QRRenderService  # noqa: E402
+
+
+def didcomm_invitation_url(index: int) -> str:
+    """invitation_url como la devuelve /out-of-band/create-invitation"""
+    invitation = {
+        "@type": "https://didcomm.org/out-of-band/1.1/invitation",
+        "@id": str(uuid.uuid4()),
+        "label": f"Estudiante-Alumno Número {index}",
+        "handshake_protocols": ["https://didcomm.org/didexchange/1.0"],
+        "services": [{
+            "id": "#inline",
+            "type": "did-communication",
+            "recipientKeys": [f"did:key:z6Mk{uuid.uuid4().hex}{uuid.uuid4().hex[:12]}#z6Mk{uuid.uuid4().hex[:12]}"],
+            "serviceEndpoint": "http://192.168.100.137:8021"
+        }]
+    }
+    encoded = base64.urlsafe_b64encode(json.dumps(invitation).encode()).decode().rstrip("=")
+    return f"http://192.168.100.137:8021?oob={encoded}"
+
+
+def openid_offer_url(index: int) -> str:
+    """qr_url como lo arma create_openid_credential_offer"""
+    offer = {
+        "credential_issuer": "https://utnpf.site",
+        "credential_configuration_ids": ["UniversityCredential"],
+        "grants": {
+            "urn:ietf:params:oauth:grant-type:pre-authorized_code": {
+                "pre-authorized_code": f"pre_auth_{100000 + index}_{int(time.time())}_{uuid.uuid4().int % 10000}"
+            }
+        }
+    }
+    return f"openid-credential-offer://?credential_offer={quote(json.dumps(offer, separators=(',', ':')), safe='')}"
+
+
+def report(label: str, elapsed: float, count: int):
+    print(f"  {label:<10} {elapsed:8.2f} s   {count / elapsed:8.1f} QR/s")
+
+
+async def render_pool(kind: str, payloads, workers: int):
+    """Todas las imágenes de la cohorte por el servicio del Controller (qr_renderer)"""
+    service = QRRenderService(executor_kind=kind, max_workers=workers)
+    await service.render_png(openid_offer_url(-1))  # arrancar el pool fuera de la medición
+    start = time.perf_counter()
+    results = await asyncio.gather(*(service.render_png(p) for p in payloads))
+    elapsed = time.perf_counter() - start
+    await service.close()
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de QRRenderService")
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    workloads = {
+        "DIDComm OOB": [didcomm_invitation_url(i) for i in range(args.count)],
+        "OpenID4VC offer": [openid_offer_url(i) for i in range(args.count)],
+    }
+
+    print(f"🔳 {args.count} QR por flujo, {args.workers} workers\n")
+    for name, payloads in workloads.items():
+        avg_len = sum(len(p) for p in payloads) // len(payloads)
+        print(f"{name} (payload medio {avg_len} caracteres)")
+
+        start = time.perf_counter()
+        serial = [render_qr_png(p) for p in payloads]
+        report("serial", time.perf_counter() - start, len(payloads))
+        elapsed, threaded = asyncio.run(render_pool("thread", payloads, args.workers))
+        report("threads", elapsed, len(payloads))
+        elapsed, processed = asyncio.run(render_pool("process", payloads, args.workers))
+        report("processes", elapsed, len(payloads))
+
+        # Mismo orden y mismo contenido en los tres modos
+        assert serial == threaded == processed
+        print()
+
+
+if __name__ == "__main__":
+    main()
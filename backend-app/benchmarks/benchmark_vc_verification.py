@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark de verificación de VCs JWT: /oid4vc/verify por lotes vs verificación por token
+Emite N credenciales con entrada en una lista StatusList2021 temporal, revoca una parte
+y mide VCs/s de:
+- por token: jwt.decode con el PEM + consulta de la lista en la base en cada credencial
+- CredentialVerifier.verify_many: clave por kid en memoria y lista de estado cacheada
+Con --anchor ancla además la cohorte en una cola de Merkle local (sin Fabric) y
+comprueba que check_anchor encuentra cada VC con los campos de su credentialSubject
+
+Uso:
+    python benchmarks/benchmark_vc_verification.py --count 2000 --revoked 0.1
+    python benchmarks/benchmark_vc_verification.py --count 500 --anchor
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "controller"))
+
+from anchor_queue import AnchorQueue  # noqa: E402
+from credential_signer import CredentialSigner, SigningKey  # noqa: E402
+from credential_verifier import CredentialVerifier  # noqa: E402
+from status_list import StatusListService  # noqa: E402
+
+ISSUER_URL = "https://utnpf.site"
+
+
+def credential_data(index: int):
+    """Datos de la solicitud tal como llegan al Controller (registro en Fabric y VC)"""
+    return {
+        "student_id": str(10000 + index),
+        "student_name": "Ana Pérez",
+        "student_email": f"ana{index}@utnpf.site",
+        "course_id": "42",
+        "course_name": "Introducción a Blockchain",
+        "completion_date": "2025-08-03T10:30:00Z",
+        "grade": "A",
+        "instructor_name": "Prof. Gómez",
+    }
+
+
+def vc_payload(index: int, credential_status):
+    now = int(time.time())
+    return {
+        "iss": ISSUER_URL,
+        "sub": f"did:web:utnpf.site#{10000 + index}",
+        "iat": now,
+        "exp": now + 365 * 24 * 3600,
+        "jti": f"urn:credential:bench_{index}",
+        "vc": {
+            "@context": ["https://www.w3.org/2018/credentials/v1"],
+            "type": ["VerifiableCredential", "UniversityCredential"],
+            "id": f"urn:credential:bench_{index}",
+            "credentialSubject": {
+                field: credential_data(index)[field]
+                for field in ("student_id", "student_name", "course_id", "course_name", "completion_date", "grade")
+            },
+            "credentialStatus": credential_status,
+        },
+    }
+
+
+async def run(args):
+    key = SigningKey.generate()
+    private_pem = key.private_pem().decode("utf-8")
+    public_pem = key.public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode("utf-8")
+    signer = CredentialSigner.from_pem(private_pem, public_pem)
+
+    async def sign(payload):
+        return signer.sign(payload)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        status_lists = StatusListService(
+            base_url=f"{ISSUER_URL}/oid4vc/status",
+            issuer=ISSUER_URL,
+            sign=sign,
+            path=os.path.join(tmp, "status_lists.db"),
+        )
+        verifier = CredentialVerifier(signer, status_lists)
+
+        print(f"🧾 Emitiendo {args.count} VCs...")
+        tokens = []
+        for i in range(args.count):
+            status = await status_lists.allocate(f"urn:credential:bench_{i}")
+            tokens.append(signer.sign(vc_payload(i, status)))
+        revoked = int(args.count * args.revoked)
+        for i in range(revoked):
+            await status_lists.revoke(f"urn:credential:bench_{i}")
+
+        # Por token: PEM por llamada y lista consultada en la base cada vez
+        start = time.perf_counter()
+        naive_valid = 0
+        for token in tokens:
+            payload = jwt.decode(token, public_pem, algorithms=["ES256"])
+            status = payload["vc"]["credentialStatus"]
+            list_id = status_lists.parse_list_url(status["statusListCredential"])
+            if not await status_lists.is_revoked(list_id, int(status["statusListIndex"])):
+                naive_valid += 1
+        naive = time.perf_counter() - start
+
+        await verifier.verify_many(tokens[:10])  # calentar caché de claves y de la lista
+        start = time.perf_counter()
+        results = await verifier.verify_many(tokens)
+        batched = time.perf_counter() - start
+        batched_valid = sum(1 for r in results if r["valid"])
+
+        assert naive_valid == batched_valid == args.count - revoked
+        print(f"\n{'modo':<14}{'tiempo':>10}{'VC/s':>12}")
+        print(f"{'por token':<14}{naive:>9.2f}s{args.count / naive:>12.1f}")
+        print(f"{'verify_many':<14}{batched:>9.2f}s{args.count / batched:>12.1f}")
+        print(f"\n✅ {batched_valid} válidas, {revoked} revocadas; mejora {naive / batched:.2f}x")
+
+        if args.anchor:
+            await check_anchor(args, verifier, tokens, tmp)
+
+
+async def check_anchor(args, verifier, tokens, tmp):
+    """Anclar la cohorte como lo hace register_credentials y verificar cada VC con check_anchor"""
+    from fabric_client import FabricClient
+
+    client = FabricClient()
+
+    async def submit_batch(batch_id, root, leaf_count):
+        return f"bench_tx_{root[:16]}"
+
+    client.anchor_queue = AnchorQueue(submit_batch=submit_batch, path=os.path.join(tmp, "anchor_queue.db"))
+    await client.register_credentials([credential_data(i) for i in range(args.count)])
+    verifier.anchor_lookup = client.verify_credential_anchor
+
+    start = time.perf_counter()
+    results = await verifier.verify_many(tokens, check_anchor=True)
+    elapsed = time.perf_counter() - start
+    anchored = sum(1 for r in results if r["anchor"].get("anchored"))
+    client.anchor_queue.close()
+
+    assert anchored == args.count, results[0]["anchor"]
+    print(f"🌳 {anchored}/{args.count} VCs encontradas en el lote anclado ({args.count / elapsed:.1f} VC/s con check_anchor)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de CredentialVerifier")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--revoked", type=float, default=0.1, help="Fracción de VCs revocadas")
+    parser.add_argument("--anchor", action="store_true", help="Comprobar también el anclaje de cada VC")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+AcaPy Client - Cliente HTTP compartido para la Admin API de ACA-Py
+Mantiene un pool de conexiones keep-alive (HTTP/2 opcional), timeouts ajustados,
+reintentos con backoff y latencias por endpoint
+"""
+
+import asyncio
+import importlib.util
+import os
+import random
+import re
+import time
+from typing import Optional
+import logging
+
+import httpx
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración del cliente ACA-Py
+ACAPY_ADMIN_URL = os.getenv("ACAPY_ADMIN_URL", "http://acapy-agent:8020")
+ACAPY_HTTP2 = os.getenv("ACAPY_HTTP2", "false").lower() == "true"
+ACAPY_MAX_CONNECTIONS = int(os.getenv("ACAPY_MAX_CONNECTIONS", "100"))
+ACAPY_MAX_KEEPALIVE = int(os.getenv("ACAPY_MAX_KEEPALIVE", "20"))
+ACAPY_KEEPALIVE_EXPIRY = float(os.getenv("ACAPY_KEEPALIVE_EXPIRY", "30"))
+ACAPY_CONNECT_TIMEOUT = float(os.getenv("ACAPY_CONNECT_TIMEOUT", "3"))
+ACAPY_READ_TIMEOUT = float(os.getenv("ACAPY_READ_TIMEOUT", "30"))
+ACAPY_POOL_TIMEOUT = float(os.getenv("ACAPY_POOL_TIMEOUT", "5"))
+ACAPY_MAX_RETRIES = int(os.getenv("ACAPY_MAX_RETRIES", "2"))
+ACAPY_BACKOFF_BASE = float(os.getenv("ACAPY_BACKOFF_BASE", "0.2"))
+
+# Respuestas que justifican reintentar una petición idempotente
+RETRYABLE_STATUS = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Segmentos de ruta que son identificadores (UUID, DID, cred def id, números, hex)
+_ID_SEGMENT = re.compile(
+    r"^(?:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"|\d+|[0-9a-fA-F]{16,}|.*[:%].*|.{33,})$"
+)
+
+
+def path_label(path: str) -> str:
+    """Plantilla de la ruta para métricas: /connections/3fa8... → /connections/{id}"""
+    path = path.split("?", 1)[0]
+    return "/".join("{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+
+class AcaPyClient:
+    """Wrapper de httpx.AsyncClient para la Admin API de ACA-Py"""
+
+    def __init__(self, base_url: str = ACAPY_ADMIN_URL):
+        self.base_url = base_url.rstrip("/")
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        http2 = ACAPY_HTTP2 and importlib.util.find_spec("h2") is not None
+        if ACAPY_HTTP2 and not http2:
+            logger.warning("⚠️ ACAPY_HTTP2 activo pero falta el paquete 'h2' - usando HTTP/1.1")
+
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=ACAPY_MAX_CONNECTIONS,
+                max_keepalive_connections=ACAPY_MAX_KEEPALIVE,
+                keepalive_expiry=ACAPY_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=ACAPY_CONNECT_TIMEOUT,
+                read=ACAPY_READ_TIMEOUT,
+                write=ACAPY_READ_TIMEOUT,
+                pool=ACAPY_POOL_TIMEOUT,
+            ),
+        )
+
+    async def start(self):
+        """Crear el pool de conexiones (evento startup)"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+            logger.info(f"🔌 Cliente ACA-Py iniciado: {self.base_url}")
+
+    async def close(self):
+        """Cerrar el pool de conexiones (evento shutdown)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def request(self, method: str, path: str, label: Optional[str] = None, **kwargs) -> httpx.Response:
+        """
+        Enviar petición a ACA-Py con reintentos y backoff exponencial con jitter
+
+        Los errores de conexión se reintentan siempre (la petición no llegó a enviarse);
+        timeouts de lectura y 502/503/504 solo en métodos idempotentes.
+        ``label`` nombra la métrica de latencia; por defecto la plantilla de la ruta
+        (los identificadores no deben crear un histograma por conexión)
+        """
+        method = method.upper()
+        histogram = metrics.histogram(f"acapy {method} {label or path_label(path)}")
+        attempt = 0
+
+        while True:
+            start = time.perf_counter()
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                histogram.observe(time.perf_counter() - start)
+                if attempt >= ACAPY_MAX_RETRIES:
+                    raise
+                logger.warning(f"⚠️ ACA-Py {method} {path} sin conexión ({e}), reintentando...")
+            except (httpx.ReadTimeout, httpx.RemoteProtocolError) as e:
+                histogram.observe(time.perf_counter() - start)
+                if method not in IDEMPOTENT_METHODS or attempt >= ACAPY_MAX_RETRIES:
+                    raise
+                logger.warning(f"⚠️ ACA-Py {method} {path} falló ({e}), reintentando...")
+            else:
+                histogram.observe(time.perf_counter() - start)
+                if (
+                    response.status_code in RETRYABLE_STATUS
+                    and method in IDEMPOTENT_METHODS
+                    and attempt < ACAPY_MAX_RETRIES
+                ):
+                    logger.warning(f"⚠️ ACA-Py {method} {path} respondió {response.status_code}, reintentando...")
+                else:
+                    return response
+
+            metrics.increment("acapy_retries")
+            delay = ACAPY_BACKOFF_BASE * (2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            attempt += 1
+
+    async def get(self, path: str, label: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, label=label, **kwargs)
+
+    async def post(self, path: str, label: Optional[str] = None, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, label=label, **kwargs)
+
+
+# Instancia compartida del Controller
+acapy_client = AcaPyClient()
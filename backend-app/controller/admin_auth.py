@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Admin Auth - Protección de los endpoints de administración del Controller
+(revocación, claves de firma, log de auditoría Fabric, registro de cred defs).
+Token compartido en CONTROLLER_ADMIN_TOKEN, enviado como ``Authorization: Bearer``
+o ``X-Admin-Token``. Sin token configurado la administración queda deshabilitada
+"""
+
+import hmac
+import os
+from typing import Optional
+import logging
+
+from fastapi import Header, HTTPException
+
+logger = logging.getLogger(__name__)
+
+CONTROLLER_ADMIN_TOKEN = os.getenv("CONTROLLER_ADMIN_TOKEN", "")
+
+if not CONTROLLER_ADMIN_TOKEN:
+    logger.warning("⚠️ CONTROLLER_ADMIN_TOKEN no configurado: endpoints de administración deshabilitados")
+
+
+def _presented_token(authorization: Optional[str], x_admin_token: Optional[str]) -> Optional[str]:
+    if x_admin_token:
+        return x_admin_token.strip()
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token.strip():
+            return token.strip()
+    return None
+
+
+async def require_admin(
+    authorization: Optional[str] = Header(None),
+    x_admin_token: Optional[str] = Header(None),
+) -> None:
+    """Dependencia FastAPI: 503 si no hay token configurado, 401 si falta o no coincide"""
+    if not CONTROLLER_ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Administración deshabilitada: configure CONTROLLER_ADMIN_TOKEN")
+    token = _presented_token(authorization, x_admin_token)
+    if token is None or not hmac.compare_digest(token.encode("utf-8"), CONTROLLER_ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(
+            status_code=401,
+            detail="Token de administración inválido",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
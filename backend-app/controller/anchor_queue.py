@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Anchor Queue - Cola write-behind persistente para anclar credenciales en Fabric
+Las credenciales se encolan en SQLite y un worker las agrupa por tamaño/ventana de
+tiempo: cada lote se ancla como una única raíz de Merkle (un solo CreateAsset) y
+cada credencial guarda su prueba de inclusión
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+import logging
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, Float, select, func, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from db import create_sqlite_engine
+from merkle import build_tree, merkle_root, inclusion_proof, verify_proof
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la cola de anclaje
+FABRIC_ANCHOR_QUEUE_PATH = os.getenv("FABRIC_ANCHOR_QUEUE_PATH", "/var/lib/controller/anchor_queue.db")
+FABRIC_ANCHOR_BATCH_SIZE = int(os.getenv("FABRIC_ANCHOR_BATCH_SIZE", "256"))
+FABRIC_ANCHOR_WINDOW = float(os.getenv("FABRIC_ANCHOR_WINDOW", "5"))
+FABRIC_ANCHOR_RETRY_DELAY = float(os.getenv("FABRIC_ANCHOR_RETRY_DELAY", "10"))
+# Un lote reclamado por un worker que murió antes de completarlo vuelve a tomarse tras este plazo
+FABRIC_ANCHOR_CLAIM_LEASE = float(os.getenv("FABRIC_ANCHOR_CLAIM_LEASE", "300"))
+
+# Estados de una credencial / lote
+STATUS_QUEUED = "queued"
+STATUS_CLAIMED = "claimed"  # Reclamado por un worker, raíz en curso de envío
+STATUS_ANCHORED = "anchored"
+STATUS_LOGGED = "logged_for_processing"  # Fabric caído: lote registrado en el log de auditoría
+
+# Firma del callback que envía la raíz del lote a Fabric → transaction_id
+SubmitBatch = Callable[[str, str, int], Awaitable[str]]
+
+
+class AnchorConflictError(Exception):
+    """Uno o más asset_id ya estaban encolados; no se encola nada de la llamada"""
+
+    def __init__(self, asset_ids: List[str]):
+        self.asset_ids = asset_ids
+        super().__init__(f"asset_id ya encolado: {', '.join(asset_ids[:5])}")
+
+
+class AnchorQueue:
+    """Cola durable de credenciales pendientes de anclaje por lotes de Merkle"""
+
+    def __init__(
+        self,
+        submit_batch: SubmitBatch,
+        path: str = FABRIC_ANCHOR_QUEUE_PATH,
+        batch_size: int = FABRIC_ANCHOR_BATCH_SIZE,
+        window: float = FABRIC_ANCHOR_WINDOW,
+    ):
+        self._submit_batch = submit_batch
+        self.batch_size = batch_size
+        self.window = window
+
+        self._engine = create_sqlite_engine(path)
+        metadata = MetaData()
+        self._items = Table(
+            "anchor_items",
+            metadata,
+            Column("seq", Integer, primary_key=True, autoincrement=True),
+            Column("asset_id", String(255), nullable=False, unique=True),
+            Column("credential_hash", String(64), nullable=False, index=True),
+            Column("asset_data", Text, nullable=False),
+            Column("status", String(32), nullable=False, index=True),
+            Column("enqueued_at", Float, nullable=False),
+            Column("batch_id", String(64), nullable=True, index=True),
+            Column("claimed_at", Float, nullable=True),
+            Column("leaf_index", Integer, nullable=True),
+            Column("proof", Text, nullable=True),
+        )
+        self._batches = Table(
+            "anchor_batches",
+            metadata,
+            Column("batch_id", String(64), primary_key=True),
+            Column("merkle_root", String(64), nullable=False, index=True),
+            Column("leaf_count", Integer, nullable=False),
+            Column("transaction_id", String(255), nullable=True),
+            Column("status", String(32), nullable=False),
+            Column("created_at", String(64), nullable=False),
+        )
+        metadata.create_all(self._engine)
+        self._upgrade_schema_sync()
+
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._worker_task: Optional[asyncio.Task] = None
+        self._pending = self._count_pending_sync()
+
+    def _upgrade_schema_sync(self):
+        """Bases creadas antes del reclamo de lotes: agregar la columna claimed_at"""
+        columns = {column["name"] for column in inspect(self._engine).get_columns("anchor_items")}
+        if "claimed_at" not in columns:
+            with self._engine.begin() as conn:
+                conn.execute(text("ALTER TABLE anchor_items ADD COLUMN claimed_at FLOAT"))
+            logger.info("🔧 Cola de anclaje: columna claimed_at agregada")
+
+    # ---------------------------------------------------------------- encolado
+
+    async def enqueue(self, asset_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Encolar una credencial para anclaje; retorna el recibo inmediato
+        AnchorConflictError si el asset_id ya estaba encolado
+        """
+        await asyncio.to_thread(self._enqueue_many_sync, [asset_data])
+        self._pending += 1
+        metrics.set_gauge("fabric_anchor_queue_depth", self._pending)
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+        return {
+            "asset_id": asset_data["ID"],
+            "credential_hash": asset_data["Hash"],
+            "status": STATUS_QUEUED,
+        }
+
+    async def enqueue_many(self, assets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Encolar una cohorte completa en una sola transacción (todo o nada)"""
+        await asyncio.to_thread(self._enqueue_many_sync, assets)
+        self._pending += len(assets)
+        metrics.set_gauge("fabric_anchor_queue_depth", self._pending)
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+        return [
+            {"asset_id": asset["ID"], "credential_hash": asset["Hash"], "status": STATUS_QUEUED}
+            for asset in assets
+        ]
+
+    def _enqueue_many_sync(self, assets: List[Dict[str, Any]]):
+        """Insertar ítems; un asset_id repetido revierte la transacción completa"""
+        now = time.time()
+        rows = [
+            {
+                "asset_id": asset["ID"],
+                "credential_hash": asset["Hash"],
+                "asset_data": json.dumps(asset, ensure_ascii=False),
+                "status": STATUS_QUEUED,
+                "enqueued_at": now,
+            }
+            for asset in assets
+        ]
+        try:
+            with self._engine.begin() as conn:
+                conn.execute(self._items.insert(), rows)
+        except IntegrityError:
+            raise AnchorConflictError(self._existing_asset_ids_sync([row["asset_id"] for row in rows])) from None
+
+    def _existing_asset_ids_sync(self, asset_ids: List[str]) -> List[str]:
+        seen, duplicated = set(), []
+        for asset_id in asset_ids:
+            if asset_id in seen:
+                duplicated.append(asset_id)
+            seen.add(asset_id)
+        with self._engine.connect() as conn:
+            for start in range(0, len(asset_ids), 500):
+                chunk = asset_ids[start:start + 500]
+                duplicated.extend(conn.execute(
+                    select(self._items.c.asset_id).where(self._items.c.asset_id.in_(chunk))
+                ).scalars())
+        return duplicated
+
+    def _count_pending_sync(self) -> int:
+        with self._engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(self._items).where(
+                    self._items.c.status.in_([STATUS_QUEUED, STATUS_CLAIMED])
+                )
+            ).scalar_one()
+
+    # ------------------------------------------------------------------ lotes
+
+    async def flush(self, batch_size: Optional[int] = None) -> int:
+        """
+        Anclar todo lo pendiente ahora mismo; retorna cuántas credenciales se anclaron
+        ``batch_size`` permite anclar una cohorte grande bajo una sola raíz
+        """
+        total = 0
+        async with self._flush_lock:
+            while True:
+                anchored = await self._anchor_next_batch(batch_size or self.batch_size)
+                if not anchored:
+                    return total
+                total += anchored
+
+    async def _anchor_next_batch(self, batch_size: int) -> int:
+        batch_id = f"batch_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+        rows = await asyncio.to_thread(self._take_batch_sync, batch_id, batch_size)
+        if not rows:
+            return 0
+
+        hashes = [row["credential_hash"] for row in rows]
+        levels = build_tree(hashes)
+        root = merkle_root(levels)
+
+        start = time.perf_counter()
+        try:
+            transaction_id = await self._submit_batch(batch_id, root, len(rows))
+        except BaseException:
+            # Devolver el lote a la cola para el próximo intento (o para otro worker)
+            await asyncio.shield(asyncio.to_thread(self._release_batch_sync, batch_id))
+            raise
+        metrics.observe("fabric_anchor_batch_submit", time.perf_counter() - start)
+
+        status = STATUS_LOGGED if str(transaction_id).startswith("audit_") else STATUS_ANCHORED
+        proofs = [inclusion_proof(levels, i) for i in range(len(rows))]
+        await asyncio.to_thread(
+            self._complete_batch_sync, batch_id, root, transaction_id, status, rows, proofs
+        )
+
+        self._pending = max(self._pending - len(rows), 0)
+        metrics.set_gauge("fabric_anchor_queue_depth", self._pending)
+        metrics.increment("fabric_anchor_batches")
+        metrics.increment("fabric_anchor_credentials", len(rows))
+        logger.info(f"🌳 Lote {batch_id} anclado: {len(rows)} credenciales, raíz {root[:16]}... ({status})")
+        return len(rows)
+
+    def _take_batch_sync(self, batch_id: str, batch_size: int) -> List[Dict[str, Any]]:
+        """
+        Reclamar el próximo lote: el UPDATE condicionado al estado leído garantiza que
+        cada ítem quede en un único lote aunque varios workers (o procesos) hagan flush
+        """
+        now = time.time()
+        ready = (self._items.c.status == STATUS_QUEUED) | (
+            (self._items.c.status == STATUS_CLAIMED) & (self._items.c.claimed_at <= now - FABRIC_ANCHOR_CLAIM_LEASE)
+        )
+        with self._engine.begin() as conn:
+            candidates = conn.execute(
+                select(self._items.c.seq).where(ready).order_by(self._items.c.seq).limit(batch_size)
+            ).scalars().all()
+            for start in range(0, len(candidates), 500):
+                conn.execute(
+                    self._items.update()
+                    .where(self._items.c.seq.in_(candidates[start:start + 500]), ready)
+                    .values(status=STATUS_CLAIMED, batch_id=batch_id, claimed_at=now)
+                )
+            claimed = conn.execute(
+                select(self._items.c.seq, self._items.c.asset_id, self._items.c.credential_hash)
+                .where(self._items.c.batch_id == batch_id, self._items.c.status == STATUS_CLAIMED)
+                .order_by(self._items.c.seq)
+            )
+            return [dict(row._mapping) for row in claimed]
+
+    def _release_batch_sync(self, batch_id: str):
+        with self._engine.begin() as conn:
+            conn.execute(
+                self._items.update()
+                .where(self._items.c.batch_id == batch_id, self._items.c.status == STATUS_CLAIMED)
+                .values(status=STATUS_QUEUED, batch_id=None, claimed_at=None)
+            )
+
+    def _complete_batch_sync(self, batch_id, root, transaction_id, status, rows, proofs):
+        with self._engine.begin() as conn:
+            conn.execute(self._batches.insert().values(
+                batch_id=batch_id,
+                merkle_root=root,
+                leaf_count=len(rows),
+                transaction_id=transaction_id,
+                status=status,
+                created_at=datetime.utcnow().isoformat(),
+            ))
+            for index, (row, proof) in enumerate(zip(rows, proofs)):
+                conn.execute(
+                    self._items.update()
+                    .where(self._items.c.seq == row["seq"], self._items.c.batch_id == batch_id)
+                    .values(status=status, leaf_index=index, proof=json.dumps(proof))
+                )
+
+    async def mark_batch_anchored(self, batch_id: Optional[str], transaction_id: str) -> bool:
+        """Marcar como anclado un lote que quedó en el log de auditoría (tras el replay)"""
+        if not batch_id:
+            return False
+        root = await asyncio.to_thread(self._mark_batch_anchored_sync, batch_id, transaction_id)
+        if root is None:
+            return False
+        logger.info(f"🌳 Lote {batch_id} anclado tras replay: {transaction_id}")
+        return True
+
+    def _mark_batch_anchored_sync(self, batch_id: str, transaction_id: str) -> Optional[str]:
+        with self._engine.begin() as conn:
+            root = conn.execute(
+                select(self._batches.c.merkle_root).where(
+                    self._batches.c.batch_id == batch_id,
+                    self._batches.c.status == STATUS_LOGGED,
+                )
+            ).scalar_one_or_none()
+            if root is None:
+                return None
+            conn.execute(
+                self._batches.update()
+                .where(self._batches.c.batch_id == batch_id)
+                .values(status=STATUS_ANCHORED, transaction_id=transaction_id)
+            )
+            conn.execute(
+                self._items.update()
+                .where(self._items.c.batch_id == batch_id)
+                .values(status=STATUS_ANCHORED)
+            )
+        return root
+
+    # ---------------------------------------------------------------- recibos
+
+    async def get_receipt(self, asset_id: str) -> Optional[Dict[str, Any]]:
+        """Estado de anclaje de una credencial, con raíz y prueba de inclusión si ya se ancló"""
+        return await asyncio.to_thread(self._get_receipt_sync, asset_id)
+
+    async def get_receipts(self, asset_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Recibos de varias credenciales en una sola consulta (asset_id → recibo)"""
+        return await asyncio.to_thread(self._get_receipts_sync, asset_ids)
+
+    def _receipt_select(self):
+        return (
+            select(
+                self._items.c.asset_id,
+                self._items.c.credential_hash,
+                self._items.c.status,
+                self._items.c.batch_id,
+                self._items.c.leaf_index,
+                self._items.c.proof,
+                self._batches.c.merkle_root,
+                self._batches.c.transaction_id,
+                self._batches.c.leaf_count,
+            )
+            .select_from(self._items.outerjoin(self._batches, self._items.c.batch_id == self._batches.c.batch_id))
+        )
+
+    @staticmethod
+    def _receipt_from_row(row) -> Dict[str, Any]:
+        receipt = dict(row._mapping)
+        receipt["proof"] = json.loads(receipt["proof"]) if receipt["proof"] else None
+        return receipt
+
+    def _get_receipt_sync(self, asset_id: str) -> Optional[Dict[str, Any]]:
+        with self._engine.connect() as conn:
+            row = conn.execute(self._receipt_select().where(self._items.c.asset_id == asset_id)).first()
+        return self._receipt_from_row(row) if row is not None else None
+
+    def _get_receipts_sync(self, asset_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        receipts: Dict[str, Dict[str, Any]] = {}
+        with self._engine.connect() as conn:
+            # Trozos por debajo del límite de parámetros de SQLite
+            for start in range(0, len(asset_ids), 500):
+                chunk = asset_ids[start:start + 500]
+                for row in conn.execute(self._receipt_select().where(self._items.c.asset_id.in_(chunk))):
+                    receipts[row.asset_id] = self._receipt_from_row(row)
+        return receipts
+
+    async def get_anchored_root(self, root: str) -> Optional[Dict[str, Any]]:
+        """Lote enviado con esa raíz (de cualquier worker del emisor), o None"""
+        return await asyncio.to_thread(self._get_root_sync, root)
+
+    def _get_root_sync(self, root: str) -> Optional[Dict[str, Any]]:
+        stmt = select(
+            self._batches.c.merkle_root,
+            self._batches.c.batch_id,
+            self._batches.c.transaction_id,
+            self._batches.c.status,
+            self._batches.c.leaf_count,
+        ).where(self._batches.c.merkle_root == root).limit(1)
+        with self._engine.connect() as conn:
+            row = conn.execute(stmt).first()
+        return dict(row._mapping) if row is not None else None
+
+    async def verify(self, credential_hash: str, proof: List[Dict[str, Any]], root: str) -> Dict[str, Any]:
+        """
+        Verificación local: la prueba reconstruye la raíz y la raíz pertenece a un lote
+        enviado por este emisor. No requiere consultar Fabric. Un lote que quedó en el
+        log de auditoría (Fabric caído) aún no está en el ledger: se informa como pendiente
+        """
+        proof_valid = verify_proof(credential_hash, proof, root)
+        batch = await self.get_anchored_root(root)
+        anchored = batch is not None and batch["status"] == STATUS_ANCHORED
+        return {
+            "valid": proof_valid and anchored,
+            "pending": proof_valid and batch is not None and not anchored,
+            "proof_valid": proof_valid,
+            "root_known": batch is not None,
+            "anchor_status": batch["status"] if batch else None,
+            "batch_id": batch["batch_id"] if batch else None,
+            "transaction_id": batch["transaction_id"] if batch else None,
+        }
+
+    async def verify_credential_hash(self, credential_hash: str) -> Optional[Dict[str, Any]]:
+        """Buscar la credencial por hash y verificar su prueba almacenada"""
+        receipt = await asyncio.to_thread(self._get_receipt_by_hash_sync, credential_hash)
+        if receipt is None:
+            return None
+        if receipt["status"] in (STATUS_QUEUED, STATUS_CLAIMED):
+            return {"valid": False, "pending": True, "anchor_status": STATUS_QUEUED, "asset_id": receipt["asset_id"]}
+        result = await self.verify(credential_hash, receipt["proof"], receipt["merkle_root"])
+        result["asset_id"] = receipt["asset_id"]
+        result["merkle_root"] = receipt["merkle_root"]
+        return result
+
+    def _get_receipt_by_hash_sync(self, credential_hash: str) -> Optional[Dict[str, Any]]:
+        with self._engine.connect() as conn:
+            asset_id = conn.execute(
+                select(self._items.c.asset_id)
+                .where(self._items.c.credential_hash == credential_hash)
+                .order_by(self._items.c.seq.desc())
+                .limit(1)
+            ).scalar_one_or_none()
+        return self._get_receipt_sync(asset_id) if asset_id else None
+
+    # ----------------------------------------------------------------- worker
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if self._pending <= 0:
+                continue
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Los ítems siguen en estado queued: se reintentan en la próxima ventana
+                logger.error(f"❌ Error anclando lote en Fabric: {e}")
+                await asyncio.sleep(FABRIC_ANCHOR_RETRY_DELAY)
+
+    def start(self):
+        """Iniciar el worker (evento startup); retoma lo que quedó pendiente"""
+        if self._worker_task is None or self._worker_task.done():
+            if self._pending:
+                logger.info(f"📦 Cola de anclaje: {self._pending} credenciales pendientes de ejecuciones anteriores")
+            self._worker_task = asyncio.create_task(self._worker_loop())
+
+    async def stop(self):
+        """Detener el worker anclando lo pendiente (evento shutdown)"""
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"⚠️ Pendientes de anclaje se procesarán al reiniciar: {e}")
+        self._engine.dispose()
+
+    def close(self):
+        """Liberar la base sin anclar lo pendiente (herramientas CLI; lo ancla el Controller)"""
+        self._engine.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._pending,
+            "batch_size": self.batch_size,
+            "window_seconds": self.window,
+        }
@@ -11,21 +11,38 @@ import logging
 import os
 import json
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from pydantic import BaseModel, Field
 import httpx
 import structlog
 
-from fabric_client import FabricClient
-from qr_generator import QRGenerator
+from fabric_client import AsyncFabricClient, FABRIC_ANCHOR_MODE
+from anchor_queue import AnchorQueue
+from audit_log import audit_log
+from pending_store import get_pending_store
+from qr_cache import qr_cache
+from qr_render import qr_renderer, QR_INLINE_BASE64
+from qr_generator import QR_RENDERERS
+from acapy_client import acapy_client
+from admin_auth import require_admin
+from metrics import metrics
+from ledger_artifacts import cred_def_registry, parse_cred_def_tag
+from batch_issuance import batch_issuance
+from job_queue import job_queue, JOB_FAILED
+from idempotency import IdempotencyIndex, IdempotencyConflictError
+from issuance_scheduler import issuance_scheduler
+from invitation_index import InvitationIndex
 
 # NUEVO: Import OpenID4VC endpoints
 try:
-    from openid4vc_endpoints import oid4vc_router
+    from openid4vc_endpoints import (
+        oid4vc_router, signing_executor, status_lists, credential_verifier,
+        build_credential_offer, CredentialOfferRequest
+    )
     OPENID4VC_AVAILABLE = True
 except ImportError:
     OPENID4VC_AVAILABLE = False
@@ -39,9 +56,29 @@ logger = structlog.get_logger()
 ACAPY_ADMIN_URL = os.getenv("ACAPY_ADMIN_URL", "http://acapy-agent:8020")
 ACAPY_PUBLIC_URL = os.getenv("ACAPY_PUBLIC_URL", "http://localhost:8021")
 CONTROLLER_PORT = int(os.getenv("CONTROLLER_PORT", "3000"))
+# URL pública del Controller para armar enlaces absolutos (vacío = rutas relativas)
+CONTROLLER_PUBLIC_URL = os.getenv("CONTROLLER_PUBLIC_URL", "").rstrip("/")
 
-# Almacenamiento temporal de QRs (en producción usar base de datos)
-qr_storage: Dict[str, Dict[str, str]] = {}
+# Tiempo de vida de credenciales DIDComm pendientes (el estudiante puede escanear más tarde)
+PENDING_CREDENTIAL_TTL = int(os.getenv("PENDING_CREDENTIAL_TTL", str(7 * 24 * 3600)))
+PENDING_DIDCOMM_NAMESPACE = "didcomm"
+
+# Schema y Credential Definition de la credencial universitaria
+CREDENTIAL_SCHEMA_NAME = "UniversidadCredencial"
+CREDENTIAL_SCHEMA_VERSION = "1.0"
+CREDENTIAL_DEFINITION_TAG = "universidad_v1"
+CREDENTIAL_SCHEMA_ATTRIBUTES = [
+    "student_id",
+    "student_name",
+    "student_email",
+    "course_id",
+    "course_name",
+    "completion_date",
+    "grade",
+    "instructor_name",
+    "issue_date",
+    "university_name"
+]
 
 # Configuración FastAPI
 app = FastAPI(
@@ -68,7 +105,12 @@ app.add_middleware(
 
 # Clientes globales
 fabric_client = None
-qr_generator = QRGenerator()
+pending_store = get_pending_store()
+# Deduplicación de solicitudes repetidas (course_completed duplicado, reintentos de cURL)
+credential_requests_index = IdempotencyIndex(pending_store, namespace="idempotency")
+queued_requests_index = IdempotencyIndex(pending_store, namespace="idempotency_jobs")
+# oob_id ↔ invi_msg_id ↔ connection_id: los datos pendientes se guardan bajo el oob_id
+invitation_index = InvitationIndex(pending_store, ttl=PENDING_CREDENTIAL_TTL)
 
 # Modelos Pydantic
 class StudentCredentialRequest(BaseModel):
@@ -95,9 +137,15 @@ class MoodleCredentialRequest(BaseModel):
 class ConnectionInvitationResponse(BaseModel):
     """Respuesta con invitación de conexión"""
     invitation_url: str
-    qr_code_base64: str
+    qr_code_base64: Optional[str] = None  # Solo si QR_INLINE_BASE64 / inline_qr
+    qr_image_url: Optional[str] = None
     connection_id: str
     
+class BatchCredentialRequest(BaseModel):
+    """Cohorte de finalizaciones de curso (cierre de cursada en Moodle)"""
+    credentials: List[StudentCredentialRequest] = Field(..., min_length=1, description="Una entrada por estudiante y curso")
+    channels: List[str] = Field(default_factory=lambda: ["didcomm"], description="Canales a emitir: didcomm y/o openid")
+
 class CredentialOfferResponse(BaseModel):
     """Respuesta con oferta de credencial"""
     credential_offer_id: str
@@ -112,6 +160,9 @@ async def startup_event():
     
     logger.info("🚀 Iniciando Controller de Credenciales W3C...")
     
+    # Pool de conexiones compartido con ACA-Py
+    await acapy_client.start()
+    
     # Verificar conectividad con ACA-Py (no bloqueante en desarrollo)
     if not await check_acapy_connection():
         logger.warning("⚠️ ACA-Py no disponible - continuando en modo desarrollo")
@@ -120,82 +171,155 @@ async def startup_event():
     
     # Inicializar Fabric Client
     try:
-        fabric_client = FabricClient()
+        fabric_client = AsyncFabricClient()
+        await fabric_client.initialize()
+        fabric_client.connection.start_monitor()
+        
+        # Anclaje write-behind por lotes de Merkle
+        if FABRIC_ANCHOR_MODE == "batched":
+            fabric_client.anchor_queue = AnchorQueue(submit_batch=fabric_client.anchor_batch_root)
+            fabric_client.anchor_queue.start()
+            if OPENID4VC_AVAILABLE:
+                credential_verifier.anchor_lookup = fabric_client.verify_credential_anchor
+            logger.info("✅ Cola de anclaje por lotes iniciada")
+        
         logger.info("✅ Fabric Client inicializado")
     except Exception as e:
         logger.error(f"❌ Error inicializando Fabric: {e}")
         # No detener el servicio, pero registrar el error
     
+    # Barrido periódico de QRs expirados
+    qr_cache.start_sweeper()
+    qr_renderer.start()
+    
     # Configurar Schema y Credential Definition
     await setup_credential_schema()
     
+    # Workers de la cola de trabajos asíncronos (retoman lo pendiente)
+    job_queue.start()
+    
+    # Emisión DIDComm disparada por los webhooks de conexión (retoma las interrumpidas)
+    issuance_scheduler.start(issue_pending_credential, store=pending_store)
+    
     logger.info("✅ Controller inicializado correctamente")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Liberar recursos compartidos"""
+    await job_queue.stop()
+    await issuance_scheduler.close()
+    await qr_cache.stop_sweeper()
+    await qr_renderer.close()
+    await batch_issuance.close()
+    if OPENID4VC_AVAILABLE:
+        await signing_executor.close()
+    await acapy_client.close()
+    if fabric_client:
+        if fabric_client.anchor_queue is not None:
+            await fabric_client.anchor_queue.stop()
+        await fabric_client.disconnect()
+    await audit_log.close()
+    await pending_store.close()
+    logger.info("🔌 Controller detenido")
+
 async def check_acapy_connection() -> bool:
     """Verificar conectividad con ACA-Py"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{ACAPY_ADMIN_URL}/status/live")
-            return response.status_code == 200
+        response = await acapy_client.get("/status/live")
+        return response.status_code == 200
     except Exception as e:
         logger.error(f"Error conectando con ACA-Py: {e}")
         return False
 
 async def setup_credential_schema():
-    """Configurar Schema y Credential Definition para credenciales universitarias"""
+    """
+    Configurar Schema y Credential Definition para credenciales universitarias
+    Idempotente: reutiliza los artefactos del manifest y solo publica lo que falte
+    """
     try:
-        # Definir Schema de Credencial Universitaria
-        schema_body = {
-            "schema_name": "UniversidadCredencial",
-            "schema_version": "1.0",
-            "attributes": [
-                "student_id",
-                "student_name", 
-                "student_email",
-                "course_id",
-                "course_name",
-                "completion_date",
-                "grade",
-                "instructor_name",
-                "issue_date",
-                "university_name"
-            ]
-        }
+        # 1. Cred def ya publicado: una sola consulta local a ACA-Py para verificarlo
+        cred_def_id = cred_def_registry.lookup(
+            CREDENTIAL_SCHEMA_NAME, CREDENTIAL_SCHEMA_VERSION, CREDENTIAL_DEFINITION_TAG
+        )
+        if cred_def_id:
+            verified = await cred_def_registry.verify_cred_def(acapy_client, cred_def_id)
+            if verified is None:
+                logger.warning("⚠️ ACA-Py no pudo verificar el manifest, se conserva sin cambios")
+                return
+            if verified:
+                logger.info(f"♻️ Credential Definition reutilizado: {cred_def_id}")
+                return
+            logger.warning(f"⚠️ Cred def del manifest no existe en ACA-Py: {cred_def_id}")
+            await cred_def_registry.invalidate(cred_def_id)
+        
+        # 2. Cred def creado en el wallet pero ausente del manifest
+        cred_def_id = await get_credential_definition_id()
+        if cred_def_id:
+            logger.info(f"♻️ Credential Definition existente en ACA-Py: {cred_def_id}")
+            return
         
-        async with httpx.AsyncClient() as client:
-            # Crear Schema
+        # 3. Schema: reutilizar si ya fue publicado, crear solo si falta
+        schema_id = await cred_def_registry.resolve_schema(
+            acapy_client, CREDENTIAL_SCHEMA_NAME, CREDENTIAL_SCHEMA_VERSION
+        )
+        if schema_id:
+            logger.info(f"♻️ Schema reutilizado: {schema_id}")
+        else:
+            schema_body = {
+                "schema_name": CREDENTIAL_SCHEMA_NAME,
+                "schema_version": CREDENTIAL_SCHEMA_VERSION,
+                "attributes": CREDENTIAL_SCHEMA_ATTRIBUTES
+            }
+            
             logger.info("📋 Creando Schema de credencial...")
-            schema_response = await client.post(
-                f"{ACAPY_ADMIN_URL}/schemas",
+            schema_response = await acapy_client.post(
+                "/schemas",
                 json=schema_body
             )
             
-            if schema_response.status_code == 200:
-                schema_data = schema_response.json()
-                schema_id = schema_data["sent"]["schema_id"]
-                logger.info(f"✅ Schema creado: {schema_id}")
-                
-                # Crear Credential Definition
-                cred_def_body = {
-                    "schema_id": schema_id,
-                    "support_revocation": False,
-                    "tag": "universidad_v1"
-                }
-                
-                logger.info("🔐 Creando Credential Definition...")
-                cred_def_response = await client.post(
-                    f"{ACAPY_ADMIN_URL}/credential-definitions",
-                    json=cred_def_body
-                )
-                
-                if cred_def_response.status_code == 200:
-                    cred_def_data = cred_def_response.json()
-                    logger.info(f"✅ Credential Definition creado: {cred_def_data['sent']['credential_definition_id']}")
-                else:
-                    logger.error(f"❌ Error creando Credential Definition: {cred_def_response.text}")
-            else:
+            if schema_response.status_code != 200:
                 logger.error(f"❌ Error creando Schema: {schema_response.text}")
-                
+                return
+            
+            schema_id = schema_response.json()["sent"]["schema_id"]
+            logger.info(f"✅ Schema creado: {schema_id}")
+            await cred_def_registry.register_schema(
+                CREDENTIAL_SCHEMA_NAME,
+                CREDENTIAL_SCHEMA_VERSION,
+                schema_id,
+                attributes=CREDENTIAL_SCHEMA_ATTRIBUTES
+            )
+        
+        # 4. Crear Credential Definition
+        cred_def_body = {
+            "schema_id": schema_id,
+            "support_revocation": False,
+            "tag": CREDENTIAL_DEFINITION_TAG
+        }
+        
+        logger.info("🔐 Creando Credential Definition...")
+        cred_def_response = await acapy_client.post(
+            "/credential-definitions",
+            json=cred_def_body,
+            timeout=120.0  # La generación de claves del cred def puede tardar
+        )
+        
+        if cred_def_response.status_code == 200:
+            cred_def_data = cred_def_response.json()
+            cred_def_id = cred_def_data['sent']['credential_definition_id']
+            logger.info(f"✅ Credential Definition creado: {cred_def_id}")
+            
+            # Registrar para no consultarlo en cada emisión
+            await cred_def_registry.register(
+                CREDENTIAL_SCHEMA_NAME,
+                CREDENTIAL_SCHEMA_VERSION,
+                CREDENTIAL_DEFINITION_TAG,
+                cred_def_id,
+                schema_id=schema_id
+            )
+        else:
+            logger.error(f"❌ Error creando Credential Definition: {cred_def_response.text}")
+            
     except Exception as e:
         logger.error(f"❌ Error configurando Schema: {e}")
 
@@ -211,16 +335,39 @@ async def health_check():
         "timestamp": datetime.utcnow().isoformat(),
         "services": {
             "acapy": "up" if acapy_status else "down",
-            "fabric": "up" if fabric_client else "down"
-        }
+            "fabric": "up" if fabric_client and fabric_client.is_connected else "down"
+        },
+        "fabric_connection": fabric_client.connection.snapshot() if fabric_client else None,
+        "qr_cache": qr_cache.stats(),
+        "fabric_audit_log": audit_log.stats()
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas en proceso: latencias por endpoint de ACA-Py, cachés y contadores"""
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        **metrics.snapshot(),
+        "caches": {"qr": qr_cache.stats(), "qr_render": qr_renderer.stats()},
+        "signing": signing_executor.stats() if OPENID4VC_AVAILABLE else None,
+        "status_lists": status_lists.stats() if OPENID4VC_AVAILABLE else None,
+        "verifier": credential_verifier.stats() if OPENID4VC_AVAILABLE else None,
+        "batch_issuance": batch_issuance.stats(),
+        "jobs": job_queue.stats(),
+        "idempotency": [credential_requests_index.stats(), queued_requests_index.stats()],
+        "issuance": issuance_scheduler.stats(),
+        "invitation_index": invitation_index.stats()
     }
 
 # COMPATIBILIDAD: Endpoint para Fases 1-3 (estructura original)
 @app.post("/api/issue-credential", response_model=ConnectionInvitationResponse)
-async def issue_credential_compatible(moodle_request: MoodleCredentialRequest):
+async def issue_credential_compatible(moodle_request: MoodleCredentialRequest, request: Request):
     """
     ENDPOINT DE COMPATIBILIDAD: Para Fases 1-3 con estructura original
     Convierte el formato original a la estructura nueva y procesa
+    
+    Con ``Prefer: respond-async`` responde 202 con un job_id (ver /api/jobs/{job_id})
+    Los reenvíos del mismo curso/estudiante/fecha devuelven la respuesta original
     """
     try:
         logger.info(f"📨 [COMPATIBILIDAD] Nueva solicitud de credencial para: {moodle_request.userName}")
@@ -237,20 +384,69 @@ async def issue_credential_compatible(moodle_request: MoodleCredentialRequest):
             instructor_name="Sistema Moodle"  # Valor por defecto para compatibilidad
         )
         
-        # Delegar al endpoint principal
-        return await request_credential(credential_request)
+        # Delegar al flujo principal (en segundo plano si Moodle lo pide)
+        if prefers_async(request):
+            return await enqueue_credential_request(credential_request, request)
+        return await process_credential_request(
+            credential_request,
+            idempotency_key=request.headers.get("idempotency-key")
+        )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error en endpoint de compatibilidad: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error procesando solicitud: {str(e)}")
 
 @app.post("/api/credential/request", response_model=ConnectionInvitationResponse)
-async def request_credential(credential_request: StudentCredentialRequest):
+async def request_credential(
+    credential_request: StudentCredentialRequest,
+    request: Request,
+    inline_qr: Optional[bool] = None
+):
     """
     ENDPOINT PRINCIPAL: Procesar solicitud de credencial desde Moodle
     Retorna invitación de conexión para que estudiante use su wallet
+    
+    ``inline_qr=false`` omite el QR en base64 y deja solo ``qr_image_url``
+    (la imagen se renderiza recién cuando alguien la pide)
+    
+    Con ``Prefer: respond-async`` responde 202 con un job_id sin esperar a
+    ACA-Py/Fabric; el header ``X-Callback-Url`` recibe el resultado al terminar
+    
+    Idempotente: el header ``Idempotency-Key`` o, si falta, (student_id,
+    course_id, completion_date) identifican la solicitud; los duplicados
+    reciben la invitación ya creada sin tocar ACA-Py ni Fabric
     """
+    if prefers_async(request):
+        return await enqueue_credential_request(credential_request, request)
+    return await process_credential_request(
+        credential_request,
+        inline_qr,
+        idempotency_key=request.headers.get("idempotency-key")
+    )
+
+def credential_request_key(credential_request: StudentCredentialRequest, idempotency_key: Optional[str]) -> str:
+    """Clave de deduplicación; 400 si el Idempotency-Key no es válido"""
     try:
+        return IdempotencyIndex.key_for(credential_request.dict(), idempotency_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def credential_request_fingerprint(credential_request: StudentCredentialRequest, idempotency_key: Optional[str]) -> Optional[str]:
+    """Huella del cuerpo: solo con Idempotency-Key (la clave natural ya deriva del cuerpo)"""
+    return IdempotencyIndex.fingerprint(credential_request.dict()) if idempotency_key else None
+
+async def process_credential_request(
+    credential_request: StudentCredentialRequest,
+    inline_qr: Optional[bool] = None,
+    idempotency_key: Optional[str] = None
+) -> ConnectionInvitationResponse:
+    """Registro en Fabric + invitación DIDComm (request síncrono y cola de trabajos)"""
+    key = credential_request_key(credential_request, idempotency_key)
+    fingerprint = credential_request_fingerprint(credential_request, idempotency_key)
+    
+    async def execute() -> Dict[str, Any]:
         logger.info(f"📨 Nueva solicitud de credencial para: {credential_request.student_name}")
         
         # 1. Registrar en Hyperledger Fabric
@@ -261,53 +457,247 @@ async def request_credential(credential_request: StudentCredentialRequest):
             except Exception as e:
                 logger.warning(f"⚠️ Error registrando en Fabric (continuando): {e}")
         
-        # 2. Crear conexión en ACA-Py usando out-of-band
-        async with httpx.AsyncClient() as client:
-            invitation_response = await client.post(
-                f"{ACAPY_ADMIN_URL}/out-of-band/create-invitation",
-                json={
-                    "alias": f"Estudiante-{credential_request.student_name}",
-                    "auto_accept": True,
-                    "handshake_protocols": ["https://didcomm.org/didexchange/1.0"],
-                    "use_public_did": False
-                }
-            )
-            
-            if invitation_response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Error creando invitación de conexión")
-            
-            invitation_data = invitation_response.json()
-            connection_id = invitation_data["oob_id"]  # out-of-band usa oob_id en lugar de connection_id
-            invitation_url = invitation_data["invitation_url"]
-            
-            logger.info(f"🔗 Invitación out-of-band creada: {connection_id}")
-            
-            # 3. Generar QR Code
-            qr_code_base64 = qr_generator.generate_qr(invitation_url)
-            
-            # 4. Almacenar QR temporalmente para visualización web
-            qr_storage[connection_id] = {
-                "qr_code_base64": qr_code_base64,
-                "invitation_url": invitation_url,
-                "student_name": credential_request.student_name,
-                "course_name": credential_request.course_name,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-            # 5. Almacenar datos para posterior emisión de credencial
-            # (En producción, usar base de datos)
-            await store_pending_credential(connection_id, credential_request)
-            
-            return ConnectionInvitationResponse(
-                invitation_url=invitation_url,
-                qr_code_base64=qr_code_base64,
-                connection_id=connection_id
+        # 2-5. Invitación out-of-band, QR y datos pendientes
+        # (el QR en base64 no se guarda en el índice: se renderiza al responder)
+        invitation = await create_didcomm_invitation(credential_request, inline_qr=False)
+        return invitation.dict(exclude_none=True)
+    
+    try:
+        response, replayed = await credential_requests_index.run(key, execute, fingerprint)
+        if replayed:
+            logger.info(
+                f"♻️ Solicitud duplicada de {credential_request.student_name}: "
+                f"se reutiliza la invitación {response['connection_id']}"
             )
-            
+        
+        invitation = ConnectionInvitationResponse(**response)
+        inline = QR_INLINE_BASE64 if inline_qr is None else inline_qr
+        if inline:
+            invitation.qr_code_base64 = await qr_renderer.data_uri(invitation.invitation_url)
+        return invitation
+        
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"❌ Error procesando solicitud: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# TRABAJOS ASÍNCRONOS (Prefer: respond-async)
+
+JOB_KIND_CREDENTIAL_REQUEST = "credential_request"
+
+def prefers_async(request: Request) -> bool:
+    """RFC 7240: el cliente acepta 202 + job_id en lugar de esperar el resultado"""
+    preferences = request.headers.get("prefer", "")
+    return any(
+        token.split("=")[0].strip().lower() == "respond-async"
+        for token in preferences.replace(";", ",").split(",")
+    )
+
+async def enqueue_credential_request(credential_request: StudentCredentialRequest, request: Request) -> JSONResponse:
+    """
+    Persistir la solicitud en la cola de trabajos y responder 202 de inmediato
+    Un duplicado recibe el mismo job_id salvo que ese trabajo haya fallado o expirado
+    """
+    idempotency_key = request.headers.get("idempotency-key")
+    key = credential_request_key(credential_request, idempotency_key)
+    fingerprint = credential_request_fingerprint(credential_request, idempotency_key)
+    
+    async def enqueue() -> Dict[str, Any]:
+        # La clave viaja con el trabajo: el worker deduplica contra el flujo síncrono
+        return await job_queue.enqueue(
+            JOB_KIND_CREDENTIAL_REQUEST,
+            {**credential_request.dict(), "idempotency_key": idempotency_key},
+            callback_url=request.headers.get("x-callback-url")
+        )
+    
+    try:
+        job, replayed = await queued_requests_index.run(key, enqueue, fingerprint)
+        if replayed:
+            current = await job_queue.get(job["job_id"])
+            if current is None or current["status"] == JOB_FAILED:
+                job = await enqueue()
+                await queued_requests_index.remember(key, job, fingerprint)
+            else:
+                job = current
+                logger.info(f"♻️ Solicitud duplicada de {credential_request.student_name}: trabajo {job['job_id']}")
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    status_url = f"{CONTROLLER_PUBLIC_URL}/api/jobs/{job['job_id']}"
+    logger.info(f"📥 Solicitud de {credential_request.student_name} encolada: {job['job_id']}")
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["job_id"], "status": job["status"], "status_url": status_url},
+        headers={"Location": status_url, "Preference-Applied": "respond-async"}
+    )
+
+async def run_credential_request_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Handler de la cola: mismo flujo que el request síncrono, sin QR en base64"""
+    idempotency_key = payload.pop("idempotency_key", None)
+    invitation = await process_credential_request(
+        StudentCredentialRequest(**payload),
+        inline_qr=False,
+        idempotency_key=idempotency_key
+    )
+    return invitation.dict(exclude_none=True)
+
+job_queue.register(JOB_KIND_CREDENTIAL_REQUEST, run_credential_request_job)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Estado de un trabajo asíncrono: queued, running, succeeded (con resultado) o failed"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return job
+
+async def create_didcomm_invitation(
+    credential_request: StudentCredentialRequest,
+    inline_qr: Optional[bool] = None
+) -> ConnectionInvitationResponse:
+    """Invitación out-of-band + QR + datos pendientes (solicitud individual y cohortes)"""
+    # 1. Crear conexión en ACA-Py usando out-of-band
+    invitation_response = await acapy_client.post(
+        "/out-of-band/create-invitation",
+        json={
+            "alias": f"Estudiante-{credential_request.student_name}",
+            "auto_accept": True,
+            "handshake_protocols": ["https://didcomm.org/didexchange/1.0"],
+            "use_public_did": False
+        }
+    )
+
+    if invitation_response.status_code != 200:
+        raise HTTPException(status_code=500, detail="Error creando invitación de conexión")
+
+    invitation_data = invitation_response.json()
+    connection_id = invitation_data["oob_id"]  # out-of-band usa oob_id en lugar de connection_id
+    invitation_url = invitation_data["invitation_url"]
+
+    logger.info(f"🔗 Invitación out-of-band creada: {connection_id}")
+    
+    # Los webhooks de conexión traen este @id como invitation_msg_id
+    await invitation_index.register_invitation(
+        connection_id,
+        invitation_data.get("invi_msg_id") or invitation_data.get("invitation", {}).get("@id")
+    )
+
+    # 2. QR Code: URL de imagen siempre; base64 en línea solo si se pide
+    qr_image_url = f"{CONTROLLER_PUBLIC_URL}/qr/{connection_id}.png"
+    inline = QR_INLINE_BASE64 if inline_qr is None else inline_qr
+    qr_code_base64 = await qr_renderer.data_uri(invitation_url) if inline else None
+
+    # 3. Almacenar datos del QR para visualización web (la imagen vive en qr_renderer)
+    qr_cache.set(f"didcomm:{connection_id}", {
+        "invitation_url": invitation_url,
+        "student_name": credential_request.student_name,
+        "course_name": credential_request.course_name,
+        "timestamp": datetime.utcnow().isoformat()
+    })
+
+    # 4. Almacenar datos para posterior emisión de credencial
+    # (En producción, usar base de datos)
+    await store_pending_credential(connection_id, credential_request)
+
+    return ConnectionInvitationResponse(
+        invitation_url=invitation_url,
+        qr_code_base64=qr_code_base64,
+        qr_image_url=qr_image_url,
+        connection_id=connection_id
+    )
+
+# EMISIÓN POR COHORTES
+
+BATCH_CHANNELS = {"didcomm", "openid"}
+# Campos de la oferta OpenID4VC que se devuelven por estudiante
+BATCH_OPENID_FIELDS = ("pre_authorized_code", "qr_url", "qr_image_url", "credential_offer_uri", "web_qr_url")
+
+@app.post("/api/credential/batch", status_code=202)
+async def request_credential_batch(batch_request: BatchCredentialRequest):
+    """
+    Emisión por cohortes: ancla toda la cohorte en Fabric en un paso y crea
+    invitaciones DIDComm / offers OpenID4VC con concurrencia acotada.
+    Responde de inmediato con el job_id; los resultados por estudiante se leen
+    en streaming (NDJSON) desde /api/credential/batch/{job_id}/results
+    """
+    channels = set(batch_request.channels)
+    if not channels or channels - BATCH_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"Canales válidos: {', '.join(sorted(BATCH_CHANNELS))}")
+    if "openid" in channels and not OPENID4VC_AVAILABLE:
+        raise HTTPException(status_code=400, detail="OpenID4VC no disponible en este Controller")
+    if len(batch_request.credentials) > batch_issuance.max_items:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {batch_issuance.max_items} credenciales por cohorte"
+        )
+    
+    items = [credential.dict() for credential in batch_request.credentials]
+    
+    async def issue_one(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        credential_request = StudentCredentialRequest(**item)
+        result = {
+            "index": index,
+            "student_id": credential_request.student_id,
+            "course_id": credential_request.course_id,
+            "status": "issued"
+        }
+        # Sin QR en línea: las imágenes se renderizan cuando el estudiante abre el enlace
+        # Misma deduplicación que /api/credential/request: un estudiante que ya pidió
+        # su credencial (o aparece dos veces en la cohorte) reutiliza la invitación
+        if "didcomm" in channels:
+            async def create_invitation() -> Dict[str, Any]:
+                invitation = await create_didcomm_invitation(credential_request, inline_qr=False)
+                return invitation.dict(exclude_none=True)
+            
+            result["didcomm"], replayed = await credential_requests_index.run(
+                IdempotencyIndex.key_for(item), create_invitation
+            )
+            if replayed:
+                result["didcomm_replayed"] = True
+        if "openid" in channels:
+            offer = await build_credential_offer(
+                CredentialOfferRequest(**{field: item[field] for field in CredentialOfferRequest.model_fields}),
+                inline_qr=False
+            )
+            result["openid"] = {field: offer.get(field) for field in BATCH_OPENID_FIELDS}
+        return result
+    
+    anchor_all = None
+    if fabric_client:
+        async def anchor_all(cohort: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            return await fabric_client.register_credentials(cohort, concurrency=batch_issuance.concurrency)
+    
+    job = batch_issuance.submit(items, issue_one, anchor_all)
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "total": job.total,
+        "status_url": f"{CONTROLLER_PUBLIC_URL}/api/credential/batch/{job.job_id}",
+        "results_url": f"{CONTROLLER_PUBLIC_URL}/api/credential/batch/{job.job_id}/results"
+    }
+
+@app.get("/api/credential/batch/{job_id}")
+async def get_credential_batch(job_id: str):
+    """Progreso de un trabajo de emisión por cohortes"""
+    job = batch_issuance.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return job.summary()
+
+@app.get("/api/credential/batch/{job_id}/results")
+async def stream_credential_batch_results(job_id: str):
+    """
+    Resultados por estudiante en NDJSON, a medida que terminan; luego los recibos de
+    anclaje en Fabric (líneas {"event": "anchor"}) y por último el resumen
+    """
+    job = batch_issuance.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o expirado")
+    return StreamingResponse(job.stream(), media_type="application/x-ndjson")
+
 @app.post("/api/credential/issue/{connection_id}")
 async def issue_credential(connection_id: str, background_tasks: BackgroundTasks):
     """
@@ -317,12 +707,13 @@ async def issue_credential(connection_id: str, background_tasks: BackgroundTasks
     try:
         logger.info(f"🎓 Emitiendo credencial para conexión: {connection_id}")
         
-        # Obtener datos de credencial pendiente
-        credential_data = await get_pending_credential(connection_id)
+        # Obtener datos de credencial pendiente (guardados bajo el oob_id de la invitación)
+        pending_key = await resolve_pending_key(connection_id)
+        credential_data = await get_pending_credential(pending_key)
         if not credential_data:
             raise HTTPException(status_code=404, detail="No hay credencial pendiente para esta conexión")
         
-        # Obtener Credential Definition ID (en producción, almacenar en BD)
+        # Obtener Credential Definition ID (registro en memoria, sin ida y vuelta a ACA-Py)
         cred_def_id = await get_credential_definition_id()
         if not cred_def_id:
             raise HTTPException(status_code=500, detail="Credential Definition no encontrado")
@@ -342,39 +733,49 @@ async def issue_credential(connection_id: str, background_tasks: BackgroundTasks
         ]
         
         # Emitir credencial vía ACA-Py
-        async with httpx.AsyncClient() as client:
-            offer_body = {
-                "connection_id": connection_id,
-                "credential_definition_id": cred_def_id,
-                "credential_preview": {
-                    "@type": "issue-credential/2.0/credential-preview",
-                    "attributes": credential_attributes
-                },
-                "auto_issue": True,
-                "auto_remove": False,
-                "comment": f"Credencial de finalización: {credential_data['course_name']}"
-            }
-            
-            offer_response = await client.post(
-                f"{ACAPY_ADMIN_URL}/issue-credential-2.0/send-offer",
-                json=offer_body
-            )
-            
-            if offer_response.status_code != 200:
-                raise HTTPException(status_code=500, detail="Error emitiendo credencial")
-            
-            offer_data = offer_response.json()
-            logger.info(f"✅ Credencial emitida: {offer_data['cred_ex_id']}")
-            
-            # Limpiar datos pendientes
-            await clear_pending_credential(connection_id)
-            
-            return {
-                "status": "credential_issued",
-                "credential_exchange_id": offer_data["cred_ex_id"],
-                "message": "Credencial emitida exitosamente"
-            }
-            
+        offer_body = {
+            "connection_id": connection_id,
+            "credential_definition_id": cred_def_id,
+            "credential_preview": {
+                "@type": "issue-credential/2.0/credential-preview",
+                "attributes": credential_attributes
+            },
+            "auto_issue": True,
+            "auto_remove": False,
+            "comment": f"Credencial de finalización: {credential_data['course_name']}"
+        }
+        
+        offer_response = await acapy_client.post(
+            "/issue-credential-2.0/send-offer",
+            json=offer_body
+        )
+        
+        if offer_response.status_code != 200:
+            if 400 <= offer_response.status_code < 500 and "definition" in offer_response.text.lower():
+                # El cred def registrado ya no es válido en ACA-Py: forzar nueva resolución
+                await cred_def_registry.invalidate(cred_def_id)
+            # Conservar el 4xx de ACA-Py (no reintentable en issuance_scheduler); 5xx → 502
+            status_code = offer_response.status_code if 400 <= offer_response.status_code < 500 else 502
+            raise HTTPException(status_code=status_code, detail=f"Error emitiendo credencial: ACA-Py respondió {offer_response.status_code}")
+        
+        offer_data = offer_response.json()
+        logger.info(f"✅ Credencial emitida: {offer_data['cred_ex_id']}")
+        
+        # Limpiar datos pendientes; la invitación ya se consumió, así que un reenvío
+        # de la misma finalización de curso debe crear una nueva
+        await clear_pending_credential(pending_key)
+        natural_key = IdempotencyIndex.key_for(credential_data)
+        await credential_requests_index.forget(natural_key)
+        await queued_requests_index.forget(natural_key)
+        
+        return {
+            "status": "credential_issued",
+            "credential_exchange_id": offer_data["cred_ex_id"],
+            "message": "Credencial emitida exitosamente"
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Error emitiendo credencial: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -385,14 +786,30 @@ async def issue_credential(connection_id: str, background_tasks: BackgroundTasks
 async def webhook_connections(data: dict):
     """Webhook para eventos de conexión"""
     logger.info(f"🔔 Webhook conexión: {data.get('state', 'unknown')}")
+    connection_id = data.get("connection_id")
+    
+    # Correlacionar con la invitación en cuanto ACA-Py informa el invitation_msg_id
+    if connection_id and data.get("invitation_msg_id"):
+        await invitation_index.link(connection_id, invi_msg_id=data["invitation_msg_id"])
     
-    if data.get("state") == "active":
-        connection_id = data.get("connection_id")
+    if data.get("state") == "active" or data.get("rfc23_state") == "completed":
         if connection_id:
-            # Emitir credencial automáticamente cuando conexión esté activa
-            logger.info(f"✅ Conexión activa, emitiendo credencial: {connection_id}")
-            # En background para no bloquear webhook
-            asyncio.create_task(issue_credential_background(connection_id))
+            # La conexión ya está lista: emitir sin esperas fijas, fuera del webhook
+            if issuance_scheduler.schedule(connection_id):
+                logger.info(f"✅ Conexión activa, emisión programada: {connection_id}")
+    
+    return {"status": "received"}
+
+@app.post("/webhooks/out_of_band")
+async def webhook_out_of_band(data: dict):
+    """Webhook para eventos out-of-band: asocia el oob_id con la conexión creada"""
+    oob_id = data.get("oob_id")
+    connection_id = data.get("connection_id")
+    
+    logger.info(f"🔔 Webhook out-of-band [{oob_id}]: {data.get('state', 'unknown')}")
+    
+    if oob_id and connection_id:
+        await invitation_index.link(connection_id, oob_id=oob_id, invi_msg_id=data.get("invi_msg_id"))
     
     return {"status": "received"}
 
@@ -409,54 +826,168 @@ async def webhook_issue_credential(data: dict):
     
     return {"status": "received"}
 
+@app.post("/webhooks/credential_definitions")
+async def webhook_credential_definitions(data: dict):
+    """Webhook para eventos de Credential Definition (actualiza el registro)"""
+    cred_def_id = data.get("credential_definition_id") or data.get("cred_def_id")
+    state = data.get("state", "unknown")
+    
+    logger.info(f"🔐 Webhook cred def [{cred_def_id}]: {state}")
+    
+    if cred_def_id:
+        tag = parse_cred_def_tag(cred_def_id)
+        if state in ("deleted", "revoked", "invalid"):
+            await cred_def_registry.invalidate(cred_def_id)
+        elif tag == CREDENTIAL_DEFINITION_TAG:
+            await cred_def_registry.register(
+                CREDENTIAL_SCHEMA_NAME,
+                CREDENTIAL_SCHEMA_VERSION,
+                tag,
+                cred_def_id,
+                schema_id=data.get("schema_id")
+            )
+    
+    return {"status": "received"}
+
+# ANCLAJE EN FABRIC
+
+@app.get("/api/fabric/anchors/{asset_id}")
+async def get_anchor_receipt(asset_id: str):
+    """Estado de anclaje de una credencial: lote, raíz de Merkle y prueba de inclusión"""
+    if not fabric_client or fabric_client.anchor_queue is None:
+        raise HTTPException(status_code=404, detail="Anclaje por lotes no habilitado")
+    
+    receipt = await fabric_client.anchor_queue.get_receipt(asset_id)
+    if receipt is None:
+        raise HTTPException(status_code=404, detail="Credencial no encontrada en la cola de anclaje")
+    return receipt
+
+class AnchorProofRequest(BaseModel):
+    """Prueba de inclusión a verificar contra una raíz anclada"""
+    credential_hash: str = Field(..., min_length=64, max_length=64, description="SHA-256 (hex) de la credencial")
+    merkle_root: str = Field(..., min_length=64, max_length=64, description="Raíz de Merkle del lote")
+    proof: List[Dict[str, str]] = Field(..., description="Hermanos desde la hoja hasta la raíz")
+
+@app.post("/api/fabric/verify-proof")
+async def verify_anchor_proof(proof_request: AnchorProofRequest):
+    """Verificar una prueba de inclusión localmente, sin consultar el ledger"""
+    if not fabric_client or fabric_client.anchor_queue is None:
+        raise HTTPException(status_code=404, detail="Anclaje por lotes no habilitado")
+    
+    return await fabric_client.anchor_queue.verify(
+        proof_request.credential_hash,
+        proof_request.proof,
+        proof_request.merkle_root
+    )
+
+@app.get("/api/fabric/verify-hash/{credential_hash}")
+async def verify_anchor_hash(credential_hash: str):
+    """Verificar por hash usando la prueba almacenada de la credencial"""
+    if not fabric_client or fabric_client.anchor_queue is None:
+        raise HTTPException(status_code=404, detail="Anclaje por lotes no habilitado")
+    
+    result = await fabric_client.anchor_queue.verify_credential_hash(credential_hash)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Hash de credencial no encontrado")
+    return result
+
+@app.get("/api/admin/fabric/audit", dependencies=[Depends(require_admin)])
+async def find_fabric_audit_records(transaction_id: Optional[str] = None, asset_id: Optional[str] = None):
+    """Buscar registros del log de auditoría Fabric por transaction_id o asset_id"""
+    if not transaction_id and not asset_id:
+        raise HTTPException(status_code=400, detail="Indique transaction_id o asset_id")
+    records = await audit_log.find(transaction_id=transaction_id, asset_id=asset_id)
+    return {"count": len(records), "records": records}
+
+@app.post("/api/admin/fabric/audit/replay", dependencies=[Depends(require_admin)])
+async def replay_fabric_audit_log(limit: Optional[int] = None, concurrency: Optional[int] = None):
+    """Reenviar a Fabric en bloque las transacciones registradas mientras el ledger estaba caído"""
+    if not fabric_client:
+        raise HTTPException(status_code=503, detail="Cliente Fabric no inicializado")
+    return await fabric_client.replay_audit_log(concurrency=concurrency, limit=limit)
+
+# ADMINISTRACIÓN DEL REGISTRO DE CREDENTIAL DEFINITIONS
+
+@app.get("/api/admin/credential-definitions", dependencies=[Depends(require_admin)])
+async def list_credential_definitions(
+    schema_name: Optional[str] = None,
+    schema_version: Optional[str] = None,
+    tag: Optional[str] = None
+):
+    """Consultar el registro de cred defs (filtrable por schema name/version/tag)"""
+    entries = [
+        e for e in cred_def_registry.list()
+        if (not schema_name or e.get("schema_name") == schema_name)
+        and (not schema_version or e.get("schema_version") == schema_version)
+        and (not tag or e.get("tag") == tag)
+    ]
+    return {"credential_definitions": entries}
+
+@app.post("/api/admin/credential-definitions/invalidate", dependencies=[Depends(require_admin)])
+async def invalidate_credential_definitions(cred_def_id: Optional[str] = None):
+    """Invalidar el registro; la próxima emisión volverá a resolver contra ACA-Py"""
+    removed = await cred_def_registry.invalidate(cred_def_id)
+    return {"status": "invalidated", "removed": removed}
+
 # FUNCIONES AUXILIARES
 
 async def store_pending_credential(connection_id: str, credential_data: StudentCredentialRequest):
-    """Almacenar datos de credencial pendiente (En producción: BD)"""
-    # Por ahora usar archivo temporal (EN PRODUCCIÓN USAR BASE DE DATOS)
-    import tempfile
-    temp_file = f"/tmp/pending_credential_{connection_id}.json"
-    with open(temp_file, 'w') as f:
-        json.dump(credential_data.dict(), f)
+    """Almacenar datos de credencial pendiente en el store compartido"""
+    await pending_store.put(
+        PENDING_DIDCOMM_NAMESPACE,
+        connection_id,
+        credential_data.dict(),
+        ttl=PENDING_CREDENTIAL_TTL
+    )
+
+async def resolve_pending_key(connection_id: str) -> str:
+    """
+    oob_id bajo el que están los datos pendientes de una conexión DIDComm
+    Índice en O(1); si la conexión aún no está correlacionada (webhook perdido)
+    se consulta una vez a ACA-Py por su invitation_msg_id
+    """
+    oob_id = await invitation_index.oob_for_connection(connection_id)
+    if oob_id:
+        return oob_id
+    
+    try:
+        response = await acapy_client.get(f"/connections/{connection_id}", label="/connections/{connection_id}")
+        if response.status_code == 200:
+            invi_msg_id = response.json().get("invitation_msg_id")
+            oob_id = await invitation_index.link(connection_id, invi_msg_id=invi_msg_id)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo consultar la conexión {connection_id} en ACA-Py: {e}")
+    
+    # Sin correlación: el id recibido puede ser directamente el oob_id (emisión manual)
+    return oob_id or connection_id
 
 async def get_pending_credential(connection_id: str) -> Optional[Dict[str, Any]]:
     """Obtener datos de credencial pendiente"""
-    try:
-        temp_file = f"/tmp/pending_credential_{connection_id}.json"
-        with open(temp_file, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return None
+    return await pending_store.get(PENDING_DIDCOMM_NAMESPACE, connection_id)
 
 async def clear_pending_credential(connection_id: str):
     """Limpiar datos de credencial pendiente"""
     try:
-        import os
-        temp_file = f"/tmp/pending_credential_{connection_id}.json"
-        os.remove(temp_file)
-    except:
-        pass
+        await pending_store.delete(PENDING_DIDCOMM_NAMESPACE, connection_id)
+    except Exception as e:
+        logger.warning(f"⚠️ Error limpiando credencial pendiente: {e}")
 
 async def get_credential_definition_id() -> Optional[str]:
-    """Obtener ID de Credential Definition"""
+    """Obtener ID de Credential Definition desde el registro (ACA-Py solo si falta)"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{ACAPY_ADMIN_URL}/credential-definitions/created")
-            if response.status_code == 200:
-                cred_defs = response.json()
-                if cred_defs.get("credential_definition_ids"):
-                    return cred_defs["credential_definition_ids"][0]
-        return None
-    except:
+        return await cred_def_registry.resolve(
+            acapy_client,
+            CREDENTIAL_SCHEMA_NAME,
+            CREDENTIAL_SCHEMA_VERSION,
+            CREDENTIAL_DEFINITION_TAG
+        )
+    except Exception as e:
+        logger.error(f"❌ Error resolviendo Credential Definition: {e}")
         return None
 
-async def issue_credential_background(connection_id: str):
-    """Emitir credencial en background"""
-    try:
-        await asyncio.sleep(2)  # Esperar un poco para que conexión se estabilice
-        await issue_credential(connection_id, None)
-    except Exception as e:
-        logger.error(f"Error en emisión background: {e}")
+async def issue_pending_credential(connection_id: str):
+    """Emitir la credencial pendiente de una conexión (issuance_scheduler)"""
+    return await issue_credential(connection_id, None)
 
 # ENDPOINT COMPATIBILIDAD MOODLE (mantener API anterior)
 
@@ -476,13 +1007,14 @@ async def legacy_credential_endpoint(data: dict):
             instructor_name=data.get("instructor", "Instructor")
         )
         
-        result = await request_credential(credential_request)
+        result = await process_credential_request(credential_request)
         
         # Formato compatible
         return {
             "success": True,
             "message": "Credencial procesada exitosamente",
             "qr_code": result.qr_code_base64,
+            "qr_image_url": result.qr_image_url,
             "invitation_url": result.invitation_url,
             "connection_id": result.connection_id
         }
@@ -496,18 +1028,36 @@ async def legacy_credential_endpoint(data: dict):
 
 # ==================== ENDPOINT PARA MOSTRAR QR ====================
 
+# Registrada antes que /qr/{connection_id}: "abc.png" no debe caer en la página HTML
+@app.get("/qr/{connection_id}.{fmt}")
+async def get_qr_image(connection_id: str, fmt: str, request: Request):
+    """Imagen del QR DIDComm (.png, .svg o .json con la matriz de módulos)"""
+    if fmt not in QR_RENDERERS:
+        raise HTTPException(status_code=404, detail=f"Formato no soportado: {fmt}")
+    qr_data = qr_cache.get(f"didcomm:{connection_id}")
+    if qr_data is None:
+        raise HTTPException(status_code=404, detail="QR Code no encontrado o expirado")
+    return await qr_renderer.image_response(request, qr_data["invitation_url"], fmt)
+
+@app.get("/qr/{connection_id}/image")
+async def get_qr_image_negotiated(connection_id: str, request: Request):
+    """Imagen del QR DIDComm con formato elegido por la cabecera Accept"""
+    qr_data = qr_cache.get(f"didcomm:{connection_id}")
+    if qr_data is None:
+        raise HTTPException(status_code=404, detail="QR Code no encontrado o expirado")
+    return await qr_renderer.image_response(request, qr_data["invitation_url"])
+
 @app.get("/qr/{connection_id}", response_class=HTMLResponse)
 async def show_qr_page(connection_id: str):
     """
     Mostrar página HTML con QR Code escaneables para conexión DIDComm
     """
     try:
-        # Buscar QR en storage temporal
-        if connection_id not in qr_storage:
+        # Buscar QR en caché compartido
+        qr_data = qr_cache.get(f"didcomm:{connection_id}")
+        if qr_data is None:
             raise HTTPException(status_code=404, detail="QR Code no encontrado o expirado")
         
-        qr_data = qr_storage[connection_id]
-        
         # Página HTML simple con QR
         html_content = f"""
         <!DOCTYPE html>
@@ -634,7 +1184,7 @@ async def show_qr_page(connection_id: str):
                 </div>
                 
                 <div class="qr-container">
-                    <img src="{qr_data['qr_code_base64']}" 
+                    <img src="/qr/{connection_id}.svg" 
                          alt="QR Code para Wallet" 
                          class="qr-code">
                 </div>
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Audit Log - Registro de auditoría de transacciones Fabric no enviadas al ledger
+Reemplaza el append síncrono a /tmp/fabric_transactions.log por un writer asíncrono:
+
+- Buffer en memoria drenado por una única tarea; cada lote se escribe y se hace un
+  solo fsync (group commit) para todos los registros que llegaron mientras tanto
+- Segmentos JSONL rotados por tamaño o antigüedad; al sellar un segmento se guarda
+  su índice transaction_id/asset_id → offsets para búsquedas sin recorrer el archivo
+- Replay: reenvía a Fabric los registros "logged_for_processing" cuando el ledger vuelve
+
+Uso por línea de comandos:
+    python audit_log.py find --transaction-id audit_...
+    python audit_log.py pending
+    python audit_log.py replay --concurrency 8
+"""
+
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+import logging
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración del log de auditoría
+FABRIC_AUDIT_LOG_DIR = os.getenv("FABRIC_AUDIT_LOG_DIR", "/var/lib/controller/fabric_audit")
+FABRIC_AUDIT_SEGMENT_MAX_BYTES = int(os.getenv("FABRIC_AUDIT_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024)))
+FABRIC_AUDIT_SEGMENT_MAX_AGE = float(os.getenv("FABRIC_AUDIT_SEGMENT_MAX_AGE", "86400"))
+FABRIC_AUDIT_REPLAY_CONCURRENCY = int(os.getenv("FABRIC_AUDIT_REPLAY_CONCURRENCY", "8"))
+
+# Eventos y estados de los registros
+EVENT_TRANSACTION = "fabric_transaction"
+EVENT_REPLAYED = "fabric_transaction_replayed"
+STATUS_LOGGED = "logged_for_processing"
+STATUS_REPLAYED = "replayed"
+
+SEGMENT_PREFIX = "fabric-audit-"
+INDEX_KEYS = ("transaction_id", "asset_id")
+
+# Reenvío de un asset a Fabric → transaction_id real, o None si el ledger sigue caído
+SubmitAsset = Callable[[Dict[str, Any]], Awaitable[Optional[str]]]
+OnReplayed = Callable[[Dict[str, Any], str], Awaitable[None]]
+
+
+def _empty_index() -> Dict[str, Dict[str, List[int]]]:
+    return {key: {} for key in INDEX_KEYS}
+
+
+def _index_record(index: Dict[str, Dict[str, List[int]]], record: Dict[str, Any], offset: int):
+    for key in INDEX_KEYS:
+        value = record.get(key)
+        if value:
+            index[key].setdefault(str(value), []).append(offset)
+
+
+class AuditLog:
+    """Log de auditoría segmentado con escritura asíncrona agrupada e índice por segmento"""
+
+    def __init__(
+        self,
+        directory: str = FABRIC_AUDIT_LOG_DIR,
+        segment_max_bytes: int = FABRIC_AUDIT_SEGMENT_MAX_BYTES,
+        segment_max_age: float = FABRIC_AUDIT_SEGMENT_MAX_AGE,
+    ):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+
+        # Estado de archivos: protegido por _io_lock (escritura y lecturas corren en hilos)
+        self._io_lock = threading.Lock()
+        self._opened = False
+        self._indexes: Dict[int, Dict[str, Dict[str, List[int]]]] = {}
+        self._active_number = 0
+        self._active_file = None
+        self._active_size = 0
+        self._active_opened_at = 0.0
+
+        # Buffer de registros pendientes de escribir: (registro, future que se resuelve tras fsync)
+        self._buffer: List[Any] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._writer_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._written = 0
+        self._fsyncs = 0
+
+    # -------------------------------------------------------------- segmentos
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:08d}.jsonl")
+
+    def _index_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:08d}.idx.json")
+
+    def _open_sync(self):
+        """Cargar índices de segmentos sellados y reabrir (o crear) el segmento activo"""
+        if self._opened:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        numbers = sorted(
+            int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(".jsonl")])
+            for path in glob.glob(os.path.join(self.directory, f"{SEGMENT_PREFIX}*.jsonl"))
+        )
+        for number in numbers:
+            index_path = self._index_path(number)
+            if os.path.exists(index_path):
+                with open(index_path, "r", encoding="utf-8") as f:
+                    self._indexes[number] = json.load(f)
+            else:
+                # Segmento sin sellar (activo o proceso interrumpido): reconstruir índice
+                self._indexes[number] = self._scan_index_sync(number)
+
+        unsealed = [n for n in numbers if not os.path.exists(self._index_path(n))]
+        if unsealed:
+            self._active_number = unsealed[-1]
+            # Sellar segmentos huérfanos anteriores al activo
+            for number in unsealed[:-1]:
+                self._write_index_sync(number)
+        else:
+            self._active_number = (numbers[-1] + 1) if numbers else 1
+            self._indexes[self._active_number] = _empty_index()
+
+        self._open_active_sync()
+        self._opened = True
+        logger.info(f"📂 Log de auditoría Fabric: {len(self._indexes)} segmentos en {self.directory}")
+
+    def _open_active_sync(self):
+        path = self._segment_path(self._active_number)
+        self._active_file = open(path, "ab")
+        self._active_size = self._active_file.tell()
+        self._active_opened_at = time.time()
+
+    def _scan_index_sync(self, number: int) -> Dict[str, Dict[str, List[int]]]:
+        index = _empty_index()
+        with open(self._segment_path(number), "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    _index_record(index, json.loads(line), offset)
+                except ValueError:
+                    logger.warning(f"⚠️ Línea corrupta en segmento {number} (offset {offset})")
+                offset += len(line)
+        return index
+
+    def _write_index_sync(self, number: int):
+        tmp_path = f"{self._index_path(number)}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._indexes[number], f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._index_path(number))
+
+    def _rotate_sync(self):
+        """Sellar el segmento activo (índice persistido) y abrir el siguiente"""
+        self._active_file.close()
+        self._write_index_sync(self._active_number)
+        logger.info(f"🔄 Segmento de auditoría {self._active_number} sellado ({self._active_size} bytes)")
+        self._active_number += 1
+        self._indexes[self._active_number] = _empty_index()
+        self._open_active_sync()
+        metrics.increment("fabric_audit_rotations")
+
+    def _should_rotate(self) -> bool:
+        if self._active_size == 0:
+            return False
+        return (
+            self._active_size >= self.segment_max_bytes
+            or time.time() - self._active_opened_at >= self.segment_max_age
+        )
+
+    # ---------------------------------------------------------------- escritura
+
+    def _write_batch_sync(self, records: List[Dict[str, Any]]):
+        """Escribir un lote de registros con un único fsync"""
+        with self._io_lock:
+            self._open_sync()
+            if self._should_rotate():
+                self._rotate_sync()
+
+            chunks = []
+            offsets = []
+            offset = self._active_size
+            for record in records:
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+                chunks.append(line)
+                offsets.append(offset)
+                offset += len(line)
+
+            self._active_file.write(b"".join(chunks))
+            self._active_file.flush()
+            os.fsync(self._active_file.fileno())
+            self._active_size = offset
+
+            # Indexar solo lo que ya quedó en disco
+            index = self._indexes[self._active_number]
+            for record, record_offset in zip(records, offsets):
+                _index_record(index, record, record_offset)
+
+    async def append(self, record: Dict[str, Any]) -> None:
+        """Encolar un registro y esperar a que quede en disco (fsync compartido con el lote)"""
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((record, future))
+        self._ensure_writer()
+        self._wakeup.set()
+        await future
+
+    def _ensure_writer(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def _writer_loop(self):
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self._drain()
+
+    async def _drain(self):
+        while self._buffer:
+            batch, self._buffer = self._buffer, []
+            records = [record for record, _ in batch]
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write_batch_sync, records)
+            except Exception as e:
+                logger.error(f"❌ Error escribiendo log de auditoría: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._written += len(records)
+            self._fsyncs += 1
+            metrics.observe("fabric_audit_group_commit", time.perf_counter() - start)
+            metrics.increment("fabric_audit_records", len(records))
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    async def close(self):
+        """Escribir lo pendiente y cerrar el segmento activo (evento shutdown)"""
+        if self._writer_task:
+            # Sin cancelar: el lote que está en fsync debe resolver sus futures
+            self._closing = True
+            self._wakeup.set()
+            await self._writer_task
+            self._writer_task = None
+        await self._drain()
+        await asyncio.to_thread(self._close_sync)
+        self._closing = False
+
+    def _close_sync(self):
+        with self._io_lock:
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+            self._opened = False
+            self._indexes = {}
+
+    # ----------------------------------------------------------------- lectura
+
+    async def find(
+        self,
+        transaction_id: Optional[str] = None,
+        asset_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Registros de una transacción o asset, en orden de escritura, usando los índices"""
+        if transaction_id:
+            return await asyncio.to_thread(self._find_sync, "transaction_id", transaction_id)
+        if asset_id:
+            return await asyncio.to_thread(self._find_sync, "asset_id", asset_id)
+        return []
+
+    def _find_sync(self, key: str, value: str) -> List[Dict[str, Any]]:
+        results = []
+        with self._io_lock:
+            self._open_sync()
+            for number in sorted(self._indexes):
+                offsets = self._indexes[number][key].get(value)
+                if not offsets:
+                    continue
+                with open(self._segment_path(number), "rb") as f:
+                    for offset in offsets:
+                        f.seek(offset)
+                        results.append(json.loads(f.readline()))
+        return results
+
+    async def pending_records(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Registros "logged_for_processing" que aún no fueron reenviados a Fabric"""
+        return await asyncio.to_thread(self._pending_sync, limit)
+
+    def _pending_sync(self, limit: Optional[int]) -> List[Dict[str, Any]]:
+        pending: Dict[str, Dict[str, Any]] = {}
+        with self._io_lock:
+            self._open_sync()
+            numbers = sorted(self._indexes)
+        for number in numbers:
+            with open(self._segment_path(number), "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    event = record.get("event")
+                    if event == EVENT_TRANSACTION and record.get("status") == STATUS_LOGGED:
+                        pending[record["transaction_id"]] = record
+                    elif event == EVENT_REPLAYED:
+                        pending.pop(record.get("transaction_id"), None)
+        records = list(pending.values())
+        return records[:limit] if limit else records
+
+    # ------------------------------------------------------------------ replay
+
+    async def replay(
+        self,
+        submit: SubmitAsset,
+        concurrency: int = FABRIC_AUDIT_REPLAY_CONCURRENCY,
+        limit: Optional[int] = None,
+        on_replayed: Optional[OnReplayed] = None,
+    ) -> Dict[str, Any]:
+        """
+        Reenviar en bloque los registros pendientes con concurrencia acotada
+        Cada reenvío exitoso agrega un registro "replayed" (el log es append-only)
+        """
+        records = await self.pending_records(limit)
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        summary = {"pending": len(records), "replayed": 0, "failed": 0, "transactions": []}
+
+        async def replay_one(record: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    fabric_transaction_id = await submit(record["asset_data"])
+                except Exception as e:
+                    logger.warning(f"⚠️ Replay de {record['transaction_id']} falló: {e}")
+                    fabric_transaction_id = None
+
+                if not fabric_transaction_id:
+                    summary["failed"] += 1
+                    return
+
+                # Antes de marcarlo "replayed": si falla, el registro sigue pendiente
+                if on_replayed is not None:
+                    try:
+                        await on_replayed(record, fabric_transaction_id)
+                    except Exception as e:
+                        logger.error(f"❌ Replay de {record['transaction_id']} sin confirmar: {e}")
+                        summary["failed"] += 1
+                        return
+
+                await self.append({
+                    "event": EVENT_REPLAYED,
+                    "transaction_id": record["transaction_id"],
+                    "asset_id": record.get("asset_id"),
+                    "fabric_transaction_id": fabric_transaction_id,
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "status": STATUS_REPLAYED,
+                })
+                summary["replayed"] += 1
+                summary["transactions"].append({
+                    "transaction_id": record["transaction_id"],
+                    "fabric_transaction_id": fabric_transaction_id,
+                })
+
+        await asyncio.gather(*(replay_one(record) for record in records))
+        metrics.increment("fabric_audit_replayed", summary["replayed"])
+        logger.info(
+            f"🔁 Replay de auditoría: {summary['replayed']}/{summary['pending']} reenviados, "
+            f"{summary['failed']} fallidos"
+        )
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "segments": len(self._indexes),
+            "active_segment": self._active_number,
+            "active_segment_bytes": self._active_size,
+            "buffered": len(self._buffer),
+            "records_written": self._written,
+            "group_commits": self._fsyncs,
+        }
+
+
+# Instancia compartida del Controller
+audit_log = AuditLog()
+
+
+async def _main(argv: Optional[List[str]] = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Log de auditoría de transacciones Fabric")
+    sub = parser.add_subparsers(dest="command", required=True)
+    find_parser = sub.add_parser("find", help="Buscar registros por transaction_id o asset_id")
+    find_parser.add_argument("--transaction-id")
+    find_parser.add_argument("--asset-id")
+    sub.add_parser("pending", help="Listar registros pendientes de reenvío")
+    replay_parser = sub.add_parser("replay", help="Reenviar a Fabric los registros pendientes")
+    replay_parser.add_argument("--concurrency", type=int, default=FABRIC_AUDIT_REPLAY_CONCURRENCY)
+    replay_parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "find":
+            result = await audit_log.find(args.transaction_id, args.asset_id)
+        elif args.command == "pending":
+            result = await audit_log.pending_records()
+        else:
+            from fabric_client import AsyncFabricClient, FABRIC_ANCHOR_MODE
+            from anchor_queue import AnchorQueue
+
+            client = AsyncFabricClient()
+            await client.initialize()
+            # Misma cola que el Controller (sin worker): los lotes reenviados pasan a anclados
+            if FABRIC_ANCHOR_MODE == "batched":
+                client.anchor_queue = AnchorQueue(submit_batch=client.anchor_batch_root)
+            try:
+                result = await client.replay_audit_log(concurrency=args.concurrency, limit=args.limit)
+            finally:
+                if client.anchor_queue is not None:
+                    client.anchor_queue.close()
+                await client.disconnect()
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    finally:
+        await audit_log.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
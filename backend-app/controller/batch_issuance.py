@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Batch Issuance - Emisión por cohortes (cierre de cursos desde Moodle)
+Un trabajo recibe cientos de finalizaciones: ancla la cohorte completa en un paso
+mientras crea invitaciones/offers por estudiante con concurrencia acotada.
+Los resultados por estudiante se publican a medida que terminan y pueden
+leerse en streaming (NDJSON) mientras el trabajo sigue en curso; los recibos
+de anclaje llegan después, como líneas de seguimiento {"event": "anchor"} por ítem
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional
+import logging
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la emisión por lotes
+BATCH_ISSUANCE_CONCURRENCY = int(os.getenv("BATCH_ISSUANCE_CONCURRENCY", "16"))
+BATCH_ISSUANCE_MAX_ITEMS = int(os.getenv("BATCH_ISSUANCE_MAX_ITEMS", "2000"))
+# Tiempo que se conservan los trabajos terminados para consultar resultados
+BATCH_JOB_TTL = int(os.getenv("BATCH_JOB_TTL", "3600"))
+
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+# Líneas de seguimiento con el recibo de anclaje de cada ítem
+EVENT_ANCHOR = "anchor"
+
+# (índice, ítem) → resultado del estudiante (invitación/offer)
+IssueOne = Callable[[int, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+# Cohorte completa → un recibo de anclaje por ítem, en el mismo orden
+AnchorAll = Callable[[List[Dict[str, Any]]], Awaitable[List[Dict[str, Any]]]]
+
+
+class BatchJob:
+    """Estado de un trabajo de emisión y sus resultados en orden de finalización"""
+
+    def __init__(self, total: int):
+        self.job_id = uuid.uuid4().hex
+        self.total = total
+        self.status = JOB_RUNNING
+        self.results: List[Dict[str, Any]] = []
+        self.succeeded = 0
+        self.failed = 0
+        self.anchor: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status != JOB_RUNNING
+
+    async def _publish(self, result: Dict[str, Any]):
+        async with self._changed:
+            self.results.append(result)
+            if result.get("status") == "failed":
+                self.failed += 1
+            else:
+                self.succeeded += 1
+            self._changed.notify_all()
+
+    async def _publish_anchor(self, items: List[Dict[str, Any]], receipts: List[Dict[str, Any]]):
+        """Recibos de anclaje de la cohorte, uno por ítem, tras los resultados ya publicados"""
+        async with self._changed:
+            for index, (item, receipt) in enumerate(zip(items, receipts)):
+                self.results.append({
+                    "event": EVENT_ANCHOR,
+                    "index": index,
+                    "student_id": item.get("student_id"),
+                    "course_id": item.get("course_id"),
+                    "fabric": receipt,
+                })
+            self._changed.notify_all()
+
+    async def _finish(self, status: str, error: Optional[str] = None):
+        async with self._changed:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self._changed.notify_all()
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Líneas NDJSON: resultados ya publicados y luego los nuevos hasta terminar"""
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.results) > sent or self.done)
+                pending = self.results[sent:]
+                finished = self.done
+            for result in pending:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            sent += len(pending)
+            if finished and sent == len(self.results):
+                yield json.dumps({"job": self.summary()}, ensure_ascii=False) + "\n"
+                return
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.created_at
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total": self.total,
+            "completed": self.succeeded + self.failed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "anchor": self.anchor,
+            "error": self.error,
+            "elapsed_seconds": round(elapsed, 3),
+        }
+
+
+class BatchIssuanceService:
+    """Ejecuta trabajos de cohorte en segundo plano y los conserva un tiempo para consulta"""
+
+    def __init__(
+        self,
+        concurrency: int = BATCH_ISSUANCE_CONCURRENCY,
+        max_items: int = BATCH_ISSUANCE_MAX_ITEMS,
+        job_ttl: int = BATCH_JOB_TTL,
+    ):
+        self.concurrency = concurrency
+        self.max_items = max_items
+        self.job_ttl = job_ttl
+        self._jobs: Dict[str, BatchJob] = {}
+
+    def submit(
+        self,
+        items: List[Dict[str, Any]],
+        issue_one: IssueOne,
+        anchor_all: Optional[AnchorAll] = None,
+    ) -> BatchJob:
+        """Crear el trabajo y lanzarlo; retorna de inmediato con el job_id"""
+        self._purge_expired()
+        job = BatchJob(total=len(items))
+        self._jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job, items, issue_one, anchor_all))
+        metrics.increment("batch_issuance_jobs")
+        logger.info(f"📚 Trabajo de emisión {job.job_id}: {len(items)} credenciales")
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(job_id)
+
+    async def _run(
+        self,
+        job: BatchJob,
+        items: List[Dict[str, Any]],
+        issue_one: IssueOne,
+        anchor_all: Optional[AnchorAll],
+    ):
+        # El anclaje de toda la cohorte corre en paralelo con las invitaciones, que se
+        # publican sin esperarlo; sus recibos llegan luego como líneas de seguimiento
+        anchor_task = asyncio.create_task(anchor_all(items)) if anchor_all else None
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending_anchor = {"status": "pending"} if anchor_task is not None else None
+
+        async def run_one(index: int, item: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    with metrics.timer("batch_issuance_item"):
+                        result = await issue_one(index, item)
+                except Exception as e:
+                    result = {
+                        "index": index,
+                        "student_id": item.get("student_id"),
+                        "course_id": item.get("course_id"),
+                        "status": "failed",
+                        "error": str(e),
+                    }
+            result["fabric"] = pending_anchor
+            await job._publish(result)
+
+        try:
+            with metrics.timer("batch_issuance_job"):
+                await asyncio.gather(*(run_one(i, item) for i, item in enumerate(items)))
+                if anchor_task is not None:
+                    try:
+                        receipts = await anchor_task
+                    except Exception as e:
+                        # Las invitaciones ya se emitieron; el anclaje queda para el audit log/reintento
+                        job.anchor = {"error": str(e)}
+                        await job._publish_anchor(items, [{"success": False, "error": str(e)}] * len(items))
+                    else:
+                        roots = sorted({r.get("merkle_root") for r in receipts if r.get("merkle_root")})
+                        job.anchor = {"credentials": len(receipts), "merkle_roots": roots}
+                        await job._publish_anchor(items, receipts)
+            await job._finish(JOB_COMPLETED)
+            logger.info(
+                f"✅ Trabajo {job.job_id} terminado: {job.succeeded} emitidas, {job.failed} fallidas "
+                f"en {job.summary()['elapsed_seconds']}s"
+            )
+        except asyncio.CancelledError:
+            await job._finish(JOB_FAILED, "Trabajo cancelado")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Trabajo de emisión {job.job_id} falló: {e}")
+            await job._finish(JOB_FAILED, str(e))
+        finally:
+            # Cancelación (shutdown) o fallo: no dejar el anclaje de la cohorte huérfano
+            if anchor_task is not None and not anchor_task.done():
+                anchor_task.cancel()
+                await asyncio.gather(anchor_task, return_exceptions=True)
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.done and now - job.finished_at > self.job_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def close(self):
+        """Cancelar trabajos en curso y su anclaje de cohorte (evento shutdown)"""
+        running = [job.task for job in self._jobs.values() if job.task and not job.task.done()]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "jobs": len(self._jobs),
+            "running": sum(1 for job in self._jobs.values() if not job.done),
+            "concurrency": self.concurrency,
+            "max_items": self.max_items,
+        }
+
+
+# Instancia compartida del Controller
+batch_issuance = BatchIssuanceService()
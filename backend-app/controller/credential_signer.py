@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Credential Signer - Firma y verificación ES256 con claves ya parseadas
+PyJWT vuelve a parsear el PEM en cada jwt.encode/jwt.decode si recibe una cadena;
+este componente carga las claves una sola vez como objetos de ``cryptography``
+y mide la latencia de firma y verificación
+
+Keyring: varias claves (una activa para firmar, las retiradas solo para verificar)
+identificadas por ``kid`` = thumbprint JWK (RFC 7638). Cada token lleva el ``kid``
+en la cabecera y la verificación usa el índice kid → clave pública en memoria.
+El JWKS se precalcula una vez por cambio del keyring y se sirve con ETag.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+import logging
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Directorio del keyring y de la clave ES256 semilla (volumen persistente del Controller:
+# las claves rotadas y retiradas deben sobrevivir a la recreación del contenedor)
+OPENID_KEYRING_DIR = os.getenv("OPENID_KEYRING_DIR", "/var/lib/controller/openid4vc_keys")
+# Ubicación anterior de la clave semilla (fuera de cualquier volumen), solo para migrarla
+LEGACY_OPENID_KEY_DIR = "/var/lib/openid4vc/keys"
+KEYRING_MANIFEST = "keyring.json"
+
+# Cabeceras distintas (kid/typ) recordadas por el signer para resolver la clave de verificación
+VERIFY_KEY_CACHE_MAX_ENTRIES = 256
+
+KEY_STATUS_ACTIVE = "active"
+KEY_STATUS_RETIRED = "retired"
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def public_jwk(public_key) -> Dict[str, str]:
+    """Miembros requeridos de un JWK EC P-256 (sin kid/use/alg)"""
+    numbers = public_key.public_numbers()
+    return {
+        "crv": "P-256",
+        "kty": "EC",
+        "x": _b64url(numbers.x.to_bytes(32, "big")),
+        "y": _b64url(numbers.y.to_bytes(32, "big")),
+    }
+
+
+def jwk_thumbprint(jwk: Dict[str, str]) -> str:
+    """Thumbprint RFC 7638: SHA-256 del JSON canónico de los miembros requeridos"""
+    canonical = json.dumps(
+        {k: jwk[k] for k in ("crv", "kty", "x", "y")},
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+    return _b64url(hashlib.sha256(canonical.encode("utf-8")).digest())
+
+
+class SigningKey:
+    """Par de claves ES256 con su kid y JWK público precalculados"""
+
+    def __init__(
+        self,
+        private_key,
+        status: str = KEY_STATUS_ACTIVE,
+        created_at: Optional[str] = None,
+        retired_at: Optional[str] = None,
+    ):
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.status = status
+        self.created_at = created_at or datetime.utcnow().isoformat()
+        self.retired_at = retired_at
+
+        jwk = public_jwk(self.public_key)
+        self.kid = jwk_thumbprint(jwk)
+        self.jwk = {**jwk, "kid": self.kid, "use": "sig", "alg": "ES256"}
+
+    @classmethod
+    def generate(cls) -> "SigningKey":
+        return cls(ec.generate_private_key(ec.SECP256R1()))
+
+    def private_pem(self) -> bytes:
+        return self.private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "kid": self.kid,
+            "status": self.status,
+            "created_at": self.created_at,
+            "retired_at": self.retired_at,
+        }
+
+
+class Keyring:
+    """Claves de firma indexadas por kid; persistidas como {kid}.pem + keyring.json"""
+
+    def __init__(self, directory: Optional[str] = OPENID_KEYRING_DIR):
+        self.directory = directory
+        self._keys: Dict[str, SigningKey] = {}
+        self.active_kid: Optional[str] = None
+        # Clave de los tokens sin kid (firmados antes del keyring con la clave ES256 original)
+        self.legacy_kid: Optional[str] = None
+        self._manifest_mtime: Optional[float] = None
+        self._refresh_lock = threading.Lock()
+        self._jwks_body = b'{"keys":[]}'
+        self.jwks_etag = ""
+        # Se incrementa en cada cambio de claves (invalida las cachés de verificación)
+        self.version = 0
+
+    @classmethod
+    def from_pem(cls, private_key_pem: str) -> "Keyring":
+        """Keyring en memoria con una sola clave activa (sin persistencia)"""
+        keyring = cls(directory=None)
+        keyring._add(SigningKey(load_pem_private_key(private_key_pem.encode("utf-8"), password=None)))
+        keyring.legacy_kid = keyring.active_kid
+        keyring._rebuild_jwks()
+        return keyring
+
+    # -------------------------------------------------------------- persistencia
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, KEYRING_MANIFEST)
+
+    def load(self, seed_private_pem: Optional[str] = None):
+        """
+        Cargar el keyring del disco; si aún no existe, crearlo con ``seed_private_pem``
+        (la clave ES256 de despliegues anteriores) como clave activa
+        """
+        manifest_path = self._manifest_path()
+        if not os.path.exists(manifest_path):
+            seed = (
+                SigningKey(load_pem_private_key(seed_private_pem.encode("utf-8"), password=None))
+                if seed_private_pem
+                else SigningKey.generate()
+            )
+            self._keys = {}
+            self._add(seed)
+            self.legacy_kid = seed.kid
+            self._save()
+            logger.info(f"🔑 Keyring de firma creado con clave activa {seed.kid}")
+        else:
+            self._read_manifest()
+        self._rebuild_jwks()
+
+    def _read_manifest(self):
+        manifest_path = self._manifest_path()
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        keys: Dict[str, SigningKey] = {}
+        for entry in manifest.get("keys", []):
+            with open(os.path.join(self.directory, f"{entry['kid']}.pem"), "rb") as f:
+                key = SigningKey(
+                    load_pem_private_key(f.read(), password=None),
+                    status=entry.get("status", KEY_STATUS_RETIRED),
+                    created_at=entry.get("created_at"),
+                    retired_at=entry.get("retired_at"),
+                )
+            keys[key.kid] = key
+
+        self._keys = keys
+        self.active_kid = manifest.get("active")
+        # Manifests anteriores no registran la clave semilla: es la más antigua
+        self.legacy_kid = manifest.get("legacy") or min(
+            keys, key=lambda kid: keys[kid].created_at or "", default=None
+        )
+        self._manifest_mtime = os.path.getmtime(manifest_path)
+        logger.info(f"🔑 Keyring de firma cargado: {len(keys)} claves, activa {self.active_kid}")
+
+    def _save(self):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        for key in self._keys.values():
+            key_path = os.path.join(self.directory, f"{key.kid}.pem")
+            if not os.path.exists(key_path):
+                with open(key_path, "wb") as f:
+                    f.write(key.private_pem())
+                os.chmod(key_path, 0o600)
+
+        manifest = {
+            "active": self.active_kid,
+            "legacy": self.legacy_kid,
+            "keys": [key.describe() for key in self._keys.values()],
+        }
+        tmp_path = f"{self._manifest_path()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path())
+        self._manifest_mtime = os.path.getmtime(self._manifest_path())
+
+    def refresh(self) -> bool:
+        """Recargar si otro worker rotó el keyring (compara el mtime del manifest)"""
+        if self.directory is None:
+            return False
+        try:
+            mtime = os.path.getmtime(self._manifest_path())
+        except OSError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        with self._refresh_lock:
+            if os.path.getmtime(self._manifest_path()) == self._manifest_mtime:
+                return False
+            self._read_manifest()
+            self._rebuild_jwks()
+        return True
+
+    # ------------------------------------------------------------------ claves
+
+    def _add(self, key: SigningKey):
+        if self.active_kid and self.active_kid in self._keys:
+            previous = self._keys[self.active_kid]
+            previous.status = KEY_STATUS_RETIRED
+            previous.retired_at = datetime.utcnow().isoformat()
+        key.status = KEY_STATUS_ACTIVE
+        self._keys[key.kid] = key
+        self.active_kid = key.kid
+
+    @property
+    def active(self) -> SigningKey:
+        return self._keys[self.active_kid]
+
+    def get(self, kid: Optional[str]) -> Optional[SigningKey]:
+        return self._keys.get(kid) if kid else None
+
+    @property
+    def legacy(self) -> Optional[SigningKey]:
+        return self._keys.get(self.legacy_kid) if self.legacy_kid else None
+
+    def rotate(self) -> SigningKey:
+        """Generar una nueva clave activa; la anterior queda retirada (solo verificación)"""
+        key = SigningKey.generate()
+        self._add(key)
+        self._save()
+        self._rebuild_jwks()
+        metrics.increment("signing_key_rotations")
+        logger.info(f"🔄 Clave de firma rotada: activa {key.kid}")
+        return key
+
+    def remove(self, kid: str) -> bool:
+        """Eliminar una clave retirada (deja de aparecer en el JWKS)"""
+        key = self._keys.get(kid)
+        if key is None or kid == self.active_kid:
+            return False
+        del self._keys[kid]
+        if kid == self.legacy_kid:
+            self.legacy_kid = None
+        self._save()
+        if self.directory is not None:
+            try:
+                os.remove(os.path.join(self.directory, f"{kid}.pem"))
+            except OSError:
+                pass
+        self._rebuild_jwks()
+        logger.info(f"🗑️ Clave de firma eliminada: {kid}")
+        return True
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [key.describe() for key in self._keys.values()]
+
+    # -------------------------------------------------------------------- JWKS
+
+    def _rebuild_jwks(self):
+        self.version += 1
+        # Activa primero: algunos verificadores prueban las claves en orden
+        ordered = sorted(self._keys.values(), key=lambda k: k.kid != self.active_kid)
+        self._jwks_body = json.dumps({"keys": [key.jwk for key in ordered]}, separators=(",", ":")).encode("utf-8")
+        self.jwks_etag = f'"{hashlib.sha256(self._jwks_body).hexdigest()[:32]}"'
+
+    @property
+    def jwks_body(self) -> bytes:
+        """Documento JWKS serializado (precalculado)"""
+        return self._jwks_body
+
+
+class CredentialSigner:
+    """Firma tokens/VCs JWT con la clave activa (cabecera kid) y verifica por kid"""
+
+    def __init__(self, keyring: Keyring, algorithm: str = "ES256"):
+        self.keyring = keyring
+        self.algorithm = algorithm
+        # Segmento de cabecera del token → (versión del keyring, clave pública)
+        self._header_keys: Dict[str, tuple] = {}
+
+    @classmethod
+    def from_pem(cls, private_key_pem: str, public_key_pem: Optional[str] = None, algorithm: str = "ES256") -> "CredentialSigner":
+        """Signer de una sola clave en memoria (el PEM se parsea una única vez)"""
+        keyring = Keyring.from_pem(private_key_pem)
+        if public_key_pem:
+            public_key = load_pem_public_key(public_key_pem.encode("utf-8"))
+            if jwk_thumbprint(public_jwk(public_key)) != keyring.active_kid:
+                raise ValueError("La clave pública no corresponde a la clave privada")
+        return cls(keyring, algorithm)
+
+    @property
+    def public_key(self):
+        return self.keyring.active.public_key
+
+    def signing_key(self) -> SigningKey:
+        """Clave activa vigente: otro worker pudo rotar o eliminar claves (stat del manifest)"""
+        self.keyring.refresh()
+        return self.keyring.active
+
+    def sign(self, payload: Dict[str, Any], headers: Optional[Dict[str, Any]] = None) -> str:
+        """Firmar un payload como JWT compacto con la clave activa"""
+        key = self.signing_key()
+        with metrics.timer(f"jwt sign {self.algorithm}"):
+            return jwt.encode(
+                payload,
+                key.private_key,
+                algorithm=self.algorithm,
+                headers={**(headers or {}), "kid": key.kid},
+            )
+
+    def verification_key(self, token: str):
+        """
+        Clave pública según el kid del token (sin kid: clave semilla, tokens previos al keyring)
+        Todos los tokens de una misma clave comparten el segmento de cabecera: se resuelve una vez
+        """
+        # Una clave eliminada por otro worker deja de verificar también aquí
+        self.keyring.refresh()
+        header_segment = token.split(".", 1)[0]
+        cached = self._header_keys.get(header_segment)
+        if cached is not None and cached[0] == self.keyring.version:
+            return cached[1]
+
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            legacy = self.keyring.legacy
+            if legacy is None and self.keyring.refresh():
+                legacy = self.keyring.legacy
+            if legacy is None:
+                raise jwt.InvalidTokenError("Token sin kid y sin clave semilla en el keyring")
+            public_key = legacy.public_key
+        else:
+            key = self.keyring.get(kid)
+            if key is None and self.keyring.refresh():
+                key = self.keyring.get(kid)
+            if key is None:
+                raise jwt.InvalidTokenError(f"kid desconocido: {kid}")
+            public_key = key.public_key
+
+        if len(self._header_keys) >= VERIFY_KEY_CACHE_MAX_ENTRIES:
+            self._header_keys.clear()
+        self._header_keys[header_segment] = (self.keyring.version, public_key)
+        return public_key
+
+    def verify(self, token: str, **kwargs) -> Dict[str, Any]:
+        """
+        Verificar firma y claims; ``kwargs`` se pasan a ``jwt.decode`` (audience, issuer, options)
+        Propaga las excepciones de PyJWT (ExpiredSignatureError, InvalidTokenError)
+        """
+        with metrics.timer(f"jwt verify {self.algorithm}"):
+            try:
+                return jwt.decode(token, self.verification_key(token), algorithms=[self.algorithm], **kwargs)
+            except jwt.InvalidTokenError:
+                metrics.increment("jwt_verify_failures")
+                raise
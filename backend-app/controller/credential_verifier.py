@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Credential Verifier - Verificación local de VCs JWT emitidas por este issuer
+Firma (clave por kid del keyring, sin re-parsear PEM), expiración, revocación
+(bit de la lista StatusList2021 en memoria) y, opcionalmente, el anclaje en Fabric
+(índice local de lotes de Merkle, sin consultar el ledger por credencial).
+Los lotes se verifican por trozos fuera del event loop
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+import logging
+
+import jwt
+
+from credential_signer import CredentialSigner
+from metrics import metrics
+from qr_cache import TTLCache
+from status_list import StatusListService
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la verificación
+OPENID_VERIFY_MAX_BATCH = int(os.getenv("OPENID_VERIFY_MAX_BATCH", "1000"))
+OPENID_VERIFY_CHUNK = int(os.getenv("OPENID_VERIFY_CHUNK", "64"))
+# Segundos durante los que se usa la lista de estado en memoria sin revisar su versión
+OPENID_VERIFY_STATUS_STALENESS = float(os.getenv("OPENID_VERIFY_STATUS_STALENESS", "5"))
+OPENID_VERIFY_ANCHOR_CACHE_TTL = int(os.getenv("OPENID_VERIFY_ANCHOR_CACHE_TTL", "300"))
+
+# Campos del hash de anclaje (FabricClient._generate_credential_hash)
+ANCHOR_HASH_FIELDS = ("student_id", "course_id", "completion_date", "grade")
+
+# credentialSubject → resultado de anclaje (FabricClient.verify_credential_anchor)
+AnchorLookup = Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]
+
+
+class CredentialVerifier:
+    """Verifica una o muchas VCs JWT y devuelve el detalle de cada comprobación"""
+
+    def __init__(
+        self,
+        signer: CredentialSigner,
+        status_lists: StatusListService,
+        anchor_lookup: Optional[AnchorLookup] = None,
+        chunk_size: int = OPENID_VERIFY_CHUNK,
+    ):
+        self.signer = signer
+        self.status_lists = status_lists
+        # Lo asigna el Controller al iniciar si el anclaje por lotes está activo
+        self.anchor_lookup = anchor_lookup
+        self.chunk_size = max(1, chunk_size)
+        self.anchor_cache = TTLCache(
+            name="verify_anchors",
+            max_entries=10000,
+            default_ttl=OPENID_VERIFY_ANCHOR_CACHE_TTL,
+        )
+        self.verified = 0
+        self.rejected = 0
+
+    # ------------------------------------------------------------ firma + exp
+
+    def _check_token(self, token: str) -> Dict[str, Any]:
+        """Firma y expiración (CPU): se ejecuta en un hilo, por trozos"""
+        result: Dict[str, Any] = {"signature": False, "expired": None, "payload": None, "error": None}
+        try:
+            result["payload"] = self.signer.verify(token)
+            result["signature"] = True
+            result["expired"] = False
+        except jwt.ExpiredSignatureError:
+            # PyJWT valida la firma antes que exp: la firma es correcta
+            result["signature"] = True
+            result["expired"] = True
+            result["payload"] = jwt.decode(token, options={"verify_signature": False})
+        except jwt.InvalidTokenError as e:
+            result["error"] = str(e) or e.__class__.__name__
+        return result
+
+    def _check_chunk(self, tokens: List[str]) -> List[Dict[str, Any]]:
+        return [self._check_token(token) for token in tokens]
+
+    # ------------------------------------------------------------- revocación
+
+    async def _check_status(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        status = (payload.get("vc") or {}).get("credentialStatus")
+        if not status:
+            return {"checked": False, "reason": "La credencial no declara credentialStatus"}
+
+        list_id = self.status_lists.parse_list_url(status.get("statusListCredential", ""))
+        try:
+            index = int(status.get("statusListIndex"))
+        except (TypeError, ValueError):
+            index = None
+        if list_id is None or index is None:
+            return {"checked": False, "reason": "Lista de estado ajena a este issuer"}
+
+        revoked = await self.status_lists.is_revoked(list_id, index, max_staleness=OPENID_VERIFY_STATUS_STALENESS)
+        if revoked is None:
+            return {"checked": False, "reason": "Lista o índice de estado inexistente"}
+        return {"checked": True, "revoked": revoked, "status_list": list_id, "index": index}
+
+    # ---------------------------------------------------------------- anclaje
+
+    async def _check_anchor(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.anchor_lookup is None:
+            return {"checked": False, "reason": "Anclaje por lotes no habilitado"}
+        subject = (payload.get("vc") or {}).get("credentialSubject") or {}
+        missing = [field for field in ANCHOR_HASH_FIELDS if field not in subject]
+        if missing:
+            return {"checked": False, "reason": f"Faltan campos para el hash de anclaje: {', '.join(missing)}"}
+
+        key = "|".join(str(subject[field]) for field in ANCHOR_HASH_FIELDS)
+        cached = self.anchor_cache.get(key)
+        if cached is not None:
+            return cached
+
+        anchor = await self.anchor_lookup({field: subject[field] for field in ANCHOR_HASH_FIELDS})
+        if anchor is None:
+            result = {"checked": True, "anchored": False, "reason": "Hash no encontrado en los lotes anclados"}
+        else:
+            result = {"checked": True, "anchored": bool(anchor.get("valid")), **anchor}
+        # Solo se cachean anclajes confirmados: un hash pendiente puede anclarse en segundos
+        if result["anchored"]:
+            self.anchor_cache.set(key, result)
+        return result
+
+    # -------------------------------------------------------------------- API
+
+    async def _complete(self, checked: Dict[str, Any], check_anchor: bool) -> Dict[str, Any]:
+        payload = checked["payload"]
+        result: Dict[str, Any] = {
+            "valid": False,
+            "signature_valid": checked["signature"],
+            "expired": checked["expired"],
+        }
+        if not checked["signature"]:
+            result["error"] = checked["error"]
+            return result
+
+        vc = payload.get("vc") or {}
+        result.update({
+            "credential_id": payload.get("jti") or vc.get("id"),
+            "issuer": payload.get("iss"),
+            "subject": payload.get("sub"),
+            "expires_at": payload.get("exp"),
+        })
+        result["status"] = await self._check_status(payload)
+        revoked = result["status"].get("revoked", False)
+        valid = not checked["expired"] and not revoked
+        if check_anchor:
+            # Un anclaje no comprobable (sin campos o sin cola) se informa pero no invalida
+            result["anchor"] = await self._check_anchor(payload)
+            if result["anchor"]["checked"]:
+                valid = valid and result["anchor"]["anchored"]
+        result["valid"] = valid
+        return result
+
+    async def verify_many(self, tokens: List[str], check_anchor: bool = False) -> List[Dict[str, Any]]:
+        """Verificar un lote conservando el orden; firmas por trozos en hilos"""
+        chunks = [tokens[i:i + self.chunk_size] for i in range(0, len(tokens), self.chunk_size)]
+        with metrics.timer("vc_verify_batch"):
+            checked_chunks = await asyncio.gather(
+                *(asyncio.to_thread(self._check_chunk, chunk) for chunk in chunks)
+            )
+            results = []
+            for checked in (item for chunk in checked_chunks for item in chunk):
+                results.append(await self._complete(checked, check_anchor))
+
+        valid = sum(1 for result in results if result["valid"])
+        self.verified += valid
+        self.rejected += len(results) - valid
+        metrics.increment("vc_verify_valid", valid)
+        metrics.increment("vc_verify_invalid", len(results) - valid)
+        return results
+
+    async def verify(self, token: str, check_anchor: bool = False) -> Dict[str, Any]:
+        return (await self.verify_many([token], check_anchor))[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "anchor_lookup": self.anchor_lookup is not None,
+            "anchor_cache": self.anchor_cache.stats(),
+        }
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+DB - Utilidades comunes para las bases SQLite locales del Controller
+(pending store, cola de anclaje en Fabric, etc.)
+"""
+
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+
+def create_sqlite_engine(path: str) -> Engine:
+    """Crear engine SQLite en modo WAL apto para usarse desde varios threads/workers"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    engine = create_engine(
+        f"sqlite:///{path}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    return engine
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Fabric Connection - Estado de conexión con Hyperledger Fabric
+Inicialización única, monitor de salud en background y circuit breaker para que
+las llamadas del hot path consulten el estado cacheado y fallen rápido
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Any, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Configuración del monitor y del circuit breaker
+FABRIC_HEALTH_INTERVAL = float(os.getenv("FABRIC_HEALTH_INTERVAL", "30"))
+FABRIC_BREAKER_FAILURE_THRESHOLD = int(os.getenv("FABRIC_BREAKER_FAILURE_THRESHOLD", "3"))
+FABRIC_BREAKER_RESET_TIMEOUT = float(os.getenv("FABRIC_BREAKER_RESET_TIMEOUT", "60"))
+
+
+class CircuitBreaker:
+    """Circuit breaker clásico: closed → open (tras N fallos) → half_open (tras timeout)"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = FABRIC_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = FABRIC_BREAKER_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        """True si la llamada puede intentarse; en half_open solo se permite una de prueba"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            logger.info("✅ Circuito Fabric cerrado")
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                logger.warning(f"⚡ Circuito Fabric abierto tras {self._failures} fallos")
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+        }
+
+
+class FabricConnectionManager:
+    """Mantiene el estado de conexión con Fabric fuera del hot path"""
+
+    def __init__(
+        self,
+        probe: Callable[[], Awaitable[bool]],
+        connection_profile_path: str,
+        interval: float = FABRIC_HEALTH_INTERVAL,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self._probe = probe
+        self.connection_profile_path = connection_profile_path
+        self.interval = interval
+        self.breaker = breaker or CircuitBreaker()
+
+        self.is_available = False
+        self.initialized = False
+        self.last_check: Optional[float] = None
+        self._init_lock = asyncio.Lock()
+        self._monitor_task: Optional[asyncio.Task] = None
+
+    async def ensure_initialized(self):
+        """Inicialización única: perfil de conexión + primer probe"""
+        if self.initialized:
+            return
+        async with self._init_lock:
+            if self.initialized:
+                return
+
+            logger.info("🔗 Inicializando conexión con Hyperledger Fabric...")
+            if not os.path.exists(self.connection_profile_path):
+                logger.warning(f"⚠️ Perfil de conexión no encontrado: {self.connection_profile_path}")
+                logger.info("📝 Continuando con configuración de desarrollo...")
+            else:
+                logger.info("✅ Archivos de configuración encontrados")
+
+            await self.check_now()
+            self.initialized = True
+
+    async def check_now(self) -> bool:
+        """Ejecutar el probe y actualizar estado y circuit breaker"""
+        try:
+            available = bool(await self._probe())
+        except Exception as e:
+            logger.warning(f"⚠️ Error probando conexión Fabric: {e}")
+            available = False
+
+        self.is_available = available
+        self.last_check = time.time()
+        if available:
+            # Un probe exitoso es evidencia suficiente para cerrar el circuito; los
+            # fallos solo los cuentan las transacciones reales (la CLI puede funcionar
+            # aunque no haya endpoint REST que responda al probe)
+            self.breaker.record_success()
+        return available
+
+    def allow_request(self) -> bool:
+        return self.breaker.allow_request()
+
+    def record_success(self):
+        self.breaker.record_success()
+
+    def record_failure(self):
+        self.breaker.record_failure()
+
+    async def _monitor_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            was_available = self.is_available
+            available = await self.check_now()
+            if available != was_available:
+                logger.info(f"🔄 Estado Fabric: {'disponible' if available else 'no disponible'}")
+
+    def start_monitor(self):
+        """Iniciar el monitor de salud (llamar desde el evento startup)"""
+        if self._monitor_task is None or self._monitor_task.done():
+            self._monitor_task = asyncio.create_task(self._monitor_loop())
+
+    async def stop_monitor(self):
+        if self._monitor_task:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+            self._monitor_task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "available": self.is_available,
+            "initialized": self.initialized,
+            "last_check": self.last_check,
+            "health_interval": self.interval,
+            "circuit_breaker": self.breaker.snapshot(),
+        }
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Fabric Gateway - Conexión gRPC persistente con el servicio Gateway del peer (Fabric >= 2.4)
+Reemplaza ``docker exec cli peer chaincode invoke`` por un único canal TLS autenticado
+con la identidad User1, reutilizado por todas las transacciones (HTTP/2 multiplexado)
+
+No existe SDK oficial de Fabric Gateway para Python ni paquete con los .proto compilados,
+así que los mensajes necesarios (Proposal, Envelope, Endorse/Submit/CommitStatus/Evaluate)
+se codifican directamente en formato wire de protobuf con los números de campo de fabric-protos
+"""
+
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Any, Optional, List, Tuple
+import logging
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración del gateway
+FABRIC_GATEWAY_ENABLED = os.getenv("FABRIC_GATEWAY_ENABLED", "true").lower() == "true"
+FABRIC_GATEWAY_PEER_ENDPOINT = os.getenv("FABRIC_GATEWAY_PEER_ENDPOINT", "")
+FABRIC_GATEWAY_MSP_PATH = os.getenv("FABRIC_GATEWAY_MSP_PATH", "/crypto-config/User1/msp")
+FABRIC_GATEWAY_ENDORSE_TIMEOUT = float(os.getenv("FABRIC_GATEWAY_ENDORSE_TIMEOUT", "15"))
+FABRIC_GATEWAY_SUBMIT_TIMEOUT = float(os.getenv("FABRIC_GATEWAY_SUBMIT_TIMEOUT", "15"))
+FABRIC_GATEWAY_COMMIT_TIMEOUT = float(os.getenv("FABRIC_GATEWAY_COMMIT_TIMEOUT", "60"))
+FABRIC_GATEWAY_WAIT_COMMIT = os.getenv("FABRIC_GATEWAY_WAIT_COMMIT", "true").lower() == "true"
+FABRIC_GATEWAY_MAX_IN_FLIGHT = int(os.getenv("FABRIC_GATEWAY_MAX_IN_FLIGHT", "64"))
+
+# Constantes de fabric-protos
+HEADER_TYPE_ENDORSER_TRANSACTION = 3
+TX_VALIDATION_CODE_VALID = 0
+
+# Orden del grupo de P-256 (curva de las identidades de test-network)
+P256_ORDER = 0xFFFFFFFF00000000FFFFFFFFFFFFFFFFBCE6FAADA7179E84F3B9CAC2FC632551
+
+GATEWAY_ENDORSE = "/gateway.Gateway/Endorse"
+GATEWAY_SUBMIT = "/gateway.Gateway/Submit"
+GATEWAY_COMMIT_STATUS = "/gateway.Gateway/CommitStatus"
+GATEWAY_EVALUATE = "/gateway.Gateway/Evaluate"
+
+
+class GatewayError(Exception):
+    """Error de endorsement, envío o validación de una transacción vía Gateway"""
+
+
+# ---------------------------------------------------------------- protobuf wire
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _field_varint(number: int, value: int) -> bytes:
+    if not value:
+        return b""
+    return _varint(number << 3) + _varint(value)
+
+
+def _field_bytes(number: int, value) -> bytes:
+    """Campo singular bytes/string/mensaje: proto3 omite el valor vacío"""
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if not value:
+        return b""
+    return _varint((number << 3) | 2) + _varint(len(value)) + value
+
+
+def _repeated_bytes(number: int, values) -> bytes:
+    """Campo repeated: cada elemento se codifica aunque esté vacío (la posición importa)"""
+    encoded = []
+    for value in values:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        encoded.append(_varint((number << 3) | 2) + _varint(len(value)) + value)
+    return b"".join(encoded)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _decode(data: bytes) -> Dict[int, List[Any]]:
+    """Decodificar un mensaje en {número de campo: [valores]} (varint → int, length → bytes)"""
+    fields: Dict[int, List[Any]] = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        number, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise GatewayError(f"Tipo wire de protobuf no soportado: {wire_type}")
+        fields.setdefault(number, []).append(value)
+    return fields
+
+
+def _first(fields: Dict[int, List[Any]], number: int, default=None):
+    values = fields.get(number)
+    return values[0] if values else default
+
+
+# ---------------------------------------------------------------- identidad
+
+class FabricIdentity:
+    """Identidad X.509 de un MSP (certificado + clave privada ECDSA) cargada una sola vez"""
+
+    def __init__(self, mspid: str, certificate: bytes, private_key):
+        self.mspid = mspid
+        self.certificate = certificate
+        self._private_key = private_key
+        # SerializedIdentity {mspid = 1, id_bytes = 2}
+        self.serialized = _field_bytes(1, mspid) + _field_bytes(2, certificate)
+
+    @classmethod
+    def from_msp_dir(cls, mspid: str, msp_path: str) -> "FabricIdentity":
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+        with open(os.path.join(msp_path, "signcerts", "cert.pem"), "rb") as f:
+            certificate = f.read()
+        keys = glob.glob(os.path.join(msp_path, "keystore", "*_sk"))
+        if not keys:
+            raise FileNotFoundError(f"No hay clave privada en {msp_path}/keystore")
+        with open(keys[0], "rb") as f:
+            private_key = load_pem_private_key(f.read(), password=None)
+        return cls(mspid, certificate, private_key)
+
+    def sign(self, message: bytes) -> bytes:
+        """ECDSA P-256/SHA-256 con S bajo (requisito de validación de Fabric)"""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric.utils import (
+            decode_dss_signature,
+            encode_dss_signature,
+        )
+
+        signature = self._private_key.sign(message, ec.ECDSA(hashes.SHA256()))
+        r, s = decode_dss_signature(signature)
+        if s > P256_ORDER // 2:
+            s = P256_ORDER - s
+        return encode_dss_signature(r, s)
+
+
+# ---------------------------------------------------------------- gateway
+
+class FabricGateway:
+    """Canal gRPC persistente con el Gateway del peer, compartido por todas las transacciones"""
+
+    def __init__(
+        self,
+        connection_profile_path: str,
+        channel_name: str,
+        chaincode_name: str,
+        mspid: str,
+        msp_path: str = FABRIC_GATEWAY_MSP_PATH,
+        peer_endpoint: str = FABRIC_GATEWAY_PEER_ENDPOINT,
+        max_in_flight: int = FABRIC_GATEWAY_MAX_IN_FLIGHT,
+    ):
+        self.connection_profile_path = connection_profile_path
+        self.channel_name = channel_name
+        self.chaincode_name = chaincode_name
+        self.mspid = mspid
+        self.msp_path = msp_path
+        self.peer_endpoint = peer_endpoint
+        self.max_in_flight = max_in_flight
+
+        self.identity: Optional[FabricIdentity] = None
+        self._channel = None
+        self._stubs: Dict[str, Any] = {}
+        self._connect_lock = asyncio.Lock()
+        self._in_flight: Optional[asyncio.Semaphore] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._channel is not None
+
+    def _load_peer(self) -> Tuple[str, bytes, Optional[str]]:
+        """(endpoint, PEM de la CA TLS, nombre TLS) del primer peer de la organización"""
+        with open(self.connection_profile_path, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+
+        peer_name = None
+        for org in profile.get("organizations", {}).values():
+            if org.get("mspid") == self.mspid and org.get("peers"):
+                peer_name = org["peers"][0]
+                break
+        peers = profile.get("peers", {})
+        if peer_name is None and peers:
+            peer_name = next(iter(peers))
+        if peer_name is None:
+            raise GatewayError("El perfil de conexión no define peers")
+
+        peer = peers[peer_name]
+        endpoint = self.peer_endpoint or peer["url"].split("://", 1)[-1]
+        tls_ca = peer.get("tlsCACerts", {}).get("pem", "")
+        if isinstance(tls_ca, list):
+            tls_ca = "".join(tls_ca)
+        grpc_options = peer.get("grpcOptions", {})
+        target_name = grpc_options.get("ssl-target-name-override") or grpc_options.get("hostnameOverride")
+        return endpoint, tls_ca.encode("utf-8"), target_name
+
+    async def connect(self):
+        """Abrir el canal una sola vez (llamadas concurrentes esperan al mismo intento)"""
+        if self._channel is not None:
+            return
+        async with self._connect_lock:
+            if self._channel is not None:
+                return
+            try:
+                import grpc
+            except ImportError as e:
+                logger.error("❌ El gateway de Fabric requiere el paquete 'grpcio'")
+                raise e
+
+            endpoint, tls_ca, target_name = await asyncio.to_thread(self._load_peer)
+            self.identity = await asyncio.to_thread(FabricIdentity.from_msp_dir, self.mspid, self.msp_path)
+
+            options = [
+                ("grpc.keepalive_time_ms", 60000),
+                ("grpc.keepalive_timeout_ms", 20000),
+                ("grpc.http2.max_pings_without_data", 0),
+            ]
+            if target_name:
+                options.append(("grpc.ssl_target_name_override", target_name))
+
+            credentials = grpc.ssl_channel_credentials(root_certificates=tls_ca or None)
+            channel = grpc.aio.secure_channel(endpoint, credentials, options=options)
+            # Mensajes ya serializados: sin (de)serializadores, gRPC transporta bytes
+            self._stubs = {
+                method: channel.unary_unary(method)
+                for method in (GATEWAY_ENDORSE, GATEWAY_SUBMIT, GATEWAY_COMMIT_STATUS, GATEWAY_EVALUATE)
+            }
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._channel = channel
+            logger.info(f"🔗 Canal gRPC con Fabric Gateway abierto: {endpoint}")
+
+    async def wait_ready(self, timeout: float = 2.0) -> bool:
+        """True si el canal llega a READY antes del timeout (usado por el probe de salud)"""
+        try:
+            await self.connect()
+            await asyncio.wait_for(self._channel.channel_ready(), timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    async def close(self):
+        if self._channel is not None:
+            await self._channel.close()
+            self._channel = None
+            self._stubs = {}
+            logger.info("🔌 Canal gRPC con Fabric Gateway cerrado")
+
+    # ------------------------------------------------------------ mensajes
+
+    def _new_signed_proposal(self, function_name: str, args: List[str]) -> Tuple[str, bytes]:
+        """Construir y firmar la propuesta; retorna (transaction_id, SignedProposal)"""
+        creator = self.identity.serialized
+        nonce = os.urandom(24)
+        transaction_id = hashlib.sha256(nonce + creator).hexdigest()
+
+        now = time.time()
+        timestamp = _field_varint(1, int(now)) + _field_varint(2, int((now % 1) * 1e9))
+        chaincode_id = _field_bytes(2, self.chaincode_name)
+
+        channel_header = (
+            _field_varint(1, HEADER_TYPE_ENDORSER_TRANSACTION)
+            + _field_bytes(3, timestamp)
+            + _field_bytes(4, self.channel_name)
+            + _field_bytes(5, transaction_id)
+            + _field_bytes(7, _field_bytes(2, chaincode_id))
+        )
+        signature_header = _field_bytes(1, creator) + _field_bytes(2, nonce)
+        header = _field_bytes(1, channel_header) + _field_bytes(2, signature_header)
+
+        chaincode_input = _repeated_bytes(1, [function_name, *args])
+        chaincode_spec = _field_bytes(2, chaincode_id) + _field_bytes(3, chaincode_input)
+        invocation_spec = _field_bytes(1, chaincode_spec)
+        proposal_payload = _field_bytes(1, invocation_spec)
+
+        proposal = _field_bytes(1, header) + _field_bytes(2, proposal_payload)
+        signed_proposal = _field_bytes(1, proposal) + _field_bytes(2, self.identity.sign(proposal))
+        return transaction_id, signed_proposal
+
+    def _transaction_request(self, transaction_id: str, body: bytes) -> bytes:
+        return _field_bytes(1, transaction_id) + _field_bytes(2, self.channel_name) + _field_bytes(3, body)
+
+    # ------------------------------------------------------------ transacciones
+
+    async def submit_transaction(self, function_name: str, *args: str) -> str:
+        """Endorse → Submit (→ CommitStatus); retorna el transaction ID real de Fabric"""
+        await self.connect()
+        async with self._in_flight:
+            start = time.perf_counter()
+            transaction_id, signed_proposal = self._new_signed_proposal(function_name, list(args))
+            try:
+                endorse_response = await self._stubs[GATEWAY_ENDORSE](
+                    self._transaction_request(transaction_id, signed_proposal),
+                    timeout=FABRIC_GATEWAY_ENDORSE_TIMEOUT,
+                )
+                envelope = _first(_decode(endorse_response), 1)
+                if envelope is None:
+                    raise GatewayError("Endorse no devolvió la transacción preparada")
+
+                payload = _first(_decode(envelope), 1, b"")
+                signed_envelope = _field_bytes(1, payload) + _field_bytes(2, self.identity.sign(payload))
+                await self._stubs[GATEWAY_SUBMIT](
+                    self._transaction_request(transaction_id, signed_envelope),
+                    timeout=FABRIC_GATEWAY_SUBMIT_TIMEOUT,
+                )
+                metrics.observe("fabric_gateway submit", time.perf_counter() - start)
+
+                if FABRIC_GATEWAY_WAIT_COMMIT:
+                    await self._wait_for_commit(transaction_id)
+                    metrics.observe("fabric_gateway commit", time.perf_counter() - start)
+            except GatewayError:
+                metrics.increment("fabric_gateway_errors")
+                raise
+            except Exception as e:
+                metrics.increment("fabric_gateway_errors")
+                raise GatewayError(self._describe_error(e)) from e
+
+        return transaction_id
+
+    async def _wait_for_commit(self, transaction_id: str):
+        request = (
+            _field_bytes(1, transaction_id)
+            + _field_bytes(2, self.channel_name)
+            + _field_bytes(3, self.identity.serialized)
+        )
+        signed_request = _field_bytes(1, request) + _field_bytes(2, self.identity.sign(request))
+        response = await self._stubs[GATEWAY_COMMIT_STATUS](
+            signed_request,
+            timeout=FABRIC_GATEWAY_COMMIT_TIMEOUT,
+        )
+        status = _first(_decode(response), 1, TX_VALIDATION_CODE_VALID)
+        if status != TX_VALIDATION_CODE_VALID:
+            raise GatewayError(f"Transacción {transaction_id} inválida (código de validación {status})")
+
+    async def evaluate_transaction(self, function_name: str, *args: str) -> bytes:
+        """Consulta sin ordenar (Evaluate); retorna el payload de la respuesta del chaincode"""
+        await self.connect()
+        async with self._in_flight:
+            start = time.perf_counter()
+            transaction_id, signed_proposal = self._new_signed_proposal(function_name, list(args))
+            try:
+                response = await self._stubs[GATEWAY_EVALUATE](
+                    self._transaction_request(transaction_id, signed_proposal),
+                    timeout=FABRIC_GATEWAY_ENDORSE_TIMEOUT,
+                )
+            except Exception as e:
+                metrics.increment("fabric_gateway_errors")
+                raise GatewayError(self._describe_error(e)) from e
+            metrics.observe("fabric_gateway evaluate", time.perf_counter() - start)
+
+        result = _decode(_first(_decode(response), 1, b""))
+        status = _first(result, 1, 0)
+        if status >= 400:
+            message = _first(result, 2, b"").decode("utf-8", "replace")
+            raise GatewayError(f"Chaincode respondió {status}: {message}")
+        return _first(result, 3, b"")
+
+    @staticmethod
+    def _describe_error(error: Exception) -> str:
+        details = getattr(error, "details", None)
+        if callable(details):
+            return f"{error.code().name}: {details()}"
+        return str(error)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Idempotency - Deduplicación de solicitudes de credencial
+Moodle puede disparar course_completed más de una vez y cURL reintenta: cada
+duplicado creaba otra invitación en ACA-Py, otro asset en Fabric y otro QR.
+La clave es el header ``Idempotency-Key`` o, si no viene, el hash de
+(student_id, course_id, completion_date). La primera respuesta exitosa se
+guarda en el pending store (compartido entre workers) con un caché local por
+delante; los duplicados concurrentes en el mismo proceso esperan a la primera
+ejecución en lugar de repetirla. Un Idempotency-Key reutilizado con otro cuerpo
+se rechaza (huella SHA-256 del cuerpo guardada junto a la respuesta)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+from typing import Awaitable, Callable, Dict, Any, Optional, Tuple
+import logging
+
+from metrics import metrics
+from pending_store import PendingCredentialStore
+from qr_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la deduplicación
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(7 * 24 * 3600)))
+IDEMPOTENCY_CACHE_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_CACHE_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+# Campos que identifican una misma finalización de curso
+NATURAL_KEY_FIELDS = ("student_id", "course_id", "completion_date")
+
+
+class IdempotencyConflictError(Exception):
+    """El Idempotency-Key ya se usó con otro cuerpo de solicitud (HTTP 422)"""
+
+
+class IdempotencyIndex:
+    """Índice clave → respuesta previa, con coalescencia de solicitudes en curso"""
+
+    def __init__(
+        self,
+        store: PendingCredentialStore,
+        namespace: str,
+        ttl: int = IDEMPOTENCY_TTL,
+        max_entries: int = IDEMPOTENCY_CACHE_MAX_ENTRIES,
+    ):
+        self.store = store
+        self.namespace = namespace
+        self.ttl = ttl
+        self._local = TTLCache(name=f"idempotency:{namespace}", max_entries=max_entries, default_ttl=ttl)
+        # clave → (futuro de la primera ejecución, huella del cuerpo)
+        self._in_flight: Dict[str, Tuple[asyncio.Future, Optional[str]]] = {}
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+
+    @staticmethod
+    def key_for(data: Dict[str, Any], idempotency_key: Optional[str] = None) -> str:
+        """Clave explícita del cliente o clave natural de la finalización del curso"""
+        if idempotency_key:
+            idempotency_key = idempotency_key.strip()
+            if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+                raise ValueError(f"Idempotency-Key debe tener entre 1 y {IDEMPOTENCY_MAX_KEY_LENGTH} caracteres")
+            return f"key:{idempotency_key}"
+        natural = "|".join(str(data.get(field, "")) for field in NATURAL_KEY_FIELDS)
+        return f"natural:{hashlib.sha256(natural.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def fingerprint(data: Dict[str, Any]) -> str:
+        """Huella del cuerpo de la solicitud (JSON canónico)"""
+        canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Entrada guardada: {"response": ..., "fingerprint": ...}"""
+        cached = self._local.get(key)
+        if cached is not None:
+            return cached
+        stored = await self.store.get(self.namespace, key)
+        if stored is not None:
+            self._local.set(key, stored)
+        return stored
+
+    async def remember(self, key: str, response: Dict[str, Any], fingerprint: Optional[str] = None):
+        entry = {"response": response, "fingerprint": fingerprint}
+        self._local.set(key, entry)
+        await self.store.put(self.namespace, key, entry, ttl=self.ttl)
+
+    async def forget(self, key: str):
+        """Olvidar la clave (p. ej. la invitación ya se consumió al emitir la credencial)"""
+        self._local.delete(key)
+        await self.store.delete(self.namespace, key)
+
+    def _check_fingerprint(self, stored: Optional[str], fingerprint: Optional[str]):
+        if fingerprint is not None and stored is not None and stored != fingerprint:
+            self.conflicts += 1
+            metrics.increment("idempotency_conflicts")
+            raise IdempotencyConflictError("Idempotency-Key reutilizado con otro cuerpo de solicitud")
+
+    async def _join(self, key: str, fingerprint: Optional[str]) -> Optional[Dict[str, Any]]:
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            return None
+        pending, pending_fingerprint = in_flight
+        self._check_fingerprint(pending_fingerprint, fingerprint)
+        self.coalesced += 1
+        metrics.increment("idempotency_coalesced")
+        return await asyncio.shield(pending)
+
+    async def run(
+        self,
+        key: str,
+        execute: Callable[[], Awaitable[Dict[str, Any]]],
+        fingerprint: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Ejecutar una sola vez por clave; retorna (respuesta, replayed)
+        Solo se recuerdan respuestas exitosas: un fallo permite reintentar
+        Con ``fingerprint`` un duplicado con otro cuerpo lanza IdempotencyConflictError
+        """
+        if key in self._in_flight:
+            return await self._join(key, fingerprint), True
+
+        cached = await self.lookup(key)
+        if cached is not None:
+            self._check_fingerprint(cached.get("fingerprint"), fingerprint)
+            self.replayed += 1
+            metrics.increment("idempotency_replayed")
+            return cached["response"], True
+
+        # Otra corrutina pudo empezar mientras se consultaba el store
+        if key in self._in_flight:
+            return await self._join(key, fingerprint), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (future, fingerprint)
+        try:
+            response = await execute()
+            await self.remember(key, response, fingerprint)
+            future.set_result(response)
+            return response, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evitar "Future exception was never retrieved" si nadie esperaba
+            future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "namespace": self.namespace,
+            "in_flight": len(self._in_flight),
+            "replayed": self.replayed,
+            "coalesced": self.coalesced,
+            "conflicts": self.conflicts,
+            "cache": self._local.stats(),
+        }
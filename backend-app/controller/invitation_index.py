@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Invitation Index - Correlación de invitaciones out-of-band con conexiones DIDComm
+Los datos pendientes se guardan bajo el oob_id de la invitación, pero los webhooks
+de conexión traen el connection_id (y el invitation_msg_id). El índice mantiene
+oob_id ↔ invi_msg_id ↔ connection_id a partir de la creación de la invitación y de
+los webhooks out_of_band / connections, para resolver el oob_id en O(1) al emitir.
+Se persiste en el pending store (compartido entre workers) con un caché local
+"""
+
+import os
+from typing import Dict, Any, Optional
+import logging
+
+from metrics import metrics
+from pending_store import PendingCredentialStore
+from qr_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Configuración del índice
+INVITATION_INDEX_CACHE_MAX_ENTRIES = int(os.getenv("INVITATION_INDEX_CACHE_MAX_ENTRIES", "20000"))
+
+# Prefijos de clave dentro del namespace
+INVITATION_KEY = "invi"
+CONNECTION_KEY = "conn"
+
+
+class InvitationIndex:
+    """Índice invi_msg_id → oob_id y connection_id → oob_id"""
+
+    def __init__(
+        self,
+        store: PendingCredentialStore,
+        ttl: int,
+        namespace: str = "didcomm_links",
+        max_entries: int = INVITATION_INDEX_CACHE_MAX_ENTRIES,
+    ):
+        self.store = store
+        self.ttl = ttl
+        self.namespace = namespace
+        self._local = TTLCache(name=f"index:{namespace}", max_entries=max_entries, default_ttl=ttl)
+        self.linked = 0
+        self.unresolved = 0
+
+    async def _get(self, kind: str, key: str) -> Optional[str]:
+        cache_key = f"{kind}:{key}"
+        oob_id = self._local.get(cache_key)
+        if oob_id is not None:
+            return oob_id
+        entry = await self.store.get(self.namespace, cache_key)
+        if entry is None:
+            return None
+        self._local.set(cache_key, entry["oob_id"])
+        return entry["oob_id"]
+
+    async def _put(self, kind: str, key: str, oob_id: str):
+        cache_key = f"{kind}:{key}"
+        if self._local.get(cache_key) == oob_id:
+            return
+        self._local.set(cache_key, oob_id)
+        await self.store.put(self.namespace, cache_key, {"oob_id": oob_id}, ttl=self.ttl)
+
+    async def register_invitation(self, oob_id: str, invi_msg_id: Optional[str]):
+        """Al crear la invitación: el @id del mensaje identifica luego a la conexión"""
+        if invi_msg_id:
+            await self._put(INVITATION_KEY, invi_msg_id, oob_id)
+
+    async def link(
+        self,
+        connection_id: Optional[str],
+        oob_id: Optional[str] = None,
+        invi_msg_id: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Asociar una conexión (webhook out_of_band o connections) con su invitación
+        Retorna el oob_id si pudo resolverse
+        """
+        if not oob_id and invi_msg_id:
+            oob_id = await self._get(INVITATION_KEY, invi_msg_id)
+        if not oob_id:
+            return None
+        if invi_msg_id:
+            await self._put(INVITATION_KEY, invi_msg_id, oob_id)
+        if connection_id and connection_id != oob_id:
+            if await self._get(CONNECTION_KEY, connection_id) != oob_id:
+                await self._put(CONNECTION_KEY, connection_id, oob_id)
+                self.linked += 1
+                metrics.increment("invitation_index_linked")
+                logger.info(f"🔗 Conexión {connection_id} correlacionada con invitación {oob_id}")
+        return oob_id
+
+    async def oob_for_connection(self, connection_id: str) -> Optional[str]:
+        """oob_id bajo el que están los datos pendientes de la conexión"""
+        oob_id = await self._get(CONNECTION_KEY, connection_id)
+        if oob_id is None:
+            self.unresolved += 1
+            metrics.increment("invitation_index_unresolved")
+        return oob_id
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "linked": self.linked,
+            "unresolved": self.unresolved,
+            "cache": self._local.stats(),
+        }
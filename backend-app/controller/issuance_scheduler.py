@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Issuance Scheduler - Emisión DIDComm disparada por los webhooks de conexión
+Reemplaza las tareas sueltas (asyncio.create_task + sleep fijo de 2 s): el webhook
+"active" ya indica que la conexión está lista, así que la emisión se encola al
+instante y la procesan workers con concurrencia acotada. Los fallos transitorios
+se reintentan con backoff exponencial con jitter sin ocupar un worker, y al
+apagar se drena lo que ya estaba listo para emitir. Las emisiones en espera de
+reintento (o sin drenar) se guardan en el pending store y se retoman al iniciar
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, Any, Optional
+import logging
+
+from metrics import metrics
+from pending_store import PendingCredentialStore
+
+logger = logging.getLogger(__name__)
+
+# Configuración del scheduler de emisión
+ISSUANCE_CONCURRENCY = int(os.getenv("ISSUANCE_CONCURRENCY", "8"))
+ISSUANCE_MAX_PENDING = int(os.getenv("ISSUANCE_MAX_PENDING", "10000"))
+ISSUANCE_MAX_ATTEMPTS = int(os.getenv("ISSUANCE_MAX_ATTEMPTS", "5"))
+ISSUANCE_RETRY_BASE_DELAY = float(os.getenv("ISSUANCE_RETRY_BASE_DELAY", "0.5"))
+ISSUANCE_RETRY_MAX_DELAY = float(os.getenv("ISSUANCE_RETRY_MAX_DELAY", "30"))
+# Tiempo máximo para drenar emisiones listas al apagar el Controller
+ISSUANCE_DRAIN_TIMEOUT = float(os.getenv("ISSUANCE_DRAIN_TIMEOUT", "10"))
+# Vigencia de las emisiones guardadas para retomar (la de los datos pendientes)
+ISSUANCE_RESUME_TTL = int(os.getenv("ISSUANCE_RESUME_TTL", os.getenv("PENDING_CREDENTIAL_TTL", str(7 * 24 * 3600))))
+ISSUANCE_RESUME_NAMESPACE = "issuance_resume"
+
+# connection_id → resultado de la emisión
+IssueCredential = Callable[[str], Awaitable[Any]]
+
+
+def is_retryable(error: Exception) -> bool:
+    """Errores 4xx (sin credencial pendiente, datos inválidos) no se reintentan; 429/5xx/red sí"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        return True
+    return status_code == 429 or status_code >= 500
+
+
+def backoff_delay(attempt: int, base: float = ISSUANCE_RETRY_BASE_DELAY, cap: float = ISSUANCE_RETRY_MAX_DELAY) -> float:
+    """Backoff exponencial con jitter (mitad fija + mitad aleatoria) para no sincronizar reintentos"""
+    delay = min(cap, base * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class IssuanceScheduler:
+    """Cola de emisiones por conexión con workers, reintentos y drenado al apagar"""
+
+    def __init__(
+        self,
+        concurrency: int = ISSUANCE_CONCURRENCY,
+        max_pending: int = ISSUANCE_MAX_PENDING,
+        max_attempts: int = ISSUANCE_MAX_ATTEMPTS,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_pending = max_pending
+        self.max_attempts = max(1, max_attempts)
+
+        self._issue: Optional[IssueCredential] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        # connection_id → (instante de programación, intento); evita duplicados por webhooks repetidos
+        self._scheduled: Dict[str, Dict[str, Any]] = {}
+        self._retry_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._in_flight = 0
+        self._accepting = False
+        self._store: Optional[PendingCredentialStore] = None
+        self._resume_task: Optional[asyncio.Task] = None
+
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self.resumed = 0
+
+    # ---------------------------------------------------------------- entrada
+
+    def schedule(self, connection_id: str, attempt: int = 0) -> bool:
+        """
+        Programar la emisión de una conexión lista; False si se rechaza o ya estaba programada
+        ``attempt`` > 0 retoma una emisión que ya falló: conserva su presupuesto de intentos
+        y espera el backoff correspondiente en lugar de encolarse al instante
+        """
+        if not self._accepting:
+            self.rejected += 1
+            metrics.increment("issuance_rejected")
+            logger.warning(f"⚠️ Scheduler detenido, emisión no programada: {connection_id}")
+            return False
+        if connection_id in self._scheduled:
+            return False
+        if len(self._scheduled) >= self.max_pending:
+            self.rejected += 1
+            metrics.increment("issuance_rejected")
+            logger.error(f"❌ Scheduler de emisión saturado ({self.max_pending}), descartando: {connection_id}")
+            return False
+
+        self._scheduled[connection_id] = {"scheduled_at": time.perf_counter(), "attempt": attempt}
+        if attempt > 0:
+            self._retry_handles[connection_id] = asyncio.get_running_loop().call_later(
+                backoff_delay(attempt), self._requeue, connection_id
+            )
+        else:
+            self._queue.put_nowait(connection_id)
+        self._update_gauges()
+        return True
+
+    def _requeue(self, connection_id: str):
+        self._retry_handles.pop(connection_id, None)
+        if connection_id in self._scheduled:
+            self._queue.put_nowait(connection_id)
+            self._update_gauges()
+
+    # ------------------------------------------------------------ persistencia
+
+    async def _persist(self, connection_id: str, entry: Dict[str, Any]):
+        """Guardar la emisión para retomarla si el proceso se detiene antes de reintentar"""
+        if self._store is None:
+            return
+        try:
+            await self._store.put(
+                ISSUANCE_RESUME_NAMESPACE, connection_id, {"attempt": entry["attempt"]}, ttl=ISSUANCE_RESUME_TTL
+            )
+            entry["persisted"] = True
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo guardar la emisión pendiente de {connection_id}: {e}")
+
+    async def _forget(self, connection_id: str, entry: Dict[str, Any]):
+        if self._store is None or not entry.get("persisted"):
+            return
+        try:
+            await self._store.delete(ISSUANCE_RESUME_NAMESPACE, connection_id)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo borrar la emisión guardada de {connection_id}: {e}")
+
+    async def _resume(self):
+        """Reprogramar las emisiones guardadas por ejecuciones anteriores (cada una la toma un solo worker)"""
+        try:
+            connection_ids = await self._store.keys(ISSUANCE_RESUME_NAMESPACE)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudieron leer las emisiones pendientes guardadas: {e}")
+            return
+        for connection_id in connection_ids:
+            # Ya programada en este proceso (p. ej. su propio reintento recién guardado)
+            if connection_id in self._scheduled:
+                continue
+            saved = await self._store.take(ISSUANCE_RESUME_NAMESPACE, connection_id)
+            if saved is None or connection_id in self._scheduled:
+                continue
+            attempt = saved.get("attempt", 0)
+            if not self.schedule(connection_id, attempt=attempt):
+                await self._persist(connection_id, {"attempt": attempt})
+                continue
+            self.resumed += 1
+            metrics.increment("issuance_resumed")
+        if self.resumed:
+            logger.info(f"📦 {self.resumed} emisiones retomadas de ejecuciones anteriores")
+
+    def _update_gauges(self):
+        metrics.set_gauge("issuance_queue_depth", self._queue.qsize() if self._queue else 0)
+        metrics.set_gauge("issuance_in_flight", self._in_flight)
+        metrics.set_gauge("issuance_retry_waiting", len(self._retry_handles))
+
+    # ----------------------------------------------------------------- worker
+
+    async def _process(self, connection_id: str):
+        entry = self._scheduled[connection_id]
+        entry["attempt"] += 1
+        try:
+            with metrics.timer("issuance_attempt"):
+                await self._issue(connection_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e) or e.__class__.__name__
+            if is_retryable(e) and entry["attempt"] < self.max_attempts and self._accepting:
+                await self._persist(connection_id, entry)
+                delay = backoff_delay(entry["attempt"])
+                self._retry_handles[connection_id] = asyncio.get_running_loop().call_later(
+                    delay, self._requeue, connection_id
+                )
+                self.retried += 1
+                metrics.increment("issuance_retried")
+                logger.warning(
+                    f"⚠️ Emisión para {connection_id} falló (intento {entry['attempt']}/{self.max_attempts}), "
+                    f"reintento en {delay:.2f}s: {error}"
+                )
+                return
+            self._scheduled.pop(connection_id, None)
+            await self._forget(connection_id, entry)
+            self.failed += 1
+            metrics.increment("issuance_failed")
+            logger.error(f"❌ Emisión para {connection_id} abandonada tras {entry['attempt']} intentos: {error}")
+            return
+
+        self._scheduled.pop(connection_id, None)
+        await self._forget(connection_id, entry)
+        self.succeeded += 1
+        metrics.increment("issuance_succeeded")
+        metrics.observe("issuance_latency", time.perf_counter() - entry["scheduled_at"])
+
+    async def _worker_loop(self):
+        while True:
+            connection_id = await self._queue.get()
+            self._in_flight += 1
+            self._update_gauges()
+            try:
+                await self._process(connection_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en worker de emisión: {e}")
+                self._scheduled.pop(connection_id, None)
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+                self._update_gauges()
+
+    # ------------------------------------------------------------- ciclo vida
+
+    def start(self, issue: IssueCredential, store: Optional[PendingCredentialStore] = None):
+        """
+        Iniciar los workers (evento startup) con la corrutina que emite por conexión
+        Con ``store`` las emisiones sin terminar sobreviven a reinicios y se retoman aquí
+        """
+        if self._workers:
+            return
+        self._issue = issue
+        self._store = store
+        self._queue = asyncio.Queue()
+        self._accepting = True
+        self._workers = [asyncio.create_task(self._worker_loop()) for _ in range(self.concurrency)]
+        if store is not None:
+            self._resume_task = asyncio.create_task(self._resume())
+        logger.info(f"✅ Scheduler de emisión iniciado: {self.concurrency} workers")
+
+    async def close(self, timeout: float = ISSUANCE_DRAIN_TIMEOUT):
+        """Dejar de aceptar, drenar lo listo para emitir y detener workers (evento shutdown)"""
+        if not self._workers:
+            return
+        self._accepting = False
+        if self._resume_task is not None:
+            self._resume_task.cancel()
+            await asyncio.gather(self._resume_task, return_exceptions=True)
+            self._resume_task = None
+        # Los reintentos diferidos no se esperan: ya están guardados y se retoman al reiniciar
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        if self._retry_handles:
+            logger.warning(f"⚠️ {len(self._retry_handles)} emisiones en espera de reintento quedan pendientes")
+        self._retry_handles.clear()
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Drenado de emisiones incompleto tras {timeout}s: {self._queue.qsize()} en cola")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Lo que no llegó a emitirse (en cola o en espera de reintento) se guarda para el próximo inicio
+        for connection_id, entry in self._scheduled.items():
+            if not entry.get("persisted"):
+                await self._persist(connection_id, entry)
+        self._scheduled.clear()
+        self._update_gauges()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_flight": self._in_flight,
+            "retry_waiting": len(self._retry_handles),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected,
+            "resumed": self.resumed,
+        }
+
+
+# Instancia compartida del Controller
+issuance_scheduler = IssuanceScheduler()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Job Queue - Cola persistente de trabajos asíncronos del Controller
+Las solicitudes con ``Prefer: respond-async`` se guardan en SQLite y responden 202
+con un job_id; un pool de workers las procesa fuera del request. El estado se
+consulta en /api/jobs/{job_id} y, opcionalmente, se notifica a una URL de callback.
+Los trabajos sobreviven a reinicios: uno que quedó "running" con la concesión
+vencida (worker caído) vuelve a la cola
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+from urllib.parse import urlparse
+import logging
+
+import httpx
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, Float, select, func
+
+from db import create_sqlite_engine
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración de la cola de trabajos
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "/var/lib/controller/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "5"))
+# Un trabajo "running" sin terminar tras este tiempo se considera de un worker caído
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Tiempo que se conservan los trabajos terminados para consultar su resultado
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "86400"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "10"))
+JOB_CALLBACK_ATTEMPTS = int(os.getenv("JOB_CALLBACK_ATTEMPTS", "3"))
+# Hosts permitidos para callbacks (separados por coma); vacío = callbacks deshabilitados
+JOB_CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
+# Estados de un trabajo
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# payload → resultado (serializable a JSON)
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    """Cola durable de trabajos con workers, reintentos y callbacks de finalización"""
+
+    def __init__(
+        self,
+        path: str = JOB_QUEUE_PATH,
+        workers: int = JOB_WORKERS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+
+        self._engine = create_sqlite_engine(path)
+        metadata = MetaData()
+        self._jobs = Table(
+            "jobs",
+            metadata,
+            Column("job_id", String(32), primary_key=True),
+            Column("kind", String(64), nullable=False),
+            Column("payload", Text, nullable=False),
+            Column("status", String(16), nullable=False, index=True),
+            Column("attempts", Integer, nullable=False, default=0),
+            Column("result", Text, nullable=True),
+            Column("error", Text, nullable=True),
+            Column("callback_url", Text, nullable=True),
+            Column("created_at", Float, nullable=False),
+            Column("updated_at", Float, nullable=False),
+            Column("run_after", Float, nullable=False, index=True),
+        )
+        metadata.create_all(self._engine)
+
+        self._handlers: Dict[str, JobHandler] = {}
+        self._wakeup = asyncio.Event()
+        self._worker_tasks: List[asyncio.Task] = []
+        self._callbacks: set = set()
+        self._http: Optional[httpx.AsyncClient] = None
+        self.completed = 0
+        self.failed = 0
+
+    def register(self, kind: str, handler: JobHandler):
+        """Asociar un tipo de trabajo con la corrutina que lo ejecuta"""
+        self._handlers[kind] = handler
+
+    # ---------------------------------------------------------------- encolado
+
+    @staticmethod
+    def validate_callback_url(callback_url: Optional[str]) -> Optional[str]:
+        """
+        URL de callback http(s) con host en JOB_CALLBACK_ALLOWED_HOSTS; ValueError si no
+        La URL llega en un header del cliente: sin lista configurada no se aceptan callbacks
+        """
+        if not callback_url:
+            return None
+        parsed = urlparse(callback_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError("La URL de callback debe ser http(s) absoluta")
+        if not JOB_CALLBACK_ALLOWED_HOSTS:
+            raise ValueError("Callbacks deshabilitados: configure JOB_CALLBACK_ALLOWED_HOSTS")
+        if parsed.hostname not in JOB_CALLBACK_ALLOWED_HOSTS:
+            raise ValueError(f"Host de callback no permitido: {parsed.hostname}")
+        return callback_url
+
+    @staticmethod
+    def _check_callback_addresses(callback_url: str):
+        """
+        Resolver el host y rechazar direcciones privadas, loopback o link-local (SSRF hacia
+        ACA-Py admin u otros servicios internos); se repite antes de cada envío por DNS rebinding
+        """
+        parsed = urlparse(callback_url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        try:
+            infos = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+        except socket.gaierror as e:
+            raise ValueError(f"No se pudo resolver el host de callback {parsed.hostname}: {e}")
+        for info in infos:
+            address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+            if not address.is_global or address.is_multicast:
+                raise ValueError(f"Host de callback con dirección no pública: {parsed.hostname} ({address})")
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        callback_url: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Persistir el trabajo y despertar a un worker; retorna su estado inicial"""
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        callback_url = self.validate_callback_url(callback_url)
+        if callback_url:
+            await asyncio.to_thread(self._check_callback_addresses, callback_url)
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "payload": json.dumps(payload, ensure_ascii=False),
+            "status": JOB_QUEUED,
+            "attempts": 0,
+            "callback_url": callback_url,
+            "created_at": now,
+            "updated_at": now,
+            "run_after": now,
+        }
+        await asyncio.to_thread(self._insert_sync, job)
+        metrics.increment("jobs_enqueued")
+        self._wakeup.set()
+        return self._describe(job)
+
+    def _insert_sync(self, job: Dict[str, Any]):
+        with self._engine.begin() as conn:
+            conn.execute(self._jobs.insert().values(**job))
+
+    # ---------------------------------------------------------------- consulta
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = await asyncio.to_thread(self._get_sync, job_id)
+        return self._describe(row) if row else None
+
+    def _get_sync(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._engine.connect() as conn:
+            row = conn.execute(select(self._jobs).where(self._jobs.c.job_id == job_id)).first()
+        return dict(row._mapping) if row is not None else None
+
+    @staticmethod
+    def _describe(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "job_id": row["job_id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "result": json.loads(row["result"]) if row.get("result") else None,
+            "error": row.get("error"),
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    # ------------------------------------------------------------------ claim
+
+    def _claim_sync(self) -> Optional[Dict[str, Any]]:
+        """
+        Tomar el próximo trabajo listo: el UPDATE condicionado al estado leído
+        garantiza que un solo worker (o proceso) se lo quede
+        """
+        now = time.time()
+        ready = (
+            (self._jobs.c.status == JOB_QUEUED) & (self._jobs.c.run_after <= now)
+        ) | (
+            (self._jobs.c.status == JOB_RUNNING) & (self._jobs.c.updated_at <= now - JOB_LEASE_SECONDS)
+        )
+        with self._engine.begin() as conn:
+            row = conn.execute(
+                select(self._jobs).where(ready).order_by(self._jobs.c.run_after).limit(1)
+            ).first()
+            if row is None:
+                return None
+            job = dict(row._mapping)
+            claimed = conn.execute(
+                self._jobs.update()
+                .where(
+                    self._jobs.c.job_id == job["job_id"],
+                    self._jobs.c.status == job["status"],
+                    self._jobs.c.updated_at == job["updated_at"],
+                )
+                .values(status=JOB_RUNNING, attempts=job["attempts"] + 1, updated_at=now)
+            ).rowcount
+        if not claimed:
+            return None
+        job.update(status=JOB_RUNNING, attempts=job["attempts"] + 1, updated_at=now)
+        return job
+
+    def _finish_sync(self, job_id: str, values: Dict[str, Any]):
+        values["updated_at"] = time.time()
+        with self._engine.begin() as conn:
+            conn.execute(self._jobs.update().where(self._jobs.c.job_id == job_id).values(**values))
+
+    def _purge_sync(self) -> int:
+        cutoff = time.time() - JOB_RESULT_TTL
+        with self._engine.begin() as conn:
+            return conn.execute(
+                self._jobs.delete().where(
+                    self._jobs.c.status.in_([JOB_SUCCEEDED, JOB_FAILED]),
+                    self._jobs.c.updated_at <= cutoff,
+                )
+            ).rowcount
+
+    def _depth_sync(self) -> int:
+        with self._engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(self._jobs).where(self._jobs.c.status == JOB_QUEUED)
+            ).scalar_one()
+
+    # -------------------------------------------------------------- ejecución
+
+    async def _run_job(self, job: Dict[str, Any]):
+        handler = self._handlers.get(job["kind"])
+        queued_for = time.time() - job["created_at"]
+        try:
+            if handler is None:
+                raise RuntimeError(f"Sin handler para trabajos '{job['kind']}'")
+            with metrics.timer("job_run"):
+                result = await handler(json.loads(job["payload"]))
+        except asyncio.CancelledError:
+            # Shutdown: vuelve a la cola sin consumir el intento
+            await asyncio.to_thread(
+                self._finish_sync, job["job_id"], {"status": JOB_QUEUED, "attempts": job["attempts"] - 1}
+            )
+            raise
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e) or e.__class__.__name__
+            if job["attempts"] < self.max_attempts:
+                delay = JOB_RETRY_DELAY * (2 ** (job["attempts"] - 1))
+                await asyncio.to_thread(self._finish_sync, job["job_id"], {
+                    "status": JOB_QUEUED, "error": str(error), "run_after": time.time() + delay,
+                })
+                metrics.increment("jobs_retried")
+                logger.warning(
+                    f"⚠️ Trabajo {job['job_id']} ({job['kind']}) falló, reintento "
+                    f"{job['attempts']}/{self.max_attempts} en {delay:.0f}s: {error}"
+                )
+                return
+            await asyncio.to_thread(self._finish_sync, job["job_id"], {"status": JOB_FAILED, "error": str(error)})
+            self.failed += 1
+            metrics.increment("jobs_failed")
+            logger.error(f"❌ Trabajo {job['job_id']} ({job['kind']}) falló definitivamente: {error}")
+        else:
+            await asyncio.to_thread(self._finish_sync, job["job_id"], {
+                "status": JOB_SUCCEEDED, "result": json.dumps(result, ensure_ascii=False), "error": None,
+            })
+            self.completed += 1
+            metrics.increment("jobs_succeeded")
+            metrics.observe("job_queue_wait", queued_for)
+            logger.info(f"✅ Trabajo {job['job_id']} ({job['kind']}) completado")
+
+        if job.get("callback_url"):
+            task = asyncio.create_task(self._notify(job["job_id"], job["callback_url"]))
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+
+    async def _notify(self, job_id: str, callback_url: str):
+        """POST del estado final a la URL de callback (best effort, con reintentos)"""
+        job = await self.get(job_id)
+        for attempt in range(1, JOB_CALLBACK_ATTEMPTS + 1):
+            try:
+                await asyncio.to_thread(self._check_callback_addresses, callback_url)
+            except ValueError as e:
+                metrics.increment("job_callbacks_failed")
+                logger.warning(f"⚠️ Callback del trabajo {job_id} bloqueado: {e}")
+                return
+            try:
+                response = await self._http.post(callback_url, json=job)
+                if response.status_code < 400:
+                    metrics.increment("job_callbacks_sent")
+                    return
+                error = f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                error = str(e) or e.__class__.__name__
+            if attempt < JOB_CALLBACK_ATTEMPTS:
+                await asyncio.sleep(JOB_RETRY_DELAY * attempt)
+        metrics.increment("job_callbacks_failed")
+        logger.warning(f"⚠️ Callback del trabajo {job_id} a {callback_url} falló: {error}")
+
+    async def _worker_loop(self):
+        while True:
+            job = await asyncio.to_thread(self._claim_sync)
+            if job is None:
+                # Sin trabajos listos: esperar un encolado local o el próximo sondeo
+                # (reintentos diferidos y trabajos encolados por otros procesos)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en worker de trabajos: {e}")
+
+    async def _maintenance_loop(self):
+        while True:
+            try:
+                metrics.set_gauge("job_queue_depth", await asyncio.to_thread(self._depth_sync))
+                purged = await asyncio.to_thread(self._purge_sync)
+                if purged:
+                    logger.info(f"🧹 {purged} trabajos terminados purgados")
+            except Exception as e:
+                logger.warning(f"⚠️ Mantenimiento de la cola de trabajos: {e}")
+            await asyncio.sleep(60)
+
+    def start(self):
+        """Iniciar el pool de workers (evento startup); retoma lo pendiente en la base"""
+        if self._worker_tasks:
+            return
+        self._http = httpx.AsyncClient(timeout=JOB_CALLBACK_TIMEOUT)
+        self._worker_tasks = [asyncio.create_task(self._worker_loop()) for _ in range(self.workers)]
+        self._worker_tasks.append(asyncio.create_task(self._maintenance_loop()))
+        logger.info(f"✅ Cola de trabajos iniciada: {self.workers} workers")
+
+    async def stop(self):
+        """Detener los workers (evento shutdown); lo que estaba en curso vuelve a la cola"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._callbacks:
+            await asyncio.gather(*self._callbacks, return_exceptions=True)
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        self._engine.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": bool(self._worker_tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "pending_callbacks": len(self._callbacks),
+            "kinds": sorted(self._handlers),
+        }
+
+
+# Instancia compartida del Controller
+job_queue = JobQueue()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Ledger Artifacts - Manifest persistente de Schemas y Credential Definitions de ACA-Py
+Evita consultar /credential-definitions/created en cada emisión y permite que el
+arranque verifique los artefactos ya publicados en lugar de volver a crearlos
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Dict, Any, Optional, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Archivo donde se persiste el manifest
+LEDGER_ARTIFACTS_PATH = os.getenv("LEDGER_ARTIFACTS_PATH", "/var/lib/controller/ledger_artifacts.json")
+
+
+def _registry_key(schema_name: str, schema_version: str, tag: str) -> str:
+    return f"{schema_name}:{schema_version}:{tag}"
+
+
+def _schema_key(schema_name: str, schema_version: str) -> str:
+    return f"{schema_name}:{schema_version}"
+
+
+def parse_cred_def_tag(cred_def_id: str) -> Optional[str]:
+    """Extraer el tag de un cred def ID Indy (``<did>:3:CL:<seq>:<tag>``)"""
+    parts = cred_def_id.split(":")
+    if len(parts) >= 5 and parts[1] == "3":
+        return parts[-1]
+    return None
+
+
+class CredentialDefinitionRegistry:
+    """Registro (schema_name, schema_version, tag) → cred def ID, persistido en JSON
+
+    El mismo archivo guarda también los schemas publicados (name, version) → schema ID
+    """
+
+    def __init__(self, path: str = LEDGER_ARTIFACTS_PATH):
+        self.path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._schemas: Dict[str, Dict[str, Any]] = {}
+        self._lock = asyncio.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._entries = data.get("credential_definitions", {})
+            self._schemas = data.get("schemas", {})
+            logger.info(
+                f"📂 Manifest de ledger cargado: {len(self._schemas)} schemas, "
+                f"{len(self._entries)} cred defs"
+            )
+        except FileNotFoundError:
+            self._entries = {}
+            self._schemas = {}
+        except Exception as e:
+            logger.warning(f"⚠️ Manifest de ledger ilegible, se reconstruirá: {e}")
+            self._entries = {}
+            self._schemas = {}
+
+    def _save_sync(self, snapshot: Dict[str, Any]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    async def _save(self):
+        snapshot = {
+            "schemas": dict(self._schemas),
+            "credential_definitions": dict(self._entries),
+        }
+        try:
+            await asyncio.to_thread(self._save_sync, snapshot)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo persistir el manifest de ledger: {e}")
+
+    def lookup(
+        self,
+        schema_name: Optional[str] = None,
+        schema_version: Optional[str] = None,
+        tag: Optional[str] = None,
+    ) -> Optional[str]:
+        """Buscar un cred def ID en memoria; los filtros omitidos no se aplican"""
+        for entry in self._entries.values():
+            if schema_name and entry.get("schema_name") != schema_name:
+                continue
+            if schema_version and entry.get("schema_version") != schema_version:
+                continue
+            if tag and entry.get("tag") != tag:
+                continue
+            return entry["cred_def_id"]
+        return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        return list(self._entries.values())
+
+    def get_schema_id(self, schema_name: str, schema_version: str) -> Optional[str]:
+        entry = self._schemas.get(_schema_key(schema_name, schema_version))
+        return entry["schema_id"] if entry else None
+
+    async def register_schema(
+        self,
+        schema_name: str,
+        schema_version: str,
+        schema_id: str,
+        attributes: Optional[List[str]] = None,
+    ):
+        """Registrar un schema publicado y persistir"""
+        self._schemas[_schema_key(schema_name, schema_version)] = {
+            "schema_name": schema_name,
+            "schema_version": schema_version,
+            "schema_id": schema_id,
+            "attributes": attributes or [],
+            "registered_at": datetime.utcnow().isoformat(),
+        }
+        await self._save()
+        logger.info(f"📌 Schema registrado: {schema_id}")
+
+    async def forget_schema(self, schema_name: str, schema_version: str):
+        if self._schemas.pop(_schema_key(schema_name, schema_version), None) is not None:
+            await self._save()
+
+    async def verify_cred_def(self, acapy, cred_def_id: str) -> Optional[bool]:
+        """
+        Comprobar con una consulta local al wallet de ACA-Py (sin ledger) que el cred def existe
+        Retorna None si ACA-Py no pudo responder (estado desconocido)
+        """
+        response = await acapy.get(
+            "/credential-definitions/created",
+            params={"cred_def_id": cred_def_id},
+        )
+        if response.status_code != 200:
+            return None
+        return cred_def_id in response.json().get("credential_definition_ids", [])
+
+    async def resolve_schema(self, acapy, schema_name: str, schema_version: str) -> Optional[str]:
+        """Obtener el schema ID del manifest o, si falta, de los schemas creados en el wallet"""
+        response = await acapy.get(
+            "/schemas/created",
+            params={"schema_name": schema_name, "schema_version": schema_version},
+        )
+        if response.status_code != 200:
+            return None
+
+        created = response.json().get("schema_ids", [])
+        schema_id = self.get_schema_id(schema_name, schema_version)
+        if schema_id and schema_id in created:
+            return schema_id
+        if created:
+            await self.register_schema(schema_name, schema_version, created[0])
+            return created[0]
+        if schema_id:
+            # El manifest apunta a un schema que el wallet ya no conoce
+            await self.forget_schema(schema_name, schema_version)
+        return None
+
+    async def register(
+        self,
+        schema_name: str,
+        schema_version: str,
+        tag: str,
+        cred_def_id: str,
+        schema_id: Optional[str] = None,
+    ):
+        """Registrar (o actualizar) un cred def y persistir"""
+        self._entries[_registry_key(schema_name, schema_version, tag)] = {
+            "schema_name": schema_name,
+            "schema_version": schema_version,
+            "tag": tag,
+            "schema_id": schema_id,
+            "cred_def_id": cred_def_id,
+            "registered_at": datetime.utcnow().isoformat(),
+        }
+        await self._save()
+        logger.info(f"📌 Cred def registrado: {cred_def_id}")
+
+    async def invalidate(self, cred_def_id: Optional[str] = None) -> int:
+        """Eliminar un cred def (o todos si no se indica); retorna cuántos se eliminaron"""
+        if cred_def_id is None:
+            removed = len(self._entries)
+            self._entries = {}
+        else:
+            keys = [k for k, e in self._entries.items() if e.get("cred_def_id") == cred_def_id]
+            for k in keys:
+                del self._entries[k]
+            removed = len(keys)
+        if removed:
+            await self._save()
+            logger.info(f"🗑️ Registro de cred defs invalidado: {removed} entradas")
+        return removed
+
+    async def resolve(self, acapy, schema_name: str, schema_version: str, tag: str) -> Optional[str]:
+        """
+        Obtener el cred def ID; solo consulta ACA-Py si no está en el registro
+        ``acapy`` es el AcaPyClient compartido
+        """
+        cred_def_id = self.lookup(schema_name, schema_version, tag)
+        if cred_def_id:
+            return cred_def_id
+
+        # Un único fetch aunque lleguen muchas emisiones a la vez
+        async with self._lock:
+            cred_def_id = self.lookup(schema_name, schema_version, tag)
+            if cred_def_id:
+                return cred_def_id
+
+            response = await acapy.get(
+                "/credential-definitions/created",
+                params={"schema_name": schema_name, "schema_version": schema_version},
+            )
+            if response.status_code != 200:
+                logger.warning(f"⚠️ No se pudo consultar cred defs en ACA-Py: {response.status_code}")
+                return None
+
+            for candidate in response.json().get("credential_definition_ids", []):
+                if parse_cred_def_tag(candidate) == tag:
+                    await self.register(schema_name, schema_version, tag, candidate)
+                    return candidate
+            return None
+
+
+# Instancia compartida del Controller
+cred_def_registry = CredentialDefinitionRegistry()
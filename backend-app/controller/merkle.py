@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Merkle - Árbol de Merkle SHA-256 para anclar lotes de credenciales en Fabric
+Una sola transacción (la raíz) cubre todas las credenciales del lote y cada
+credencial conserva su prueba de inclusión
+
+Hojas y nodos internos usan prefijos distintos (0x00 / 0x01) para evitar ataques
+de segunda preimagen; un nodo sin pareja sube sin duplicarse al nivel siguiente.
+"""
+
+import hashlib
+from typing import List, Dict, Any
+
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def hash_leaf(credential_hash: str) -> str:
+    """Hash de hoja a partir del hash SHA-256 (hex) de la credencial"""
+    return hashlib.sha256(LEAF_PREFIX + bytes.fromhex(credential_hash)).hexdigest()
+
+
+def hash_node(left: str, right: str) -> str:
+    return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def build_tree(credential_hashes: List[str]) -> List[List[str]]:
+    """Construir todos los niveles del árbol (nivel 0 = hojas, último = [raíz])"""
+    if not credential_hashes:
+        raise ValueError("No se puede construir un árbol de Merkle vacío")
+
+    levels = [[hash_leaf(h) for h in credential_hashes]]
+    while len(levels[-1]) > 1:
+        current = levels[-1]
+        parent = []
+        for i in range(0, len(current), 2):
+            if i + 1 < len(current):
+                parent.append(hash_node(current[i], current[i + 1]))
+            else:
+                parent.append(current[i])
+        levels.append(parent)
+    return levels
+
+
+def merkle_root(levels: List[List[str]]) -> str:
+    return levels[-1][0]
+
+
+def inclusion_proof(levels: List[List[str]], index: int) -> List[Dict[str, str]]:
+    """Prueba de inclusión de la hoja ``index``: hermanos desde la hoja hasta la raíz"""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({
+                "position": "left" if sibling < index else "right",
+                "hash": level[sibling],
+            })
+        index //= 2
+    return proof
+
+
+def verify_proof(credential_hash: str, proof: List[Dict[str, Any]], root: str) -> bool:
+    """Verificar localmente (sin consultar el ledger) que la credencial pertenece a la raíz"""
+    try:
+        current = hash_leaf(credential_hash)
+        for step in proof:
+            if step["position"] == "left":
+                current = hash_node(step["hash"], current)
+            elif step["position"] == "right":
+                current = hash_node(current, step["hash"])
+            else:
+                return False
+        return current == root
+    except (KeyError, TypeError, ValueError):
+        return False
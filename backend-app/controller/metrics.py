@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Metrics - Métricas en proceso (contadores, gauges e histogramas de latencia)
+Expuestas en formato JSON por el endpoint /metrics del Controller
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+# Límites superiores de los buckets en milisegundos
+DEFAULT_LATENCY_BUCKETS_MS: List[float] = [
+    1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000
+]
+
+
+class LatencyHistogram:
+    """Histograma de latencias con buckets fijos (acumulativos al exportar)"""
+
+    def __init__(self, buckets_ms: Optional[List[float]] = None):
+        self.buckets_ms = list(buckets_ms or DEFAULT_LATENCY_BUCKETS_MS)
+        self._counts = [0] * (len(self.buckets_ms) + 1)  # último = +Inf
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000.0
+        with self._lock:
+            index = len(self.buckets_ms)
+            for i, upper in enumerate(self.buckets_ms):
+                if ms <= upper:
+                    index = i
+                    break
+            self._counts[index] += 1
+            self.count += 1
+            self.sum_ms += ms
+            if ms > self.max_ms:
+                self.max_ms = ms
+
+    def percentile(self, q: float) -> float:
+        """Percentil aproximado (límite superior del bucket que lo contiene)"""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            running = 0
+            for i, c in enumerate(self._counts):
+                running += c
+                if running >= target:
+                    return self.buckets_ms[i] if i < len(self.buckets_ms) else self.max_ms
+            return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            cumulative = {}
+            running = 0
+            for upper, c in zip(self.buckets_ms, self._counts):
+                running += c
+                cumulative[f"le_{upper:g}ms"] = running
+            cumulative["le_inf"] = self.count
+            count, sum_ms, max_ms = self.count, self.sum_ms, self.max_ms
+        return {
+            "count": count,
+            "avg_ms": round(sum_ms / count, 3) if count else 0.0,
+            "max_ms": round(max_ms, 3),
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": cumulative,
+        }
+
+
+class MetricsRegistry:
+    """Registro de métricas del proceso, agrupadas por nombre"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = LatencyHistogram()
+            return hist
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.histogram(name).observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Medir la duración de un bloque: ``with metrics.timer("x"): ...``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms = dict(self._histograms)
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "latency": {name: h.snapshot() for name, h in sorted(histograms.items())},
+        }
+
+
+# Registro global del Controller
+metrics = MetricsRegistry()
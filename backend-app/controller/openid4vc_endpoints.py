@@ -5,24 +5,47 @@ Compatible con Lissi Wallet y certificados SSL/TLS mejorados
 Incluye configuración de seguridad SSL para Android y validación PKI
 """
 
+import os
 import json
 import jwt
 import base64
+import secrets
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from urllib.parse import urlencode
 import ssl
 import asyncio
 
-from fastapi import APIRouter, HTTPException, Header, Request, Query
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import APIRouter, HTTPException, Header, Request, Query, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from pydantic import BaseModel, Field
 from typing import Dict, Any, Optional
 import httpx
 import structlog
 
+from admin_auth import require_admin
+from pending_store import get_pending_store
+from credential_signer import CredentialSigner, Keyring, OPENID_KEYRING_DIR, LEGACY_OPENID_KEY_DIR
+from signing_executor import SigningExecutor, SigningOverloadedError
+from status_list import StatusListService, STATUS_LIST_CONTEXT, STATUS_LIST_MAX_AGE
+from credential_verifier import CredentialVerifier, OPENID_VERIFY_MAX_BATCH
+from qr_cache import qr_cache, TTLCache, QR_CACHE_MAX_ENTRIES
+from qr_render import qr_renderer, QR_INLINE_BASE64
+from qr_generator import QR_RENDERERS
+
 logger = structlog.get_logger()
 
+# Store compartido de credenciales pendientes (mismo backend que el flujo DIDComm)
+pending_store = get_pending_store()
+PENDING_OPENID_NAMESPACE = "openid"
+PENDING_OFFER_NAMESPACE = "openid_offer"
+
+# Credential offer por referencia: el QR lleva solo credential_offer_uri y el wallet
+# descarga el JSON de /oid4vc/credential-offer/{offer_id} (QR de versión mucho menor)
+OPENID_OFFER_BY_REFERENCE = os.getenv("OPENID_OFFER_BY_REFERENCE", "true").lower() == "true"
+OPENID_OFFER_TTL = int(os.getenv("OPENID_OFFER_TTL", "600"))
+offer_cache = TTLCache(name="openid_offers", max_entries=QR_CACHE_MAX_ENTRIES, default_ttl=OPENID_OFFER_TTL)
+
 # Router para endpoints OpenID4VC
 oid4vc_router = APIRouter(prefix="/oid4vc", tags=["OpenID4VC"])
 
@@ -48,16 +71,29 @@ def get_or_generate_es256_key():
     Las claves pueden proveerse mediante las variables de entorno
     ``OPENID_PRIVATE_KEY`` y ``OPENID_PUBLIC_KEY``. Si no se encuentran,
     se genera un nuevo par utilizando ``cryptography`` y se guarda
-    de forma persistente en ``/var/lib/openid4vc/keys``.
+    de forma persistente en ``OPENID_KEYRING_DIR`` (junto al keyring).
 
     Retorna tuple ``(private_key_pem, public_key_pem)``.
     """
     import os
-    key_dir = "/var/lib/openid4vc/keys"
+    import shutil
+    key_dir = OPENID_KEYRING_DIR
     os.makedirs(key_dir, mode=0o700, exist_ok=True)
     key_file = os.path.join(key_dir, "openid4vc_es256_key.pem")
     pub_key_file = os.path.join(key_dir, "openid4vc_es256_public.pem")
 
+    # Migrar clave semilla y keyring de la ubicación anterior para no perder claves al actualizar
+    if (
+        os.path.abspath(key_dir) != os.path.abspath(LEGACY_OPENID_KEY_DIR)
+        and not os.path.exists(key_file)
+        and os.path.exists(os.path.join(LEGACY_OPENID_KEY_DIR, "openid4vc_es256_key.pem"))
+    ):
+        for name in os.listdir(LEGACY_OPENID_KEY_DIR):
+            source = os.path.join(LEGACY_OPENID_KEY_DIR, name)
+            if os.path.isfile(source) and not os.path.exists(os.path.join(key_dir, name)):
+                shutil.copy2(source, os.path.join(key_dir, name))
+        logger.info(f"🔑 Claves ES256 migradas de {LEGACY_OPENID_KEY_DIR} a {key_dir}")
+
     # Intentar cargar claves desde variables de entorno/secret manager
     env_private = os.getenv("OPENID_PRIVATE_KEY")
     env_public = os.getenv("OPENID_PUBLIC_KEY")
@@ -132,6 +168,27 @@ def get_or_generate_es256_key():
 # variables de entorno ``OPENID_PRIVATE_KEY`` y ``OPENID_PUBLIC_KEY``.
 PRIVATE_KEY, PUBLIC_KEY = get_or_generate_es256_key()
 
+# Keyring de firma: la clave anterior pasa a ser la primera clave activa (kid = thumbprint RFC 7638)
+# Claves parseadas una sola vez para todas las firmas y verificaciones
+signing_keyring = Keyring(OPENID_KEYRING_DIR)
+signing_keyring.load(seed_private_pem=PRIVATE_KEY)
+credential_signer = CredentialSigner(signing_keyring)
+# Firmas en un pool fuera del event loop (emisión masiva)
+signing_executor = SigningExecutor(credential_signer)
+
+# Revocación: un índice por credencial en listas StatusList2021 compartidas
+status_lists = StatusListService(
+    base_url=f"{ISSUER_BASE_URL}/status",
+    issuer=ISSUER_URL,
+    sign=signing_executor.sign,
+)
+
+# Verificación local de VCs (el Controller conecta el anclaje Fabric al iniciar)
+credential_verifier = CredentialVerifier(credential_signer, status_lists)
+
+# Los wallets/verificadores cachean el JWKS y revalidan con If-None-Match
+OPENID_JWKS_MAX_AGE = int(os.getenv("OPENID_JWKS_MAX_AGE", "300"))
+
 # Configuración para compatibilidad Android/Lissi Wallet
 TLS_PROTOCOLS_SUPPORTED = ["TLSv1.2", "TLSv1.3"]
 CIPHER_SUITES_ANDROID = [
@@ -153,6 +210,15 @@ class CredentialOfferRequest(BaseModel):
     course_name: str = Field(..., min_length=1, max_length=300, description="Course name")
     completion_date: str = Field(..., description="Course completion date")
     grade: str = Field(..., min_length=1, max_length=10, description="Final grade")
+    course_id: Optional[str] = Field(None, min_length=1, max_length=100, description="Course ID (forma parte del hash anclado en Fabric)")
+
+class VerifyCredentialsRequest(BaseModel):
+    credential: Optional[str] = Field(None, description="VC JWT a verificar")
+    credentials: Optional[List[str]] = Field(None, description="Lote de VC JWT a verificar")
+    check_anchor: bool = Field(False, description="Comprobar además el anclaje en Fabric")
+
+class RevokeCredentialRequest(BaseModel):
+    credential_id: str = Field(..., min_length=1, max_length=255, description="VC id (urn:credential:...)")
 
 # Función para añadir headers de seguridad SSL
 async def add_security_headers(response: JSONResponse) -> JSONResponse:
@@ -170,6 +236,15 @@ async def add_security_headers(response: JSONResponse) -> JSONResponse:
     
     return response
 
+def signing_overloaded(e: SigningOverloadedError) -> HTTPException:
+    """503 + Retry-After cuando el pool de firma aplica backpressure"""
+    logger.warning(f"⏳ Firma rechazada por backpressure: {e}")
+    return HTTPException(
+        status_code=503,
+        detail={"error": "temporarily_unavailable", "error_description": str(e)},
+        headers={"Retry-After": "1"}
+    )
+
 # ENDPOINT 1: Metadata del Issuer (requerido por OpenID4VC) - MEJORADO
 @oid4vc_router.get("/.well-known/openid-credential-issuer")
 async def credential_issuer_metadata(request: Request):
@@ -217,139 +292,262 @@ async def credential_issuer_metadata(request: Request):
     response = JSONResponse(content=metadata)
     return await add_security_headers(response)
 
-# ENDPOINT 1.1: JWKS endpoint (requerido para validación SSL/TLS)
+# ENDPOINT 1.1: JWKS endpoint (claves públicas del keyring de firma)
 @oid4vc_router.get("/.well-known/jwks.json")
-async def jwks_endpoint():
+async def jwks_endpoint(request: Request):
     """
-    JSON Web Key Set endpoint - requerido para validación de certificados SSL
-    Compatible con Lissi Wallet y estándares de seguridad Android
+    JSON Web Key Set con la clave activa y las retiradas (para verificar VCs ya emitidas)
+    Documento precalculado por el keyring; ETag fuerte + If-None-Match → 304
     """
-    # Generar JWK desde la clave privada (implementación simplificada para demo)
-    # En producción, usar bibliotecas como python-jose o authlib
-    jwks = {
-        "keys": [
-            {
-                "kty": "EC",
-                "use": "sig",
-                "crv": "P-256",
-                "kid": "utnpf-ssl-key-2025",
-                "x": "t7eP9kR5F3gN2vQ8mL6yE2nF7K9aZ3QhM2nF7vE8wL6",
-                "y": "vN4xShRANCAATt7eP9kR5F3gN2vQ8mL6yE2nF7K9aZ3",
-                "alg": "ES256"
-            }
-        ]
+    signing_keyring.refresh()
+    headers = dict(SSL_SECURITY_HEADERS)
+    headers.update({
+        "ETag": signing_keyring.jwks_etag,
+        "Cache-Control": f"public, max-age={OPENID_JWKS_MAX_AGE}",
+        "Access-Control-Allow-Origin": "*",
+    })
+    if_none_match = request.headers.get("if-none-match", "")
+    if signing_keyring.jwks_etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=signing_keyring.jwks_body, media_type="application/jwk-set+json", headers=headers)
+
+# ADMINISTRACIÓN DE CLAVES DE FIRMA
+
+@oid4vc_router.get("/admin/keys", dependencies=[Depends(require_admin)])
+async def list_signing_keys():
+    """Claves del keyring (kid, estado, fechas); nunca expone material privado"""
+    signing_keyring.refresh()
+    return {"active": signing_keyring.active_kid, "keys": signing_keyring.describe()}
+
+@oid4vc_router.post("/admin/keys/rotate", dependencies=[Depends(require_admin)])
+async def rotate_signing_key():
+    """Generar una nueva clave activa; la anterior sigue publicada en el JWKS para verificación"""
+    key = await asyncio.to_thread(signing_keyring.rotate)
+    return {"status": "rotated", "active": key.kid, "keys": signing_keyring.describe()}
+
+@oid4vc_router.delete("/admin/keys/{kid}", dependencies=[Depends(require_admin)])
+async def remove_signing_key(kid: str):
+    """Quitar una clave retirada del keyring (las VCs firmadas con ella dejan de verificarse)"""
+    if kid == signing_keyring.active_kid:
+        raise HTTPException(status_code=409, detail="No se puede eliminar la clave activa; rote primero")
+    if not await asyncio.to_thread(signing_keyring.remove, kid):
+        raise HTTPException(status_code=404, detail="kid no encontrado")
+    return {"status": "removed", "kid": kid}
+
+# LISTAS DE ESTADO (revocación StatusList2021)
+
+@oid4vc_router.get("/status/{list_id}")
+async def status_list_credential(list_id: int, request: Request):
+    """
+    StatusList2021Credential firmada (JWT) con el bitstring comprimido de la lista
+    Una descarga cubre todas las credenciales de la lista; el ETag identifica el JWT
+    servido (hash del token), así que una re-firma o un cambio de bits invalida el 304
+    """
+    try:
+        published = await status_lists.get_list_credential(list_id)
+    except SigningOverloadedError as e:
+        raise signing_overloaded(e)
+    if published is None:
+        raise HTTPException(status_code=404, detail="Lista de estado no encontrada")
+
+    headers = dict(SSL_SECURITY_HEADERS)
+    headers.update({
+        "ETag": published["etag"],
+        "Cache-Control": f"public, max-age={STATUS_LIST_MAX_AGE}",
+        "Access-Control-Allow-Origin": "*",
+    })
+    if_none_match = request.headers.get("if-none-match", "")
+    if published["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=published["token"], media_type="application/vc+jwt", headers=headers)
+
+@oid4vc_router.get("/admin/status", dependencies=[Depends(require_admin)])
+async def get_credential_status(credential_id: str):
+    """Índice asignado y estado de revocación de una credencial"""
+    entry = await status_lists.get_entry(credential_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Credencial sin entrada en listas de estado")
+    return entry
+
+@oid4vc_router.post("/admin/status/revoke", dependencies=[Depends(require_admin)])
+async def revoke_credential(request: RevokeCredentialRequest):
+    """Revocar una credencial emitida (marca su bit en la lista de estado)"""
+    result = await status_lists.revoke(request.credential_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Credencial sin entrada en listas de estado")
+    return result
+
+# VERIFICACIÓN DE CREDENCIALES
+
+@oid4vc_router.post("/verify")
+async def verify_credentials(request: VerifyCredentialsRequest):
+    """
+    Verificar una o varias VCs JWT de este issuer: firma (kid), expiración,
+    revocación (lista de estado en memoria) y opcionalmente anclaje en Fabric
+    """
+    tokens = list(request.credentials or [])
+    if request.credential:
+        tokens.insert(0, request.credential)
+    if not tokens:
+        raise HTTPException(status_code=400, detail="Indique credential o credentials")
+    if len(tokens) > OPENID_VERIFY_MAX_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {OPENID_VERIFY_MAX_BATCH} credenciales por solicitud"
+        )
+
+    results = await credential_verifier.verify_many(tokens, check_anchor=request.check_anchor)
+    valid = sum(1 for result in results if result["valid"])
+    return {
+        "results": results,
+        "summary": {"total": len(results), "valid": valid, "invalid": len(results) - valid}
     }
-    
-    response = JSONResponse(content=jwks)
-    return await add_security_headers(response)
 
 # ENDPOINT 2: Crear Credential Offer compatible con Lissi - MEJORADO
 @oid4vc_router.post("/credential-offer")
-async def create_openid_credential_offer(request: CredentialOfferRequest):
+async def create_openid_credential_offer(
+    request: CredentialOfferRequest,
+    inline_qr: Optional[bool] = None,
+    by_reference: Optional[bool] = None
+):
     """
     Crear Credential Offer compatible con Lissi Wallet
     Incluye configuración SSL y validación mejorada para Android
+    
+    ``inline_qr=false`` omite el QR en base64; el wallet/página usa ``qr_image_url``
+    ``by_reference=false`` vuelve a incrustar el offer completo en el QR (credential_offer=...)
     """
     try:
-        logger.info(f"🆕 Creando Credential Offer OpenID4VC para: {request.student_name}")
-        
-        # Validaciones adicionales para seguridad
-        if len(request.student_id) < 3:
-            raise HTTPException(status_code=400, detail="Student ID debe tener al menos 3 caracteres")
-        
-        # Generar pre-authorized code único con timestamp para evitar replay attacks
-        timestamp = int(datetime.now().timestamp())
-        pre_auth_code = f"pre_auth_{request.student_id}_{timestamp}_{hash(request.student_email) % 10000}"
-        
-        # Almacenar datos pendientes con expiración y metadatos OpenID4VC
-        await store_pending_openid_credential(pre_auth_code, request.dict(), expires_in=600)
+        response_data = await build_credential_offer(request, inline_qr=inline_qr, by_reference=by_reference)
+        response = JSONResponse(content=response_data)
+        return await add_security_headers(response)
         
-        # Crear Credential Offer según OpenID4VCI Draft-16 (formato estricto)
-        offer = {
-            "credential_issuer": ISSUER_URL,
-            "credential_configuration_ids": ["UniversityCredential"],
-            "grants": {
-                "urn:ietf:params:oauth:grant-type:pre-authorized_code": {
-                    "pre-authorized_code": pre_auth_code
-                }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error creando Credential Offer OpenID4VC: {e}")
+        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+
+async def build_credential_offer(
+    request: CredentialOfferRequest,
+    inline_qr: Optional[bool] = None,
+    by_reference: Optional[bool] = None
+) -> Dict[str, Any]:
+    """Armar y almacenar un Credential Offer (endpoint individual y emisión por cohortes)"""
+    logger.info(f"🆕 Creando Credential Offer OpenID4VC para: {request.student_name}")
+
+    # Validaciones adicionales para seguridad
+    if len(request.student_id) < 3:
+        raise HTTPException(status_code=400, detail="Student ID debe tener al menos 3 caracteres")
+
+    # Generar pre-authorized code único con timestamp para evitar replay attacks
+    # (sufijo aleatorio: un mismo estudiante puede recibir varias ofertas en el mismo segundo)
+    timestamp = int(datetime.now().timestamp())
+    pre_auth_code = f"pre_auth_{request.student_id}_{timestamp}_{secrets.token_hex(4)}"
+
+    # Almacenar datos pendientes con expiración y metadatos OpenID4VC
+    await store_pending_openid_credential(pre_auth_code, request.dict(), expires_in=600)
+
+    # Crear Credential Offer según OpenID4VCI Draft-16 (formato estricto)
+    offer = {
+        "credential_issuer": ISSUER_URL,
+        "credential_configuration_ids": ["UniversityCredential"],
+        "grants": {
+            "urn:ietf:params:oauth:grant-type:pre-authorized_code": {
+                "pre-authorized_code": pre_auth_code
             }
         }
-        
+    }
+
+    from urllib.parse import quote
+
+    credential_offer_uri = None
+    if OPENID_OFFER_BY_REFERENCE if by_reference is None else by_reference:
+        # Por referencia: el QR solo lleva la URI del offer
+        offer_id = secrets.token_urlsafe(16)
+        credential_offer_uri = f"{ISSUER_BASE_URL}/credential-offer/{offer_id}"
+        offer_cache.set(offer_id, offer)
+        await pending_store.put(PENDING_OFFER_NAMESPACE, offer_id, offer, OPENID_OFFER_TTL)
+        qr_url = f"openid-credential-offer://?credential_offer_uri={quote(credential_offer_uri, safe='')}"
+    else:
         # Codificar offer para QR según RFC estándar
         offer_json = json.dumps(offer, separators=(',', ':'))  # Compact JSON
-        
+
         # Usar URL encoding estándar según OpenID4VC spec
-        from urllib.parse import quote
         offer_encoded = quote(offer_json, safe='')
-        
+
         # Usar esquema URI estándar según spec OpenID4VC Draft-16
         qr_url = f"openid-credential-offer://?credential_offer={offer_encoded}"
-        
-        # Validar longitud del QR (máximo para QR codes estándar)
-        if len(qr_url) > 1800:  # Límite más conservador para compatibilidad
-            logger.warning(f"⚠️ QR URL muy largo: {len(qr_url)} chars, puede fallar en algunos wallets")
-        
-        # Generar QR con configuración optimizada
+
+    # Validar longitud del QR (máximo para QR codes estándar)
+    if len(qr_url) > 1800:  # Límite más conservador para compatibilidad
+        logger.warning(f"⚠️ QR URL muy largo: {len(qr_url)} chars, puede fallar en algunos wallets")
+
+    # Generar QR en el pool de renderizado (caché por contenido del payload) solo si va en línea
+    qr_code_base64 = None
+    if QR_INLINE_BASE64 if inline_qr is None else inline_qr:
         try:
-            from qr_generator import QRGenerator
-            qr_gen = QRGenerator()
-            qr_code_full = qr_gen.generate_qr(qr_url)
-            
-            # Usar directamente el resultado completo (ya incluye data:image/png;base64,)
-            qr_code_base64 = qr_code_full if qr_code_full else ""
-                
-            logger.info(f"✅ QR generado exitosamente, formato: {qr_code_base64[:50] if qr_code_base64 else 'Vacío'}...")
-            
+            qr_code_base64 = await qr_renderer.data_uri(qr_url)
+
+            logger.info(f"✅ QR generado exitosamente, formato: {qr_code_base64[:50]}...")
+
         except Exception as qr_error:
             logger.error(f"❌ Error generando QR: {qr_error}")
             # Fallback sin QR pero con URL
             qr_code_base64 = ""
-        
-        # Almacenar para la página web de display
-        global qr_storage
-        if 'qr_storage' not in globals():
-            qr_storage = {}
-        
-        qr_storage[pre_auth_code] = {
-            "qr_code_base64": qr_code_base64,
-            "qr_url": qr_url,
-            "student_name": request.student_name,
-            "course_name": request.course_name,
-            "timestamp": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(minutes=10)).isoformat(),
-            "type": "openid4vc_compliant",
-            "format_version": "OpenID4VC Draft-16"
-        }
-        
-        logger.info(f"✅ Credential Offer OpenID4VC creado: {pre_auth_code}")
-        
-        response_data = {
-            "qr_url": qr_url,
-            "qr_code_base64": qr_code_base64,
-            "pre_authorized_code": pre_auth_code,
-            "offer": offer,
-            "web_qr_url": f"{ISSUER_URL}/oid4vc/qr/{pre_auth_code}",
-            "instructions": "Escanea con wallet compatible OpenID4VC (walt.id, Lissi, etc.)",
-            "compatibility": {
-                "walt_id": True,
-                "lissi_wallet": True,
-                "openid4vc_standard": True
-            },
-            "debug_info": {
-                "qr_length": len(qr_url),
-                "offer_format": "OpenID4VC Draft-16 compliant",
-                "scheme": "openid-credential-offer://"
-            }
+
+    # Almacenar para la página web de display (expira junto con el pre-authorized code)
+    qr_cache.set(f"openid:{pre_auth_code}", {
+        "qr_url": qr_url,
+        "student_name": request.student_name,
+        "course_name": request.course_name,
+        "timestamp": datetime.now().isoformat(),
+        "expires_at": (datetime.now() + timedelta(minutes=10)).isoformat(),
+        "type": "openid4vc_compliant",
+        "format_version": "OpenID4VC Draft-16"
+    }, ttl=600)
+
+    logger.info(f"✅ Credential Offer OpenID4VC creado: {pre_auth_code}")
+
+    response_data = {
+        "qr_url": qr_url,
+        "qr_code_base64": qr_code_base64,
+        "qr_image_url": f"{ISSUER_URL}/oid4vc/qr/{pre_auth_code}.png",
+        "pre_authorized_code": pre_auth_code,
+        "offer": offer,
+        "credential_offer_uri": credential_offer_uri,
+        "web_qr_url": f"{ISSUER_URL}/oid4vc/qr/{pre_auth_code}",
+        "instructions": "Escanea con wallet compatible OpenID4VC (walt.id, Lissi, etc.)",
+        "compatibility": {
+            "walt_id": True,
+            "lissi_wallet": True,
+            "openid4vc_standard": True
+        },
+        "debug_info": {
+            "qr_length": len(qr_url),
+            "offer_format": "OpenID4VC Draft-16 compliant",
+            "offer_by_reference": credential_offer_uri is not None,
+            "scheme": "openid-credential-offer://"
         }
-        
-        response = JSONResponse(content=response_data)
-        return await add_security_headers(response)
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Error creando Credential Offer OpenID4VC: {e}")
-        raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
+    }
+    return response_data
+
+# ENDPOINT 2.1: Credential Offer por referencia (credential_offer_uri)
+@oid4vc_router.get("/credential-offer/{offer_id}")
+async def get_credential_offer(offer_id: str):
+    """
+    Servir el JSON del Credential Offer referenciado por credential_offer_uri
+    Caché en proceso con respaldo en el store compartido (otros workers)
+    """
+    offer = offer_cache.get(offer_id)
+    if offer is None:
+        offer = await pending_store.get(PENDING_OFFER_NAMESPACE, offer_id)
+        if offer is None:
+            raise HTTPException(status_code=404, detail="Credential Offer no encontrado o expirado")
+        offer_cache.set(offer_id, offer)
+    
+    response = JSONResponse(content=offer)
+    return await add_security_headers(response)
 
 # ENDPOINT 3: Token endpoint (OAuth 2.0) - UNIVERSAL COMPATIBILITY 
 @oid4vc_router.post("/token")
@@ -497,7 +695,7 @@ async def token_endpoint(request: Request):
             }
         }
         
-        access_token = jwt.encode(access_token_payload, PRIVATE_KEY, algorithm="ES256")
+        access_token = await signing_executor.sign(access_token_payload)
         
         response_data = {
             "access_token": access_token,
@@ -513,6 +711,8 @@ async def token_endpoint(request: Request):
         
     except HTTPException:
         raise
+    except SigningOverloadedError as e:
+        raise signing_overloaded(e)
     except Exception as e:
         logger.error(f"❌ Error en token endpoint: {e}")
         raise HTTPException(
@@ -627,7 +827,7 @@ async def walt_token_endpoint(
             }
         }
         
-        access_token = jwt.encode(access_token_payload, PRIVATE_KEY, algorithm="ES256")
+        access_token = await signing_executor.sign(access_token_payload)
         
         response_data = {
             "access_token": access_token,
@@ -643,6 +843,8 @@ async def walt_token_endpoint(
         
     except HTTPException:
         raise
+    except SigningOverloadedError as e:
+        raise signing_overloaded(e)
     except Exception as e:
         logger.error(f"❌ Error en walt.id token endpoint: {e}")
         raise HTTPException(
@@ -724,10 +926,8 @@ async def issue_openid_credential(
         access_token = authorization.replace("Bearer ", "")
         try:
             # Para ES256, usar la clave pública para verificar el token
-            token_data = jwt.decode(
-                access_token, 
-                PUBLIC_KEY, 
-                algorithms=["ES256"],
+            token_data = credential_signer.verify(
+                access_token,
                 audience=ISSUER_URL,
                 issuer=ISSUER_URL
             )
@@ -771,6 +971,10 @@ async def issue_openid_credential(
                 }
             )
         
+        # Índice en la lista de estado (idempotente si el wallet reintenta)
+        credential_id = f"urn:credential:{pre_auth_code}"
+        credential_status = await status_lists.allocate(credential_id, subject=credential_data["student_id"])
+        
         # Crear W3C Verifiable Credential en formato JWT con configuración SSL
         now = datetime.now()
         vc_payload = {
@@ -778,14 +982,15 @@ async def issue_openid_credential(
             "sub": f"did:web:{ISSUER_URL.replace('https://', '')}#{credential_data['student_id']}",
             "iat": int(now.timestamp()),
             "exp": int((now + timedelta(days=365)).timestamp()),
-            "jti": f"urn:credential:{pre_auth_code}",  # Identificador único
+            "jti": credential_id,  # Identificador único
             "vc": {
                 "@context": [
                     "https://www.w3.org/2018/credentials/v1",
-                    "https://www.w3.org/2018/credentials/examples/v1"
+                    "https://www.w3.org/2018/credentials/examples/v1",
+                    STATUS_LIST_CONTEXT
                 ],
                 "type": ["VerifiableCredential", "UniversityCredential"],
-                "id": f"urn:credential:{pre_auth_code}",
+                "id": credential_id,
                 "issuer": {
                     "id": ISSUER_URL,
                     "name": "Tu Universidad",
@@ -804,11 +1009,7 @@ async def issue_openid_credential(
                     "university": "Tu Universidad",
                     "credential_type": "OpenBadgeCredential"
                 },
-                # Metadatos de seguridad SSL
-                "credentialStatus": {
-                    "id": f"{ISSUER_URL}/oid4vc/status/{pre_auth_code}",
-                    "type": "RevocationList2020Status"
-                },
+                "credentialStatus": credential_status,
                 "evidence": [
                     {
                         "type": "DocumentVerification",
@@ -820,9 +1021,12 @@ async def issue_openid_credential(
                 ]
             }
         }
-        
+        # course_id completa los campos del hash anclado en Fabric (verificación con check_anchor)
+        if credential_data.get("course_id"):
+            vc_payload["vc"]["credentialSubject"]["course_id"] = credential_data["course_id"]
+
         # Firmar credencial con algoritmo ES256
-        vc_jwt = jwt.encode(vc_payload, PRIVATE_KEY, algorithm="ES256")
+        vc_jwt = await signing_executor.sign(vc_payload)
         
         # Limpiar datos pendientes
         await clear_pending_openid_credential(pre_auth_code)
@@ -841,6 +1045,8 @@ async def issue_openid_credential(
         
     except HTTPException:
         raise
+    except SigningOverloadedError as e:
+        raise signing_overloaded(e)
     except Exception as e:
         logger.error(f"❌ Error emitiendo credencial OpenID4VC: {e}")
         raise HTTPException(
@@ -857,9 +1063,6 @@ async def store_pending_openid_credential(code: str, data: Dict[str, Any], expir
     Almacenar datos pendientes con expiración y validación SSL
     """
     try:
-        import tempfile
-        import os
-        
         # Añadir metadatos mejorados de OpenID4VC
         enhanced_data = {
             **data,
@@ -870,16 +1073,8 @@ async def store_pending_openid_credential(code: str, data: Dict[str, Any], expir
             "issuer_url": ISSUER_URL
         }
         
-        temp_file = f"/tmp/pending_openid_credential_{code}.json"
-        
-        # En Windows, usar directorio temp apropiado
-        if os.name == 'nt':
-            temp_dir = os.environ.get('TEMP', os.environ.get('TMP', 'C:\\temp'))
-            os.makedirs(temp_dir, exist_ok=True)
-            temp_file = os.path.join(temp_dir, f"pending_openid_credential_{code}.json")
-        
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            json.dump(enhanced_data, f, ensure_ascii=False, indent=2)
+        # El store expira la entrada de forma nativa al cumplirse el TTL
+        await pending_store.put(PENDING_OPENID_NAMESPACE, code, enhanced_data, ttl=expires_in)
             
         logger.info(f"📝 Datos almacenados para {code}, expira en {expires_in}s")
         
@@ -892,33 +1087,7 @@ async def get_pending_openid_credential(code: str) -> Optional[Dict[str, Any]]:
     Obtener datos pendientes con validación de expiración
     """
     try:
-        import os
-        
-        temp_file = f"/tmp/pending_openid_credential_{code}.json"
-        
-        # En Windows, usar directorio temp apropiado
-        if os.name == 'nt':
-            temp_dir = os.environ.get('TEMP', os.environ.get('TMP', 'C:\\temp'))
-            temp_file = os.path.join(temp_dir, f"pending_openid_credential_{code}.json")
-        
-        if not os.path.exists(temp_file):
-            return None
-            
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Verificar expiración
-        if 'expires_at' in data:
-            expires_at = datetime.fromisoformat(data['expires_at'])
-            if datetime.now() > expires_at:
-                logger.info(f"⏰ Datos expirados para {code}, eliminando...")
-                await clear_pending_openid_credential(code)
-                return None
-        
-        return data
-        
-    except FileNotFoundError:
-        return None
+        return await pending_store.get(PENDING_OPENID_NAMESPACE, code)
     except Exception as e:
         logger.error(f"❌ Error obteniendo datos pendientes: {e}")
         return None
@@ -928,24 +1097,25 @@ async def clear_pending_openid_credential(code: str):
     Limpiar datos pendientes con logging mejorado
     """
     try:
-        import os
-        
-        temp_file = f"/tmp/pending_openid_credential_{code}.json"
-        
-        # En Windows, usar directorio temp apropiado
-        if os.name == 'nt':
-            temp_dir = os.environ.get('TEMP', os.environ.get('TMP', 'C:\\temp'))
-            temp_file = os.path.join(temp_dir, f"pending_openid_credential_{code}.json")
-        
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
-            logger.info(f"🗑️ Datos limpiados para {code}")
+        await pending_store.delete(PENDING_OPENID_NAMESPACE, code)
+        logger.info(f"🗑️ Datos limpiados para {code}")
             
     except Exception as e:
         logger.warning(f"⚠️ Error limpiando datos pendientes: {e}")
 
 # ==================== ENDPOINT PARA MOSTRAR QR OPENID4VC SSL-ENHANCED ====================
 
+# Registrada antes que /qr/{pre_auth_code}: "code.png" no debe caer en la página HTML
+@oid4vc_router.get("/qr/{pre_auth_code}.{fmt}")
+async def get_openid_qr_image(pre_auth_code: str, fmt: str, request: Request):
+    """Imagen del QR OpenID4VC (.png, .svg o .json con la matriz de módulos)"""
+    if fmt not in QR_RENDERERS:
+        raise HTTPException(status_code=404, detail=f"Formato no soportado: {fmt}")
+    qr_data = qr_cache.get(f"openid:{pre_auth_code}")
+    if qr_data is None:
+        raise HTTPException(status_code=404, detail="QR Code OpenID4VC no encontrado o expirado")
+    return await qr_renderer.image_response(request, qr_data["qr_url"], fmt)
+
 @oid4vc_router.get("/qr/{pre_auth_code}", response_class=HTMLResponse)
 async def show_openid_qr_page(pre_auth_code: str):
     """
@@ -953,22 +1123,13 @@ async def show_openid_qr_page(pre_auth_code: str):
     Incluye información SSL y troubleshooting para problemas de certificados
     """
     try:
-        # Buscar QR en storage temporal
-        global qr_storage
-        if 'qr_storage' not in globals():
-            qr_storage = {}
-            
-        if pre_auth_code not in qr_storage:
+        # Buscar QR en caché compartido (el TTL ya descarta los expirados)
+        qr_data = qr_cache.get(f"openid:{pre_auth_code}")
+        if qr_data is None:
             raise HTTPException(status_code=404, detail="QR Code OpenID4VC no encontrado o expirado")
         
-        qr_data = qr_storage[pre_auth_code]
-        
-        # Verificar expiración
-        if 'expires_at' in qr_data:
-            expires_at = datetime.fromisoformat(qr_data['expires_at'])
-            if datetime.now() > expires_at:
-                del qr_storage[pre_auth_code]
-                raise HTTPException(status_code=404, detail="QR Code expirado")
+        # La imagen se sirve aparte (/oid4vc/qr/{code}.svg) y se renderiza al primer uso
+        qr_data = {**qr_data, "qr_image_url": f"/oid4vc/qr/{pre_auth_code}.svg"}
         
         # Página HTML específica para OpenID4VC con información SSL
         html_content = f"""
@@ -1124,7 +1285,7 @@ async def show_openid_qr_page(pre_auth_code: str):
                 </div>
                 
                 <div class="qr-container">
-                    {f'<img src="{qr_data["qr_code_base64"]}"' if qr_data.get('qr_code_base64') else '<div class="qr-error">❌ QR no disponible</div><br><strong>URL directa:</strong><br><code style="word-break: break-all; font-size: 0.8em;">{qr_data["qr_url"]}</code>'}
+                    {f'<img src="{qr_data["qr_image_url"]}"' if qr_data.get('qr_image_url') else '<div class="qr-error">❌ QR no disponible</div><br><strong>URL directa:</strong><br><code style="word-break: break-all; font-size: 0.8em;">{qr_data["qr_url"]}</code>'}
                          alt="QR Code OpenID4VC" class="qr-code">
                     <div class="expires-info">
                         Válido hasta: {qr_data.get('expires_at', 'Sin límite')}
@@ -1140,7 +1301,7 @@ async def show_openid_qr_page(pre_auth_code: str):
                         <li>Acepta la credencial en tu wallet</li>
                         <li>¡Credencial W3C recibida!</li>
                     </ol>
-                    {f'<p><strong>URL para copiar:</strong><br><code style="word-break: break-all; font-size: 0.8em;">{qr_data["qr_url"]}</code></p>' if not qr_data.get('qr_code_base64') else ''}
+                    {f'<p><strong>URL para copiar:</strong><br><code style="word-break: break-all; font-size: 0.8em;">{qr_data["qr_url"]}</code></p>' if not qr_data.get('qr_image_url') else ''}
                 </div>
                 
                 <div class="troubleshooting">
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Pending Credential Store - Almacenamiento de credenciales pendientes de emisión
+Reemplaza los archivos /tmp/pending_*.json por backends con expiración nativa
+
+Backends disponibles (variable PENDING_STORE_BACKEND):
+- memory: diccionario en proceso (un solo worker, desarrollo)
+- sqlite: SQLite en modo WAL vía SQLAlchemy (varios workers en el mismo host)
+- redis:  Redis o compatible (varios workers / varios hosts)
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Configuración del store
+PENDING_STORE_BACKEND = os.getenv("PENDING_STORE_BACKEND", "sqlite")
+PENDING_STORE_PATH = os.getenv("PENDING_STORE_PATH", "/var/lib/controller/pending_credentials.db")
+PENDING_STORE_REDIS_URL = os.getenv("PENDING_STORE_REDIS_URL", "redis://localhost:6379/0")
+PENDING_STORE_PREFIX = os.getenv("PENDING_STORE_PREFIX", "credenciales:pending")
+
+# Cada cuántas escrituras se purgan las entradas expiradas (memory/sqlite)
+PURGE_EVERY_WRITES = 200
+
+
+class PendingCredentialStore:
+    """Interfaz común para almacenar datos de credenciales pendientes con TTL"""
+
+    backend_name = "base"
+
+    async def put(self, namespace: str, key: str, data: Dict[str, Any], ttl: int) -> None:
+        """Guardar datos bajo (namespace, key) durante ttl segundos"""
+        raise NotImplementedError
+
+    async def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        """Obtener datos si existen y no han expirado"""
+        raise NotImplementedError
+
+    async def delete(self, namespace: str, key: str) -> None:
+        """Eliminar datos (no falla si no existen)"""
+        raise NotImplementedError
+
+    async def take(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        """Obtener y eliminar; entre workers concurrentes solo uno recibe los datos"""
+        raise NotImplementedError
+
+    async def keys(self, namespace: str) -> List[str]:
+        """Claves vigentes de un namespace (namespaces pequeños: recuperación al iniciar)"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Liberar recursos del backend"""
+        return None
+
+
+class MemoryPendingCredentialStore(PendingCredentialStore):
+    """Backend en memoria del proceso - no se comparte entre workers"""
+
+    backend_name = "memory"
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+        self._writes = 0
+
+    async def put(self, namespace: str, key: str, data: Dict[str, Any], ttl: int) -> None:
+        self._entries[(namespace, key)] = (time.time() + ttl, data)
+        self._writes += 1
+        if self._writes % PURGE_EVERY_WRITES == 0:
+            self._purge_expired()
+
+    async def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get((namespace, key))
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if time.time() >= expires_at:
+            self._entries.pop((namespace, key), None)
+            return None
+        return data
+
+    async def delete(self, namespace: str, key: str) -> None:
+        self._entries.pop((namespace, key), None)
+
+    async def take(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        data = await self.get(namespace, key)
+        self._entries.pop((namespace, key), None)
+        return data
+
+    async def keys(self, namespace: str) -> List[str]:
+        now = time.time()
+        return [k for (ns, k), (expires_at, _) in self._entries.items() if ns == namespace and now < expires_at]
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [k for k, (expires_at, _) in self._entries.items() if now >= expires_at]
+        for k in expired:
+            del self._entries[k]
+
+
+class SQLitePendingCredentialStore(PendingCredentialStore):
+    """Backend SQLite (WAL) compartido por los workers de un mismo host"""
+
+    backend_name = "sqlite"
+
+    def __init__(self, path: str = PENDING_STORE_PATH):
+        from sqlalchemy import MetaData, Table, Column, String, Text, Float
+        from db import create_sqlite_engine
+
+        self.path = path
+        self._engine = create_sqlite_engine(path)
+
+        metadata = MetaData()
+        self._table = Table(
+            "pending_credentials",
+            metadata,
+            Column("namespace", String(64), primary_key=True),
+            Column("key", String(255), primary_key=True),
+            Column("payload", Text, nullable=False),
+            Column("expires_at", Float, nullable=False, index=True),
+        )
+        metadata.create_all(self._engine)
+        self._writes = 0
+
+    async def put(self, namespace: str, key: str, data: Dict[str, Any], ttl: int) -> None:
+        await asyncio.to_thread(self._put_sync, namespace, key, json.dumps(data, ensure_ascii=False), ttl)
+
+    async def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        payload = await asyncio.to_thread(self._get_sync, namespace, key)
+        return json.loads(payload) if payload is not None else None
+
+    async def delete(self, namespace: str, key: str) -> None:
+        await asyncio.to_thread(self._delete_sync, namespace, key)
+
+    async def take(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        payload = await asyncio.to_thread(self._take_sync, namespace, key)
+        return json.loads(payload) if payload is not None else None
+
+    async def keys(self, namespace: str) -> List[str]:
+        return await asyncio.to_thread(self._keys_sync, namespace)
+
+    async def close(self) -> None:
+        self._engine.dispose()
+
+    def _put_sync(self, namespace: str, key: str, payload: str, ttl: int):
+        from sqlalchemy.dialects.sqlite import insert
+
+        expires_at = time.time() + ttl
+        stmt = insert(self._table).values(
+            namespace=namespace, key=key, payload=payload, expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["namespace", "key"],
+            set_={"payload": payload, "expires_at": expires_at},
+        )
+        with self._engine.begin() as conn:
+            conn.execute(stmt)
+            self._writes += 1
+            if self._writes % PURGE_EVERY_WRITES == 0:
+                conn.execute(self._table.delete().where(self._table.c.expires_at <= time.time()))
+
+    def _get_sync(self, namespace: str, key: str) -> Optional[str]:
+        from sqlalchemy import select
+
+        stmt = select(self._table.c.payload).where(
+            self._table.c.namespace == namespace,
+            self._table.c.key == key,
+            self._table.c.expires_at > time.time(),
+        )
+        with self._engine.connect() as conn:
+            return conn.execute(stmt).scalar_one_or_none()
+
+    def _delete_sync(self, namespace: str, key: str):
+        stmt = self._table.delete().where(
+            self._table.c.namespace == namespace,
+            self._table.c.key == key,
+        )
+        with self._engine.begin() as conn:
+            conn.execute(stmt)
+
+    def _take_sync(self, namespace: str, key: str) -> Optional[str]:
+        """El DELETE decide: solo quien borra la fila se queda con los datos"""
+        payload = self._get_sync(namespace, key)
+        if payload is None:
+            return None
+        stmt = self._table.delete().where(
+            self._table.c.namespace == namespace,
+            self._table.c.key == key,
+        )
+        with self._engine.begin() as conn:
+            return payload if conn.execute(stmt).rowcount else None
+
+    def _keys_sync(self, namespace: str) -> List[str]:
+        from sqlalchemy import select
+
+        stmt = select(self._table.c.key).where(
+            self._table.c.namespace == namespace,
+            self._table.c.expires_at > time.time(),
+        )
+        with self._engine.connect() as conn:
+            return list(conn.execute(stmt).scalars())
+
+
+class RedisPendingCredentialStore(PendingCredentialStore):
+    """Backend Redis (o compatible: KeyDB, Valkey, Dragonfly) con EXPIRE nativo"""
+
+    backend_name = "redis"
+
+    def __init__(self, url: str = PENDING_STORE_REDIS_URL, prefix: str = PENDING_STORE_PREFIX):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            logger.error("❌ El backend 'redis' requiere el paquete 'redis' (pip install redis)")
+            raise e
+
+        self._client = redis_asyncio.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _redis_key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    async def put(self, namespace: str, key: str, data: Dict[str, Any], ttl: int) -> None:
+        await self._client.set(
+            self._redis_key(namespace, key),
+            json.dumps(data, ensure_ascii=False),
+            ex=max(int(ttl), 1),
+        )
+
+    async def get(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        payload = await self._client.get(self._redis_key(namespace, key))
+        return json.loads(payload) if payload is not None else None
+
+    async def delete(self, namespace: str, key: str) -> None:
+        await self._client.delete(self._redis_key(namespace, key))
+
+    async def take(self, namespace: str, key: str) -> Optional[Dict[str, Any]]:
+        payload = await self._client.getdel(self._redis_key(namespace, key))
+        return json.loads(payload) if payload is not None else None
+
+    async def keys(self, namespace: str) -> List[str]:
+        prefix = self._redis_key(namespace, "")
+        return [key[len(prefix):] async for key in self._client.scan_iter(match=f"{prefix}*")]
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_pending_store(backend: str = PENDING_STORE_BACKEND) -> PendingCredentialStore:
+    """Crear el backend configurado; si falla, usar memoria para no detener el servicio"""
+    backend = (backend or "memory").lower()
+    try:
+        if backend == "sqlite":
+            store = SQLitePendingCredentialStore()
+        elif backend == "redis":
+            store = RedisPendingCredentialStore()
+        else:
+            store = MemoryPendingCredentialStore()
+        logger.info(f"✅ Pending store inicializado: {store.backend_name}")
+        return store
+    except Exception as e:
+        logger.error(f"❌ Error inicializando pending store '{backend}': {e}")
+        logger.warning("⚠️ Usando almacenamiento en memoria (no compartido entre workers)")
+        return MemoryPendingCredentialStore()
+
+
+_pending_store: Optional[PendingCredentialStore] = None
+
+
+def get_pending_store() -> PendingCredentialStore:
+    """Instancia compartida del store (app.py y openid4vc_endpoints.py)"""
+    global _pending_store
+    if _pending_store is None:
+        _pending_store = create_pending_store()
+    return _pending_store
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+QR Cache - Caché acotado (LRU) con expiración (TTL) para códigos QR
+Compartido por los flujos DIDComm (/qr/{id}) y OpenID4VC (/oid4vc/qr/{code})
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Configuración del caché de QRs
+QR_CACHE_MAX_ENTRIES = int(os.getenv("QR_CACHE_MAX_ENTRIES", "5000"))
+# Por defecto, lo mismo que la credencial pendiente: el QR vive tanto como la invitación
+QR_CACHE_TTL = int(os.getenv("QR_CACHE_TTL", os.getenv("PENDING_CREDENTIAL_TTL", str(7 * 24 * 3600))))
+QR_CACHE_SWEEP_INTERVAL = int(os.getenv("QR_CACHE_SWEEP_INTERVAL", "60"))
+
+
+class TTLCache:
+    """Caché LRU con expiración por entrada, barrido en background y contadores"""
+
+    def __init__(self, name: str, max_entries: int, default_ttl: int, sweep_interval: int = 60):
+        self.name = name
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper_task: Optional[asyncio.Task] = None
+
+        # Contadores
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """Guardar valor; si se supera el límite se expulsa la entrada menos usada"""
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        """Obtener valor si existe y no ha expirado"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() < entry[0]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def sweep(self) -> int:
+        """Eliminar todas las entradas expiradas; retorna cuántas se eliminaron"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, (expires_at, _) in self._entries.items() if now >= expires_at]
+            for k in expired:
+                del self._entries[k]
+            self.expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.info(f"🧹 Caché {self.name}: {removed} entradas expiradas eliminadas")
+            except Exception as e:
+                logger.warning(f"⚠️ Error barriendo caché {self.name}: {e}")
+
+    def start_sweeper(self):
+        """Iniciar barrido periódico (llamar desde el evento startup)"""
+        if self._sweeper_task is None or self._sweeper_task.done():
+            self._sweeper_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop_sweeper(self):
+        if self._sweeper_task:
+            self._sweeper_task.cancel()
+            try:
+                await self._sweeper_task
+            except asyncio.CancelledError:
+                pass
+            self._sweeper_task = None
+
+
+# Instancia compartida por app.py y openid4vc_endpoints.py
+qr_cache = TTLCache(
+    name="qr",
+    max_entries=QR_CACHE_MAX_ENTRIES,
+    default_ttl=QR_CACHE_TTL,
+    sweep_interval=QR_CACHE_SWEEP_INTERVAL,
+)
@@ -4,24 +4,108 @@ QR Generator - Generador de códigos QR para invitaciones de conexión
 Para wallets de credenciales verificables W3C
 """
 
+import os
+import json
 import qrcode
 import base64
 from io import BytesIO
+from typing import Dict, Any, List
 from PIL import Image
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Configuración por defecto de los QR de invitación
+DEFAULT_QR_CONFIG = {
+    'version': 1,
+    'error_correction': qrcode.constants.ERROR_CORRECT_L,
+    'box_size': 10,
+    'border': 4,
+}
+
+
+def qr_matrix(data: str, qr_config: Dict[str, Any] = DEFAULT_QR_CONFIG) -> List[List[bool]]:
+    """Matriz de módulos del QR (incluye el borde de silencio); True = módulo oscuro"""
+    qr = qrcode.QRCode(**qr_config)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def render_qr_png(data: str, qr_config: Dict[str, Any] = DEFAULT_QR_CONFIG) -> bytes:
+    """
+    Renderizar un QR a bytes PNG de 1 bit por píxel con compresión optimizada
+    Función de módulo (sin estado) para poder ejecutarla en un pool de hilos o procesos
+    """
+    matrix = qr_matrix(data, qr_config)
+    size = len(matrix)
+    
+    # Un píxel por módulo y escalado sin interpolación: en modo "1" blanco = 1
+    module_img = Image.new("1", (size, size))
+    module_img.putdata([0 if module else 1 for row in matrix for module in row])
+    box_size = qr_config.get('box_size', 10)
+    qr_img = module_img.resize((size * box_size, size * box_size), Image.Resampling.NEAREST)
+    
+    buffer = BytesIO()
+    qr_img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def render_qr_svg(data: str, qr_config: Dict[str, Any] = DEFAULT_QR_CONFIG) -> bytes:
+    """
+    Renderizar un QR a SVG compacto: un único <path> con un rectángulo por tramo
+    horizontal de módulos oscuros, en unidades de módulo (escala libre en el cliente)
+    """
+    matrix = qr_matrix(data, qr_config)
+    size = len(matrix)
+    
+    segments = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                segments.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+            else:
+                x += 1
+    
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+        f'shape-rendering="crispEdges"><rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(segments)}" fill="#000"/></svg>'
+    )
+    return svg.encode("utf-8")
+
+
+def render_qr_matrix(data: str, qr_config: Dict[str, Any] = DEFAULT_QR_CONFIG) -> bytes:
+    """Matriz de módulos en JSON: una cadena de "0"/"1" por fila (para renderizado en cliente)"""
+    matrix = qr_matrix(data, qr_config)
+    return json.dumps({
+        "size": len(matrix),
+        "border": qr_config.get('border', 4),
+        "rows": ["".join("1" if module else "0" for module in row) for row in matrix],
+    }, separators=(',', ':')).encode("utf-8")
+
+
+# Formatos de salida: extensión → (renderizador, content type)
+QR_RENDERERS = {
+    "png": (render_qr_png, "image/png"),
+    "svg": (render_qr_svg, "image/svg+xml"),
+    "json": (render_qr_matrix, "application/json"),
+}
+
+
+def png_data_uri(png_bytes: bytes) -> str:
+    return f"data:image/png;base64,{base64.b64encode(png_bytes).decode()}"
+
+
 class QRGenerator:
     """Generador de códigos QR para invitaciones DIDComm"""
     
     def __init__(self):
-        self.qr_config = {
-            'version': 1,
-            'error_correction': qrcode.constants.ERROR_CORRECT_L,
-            'box_size': 10,
-            'border': 4,
-        }
+        self.qr_config = dict(DEFAULT_QR_CONFIG)
     
     def generate_qr(self, invitation_url: str) -> str:
         """
@@ -36,22 +120,12 @@ class QRGenerator:
         try:
             logger.info("🔳 Generando código QR para invitación...")
             
-            # Crear código QR
-            qr = qrcode.QRCode(**self.qr_config)
-            qr.add_data(invitation_url)
-            qr.make(fit=True)
-            
-            # Generar imagen del QR
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-            
-            # Convertir a base64
-            buffer = BytesIO()
-            qr_img.save(buffer, format='PNG')
-            img_str = base64.b64encode(buffer.getvalue()).decode()
+            # Crear código QR, rasterizar y convertir a base64
+            data_uri = png_data_uri(render_qr_png(invitation_url, self.qr_config))
             
             logger.info("✅ Código QR generado exitosamente")
             
-            return f"data:image/png;base64,{img_str}"
+            return data_uri
             
         except Exception as e:
             logger.error(f"❌ Error generando QR: {e}")
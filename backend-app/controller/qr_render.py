@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+QR Render - Servicio de renderizado de códigos QR fuera del event loop
+Caché direccionado por contenido (SHA-256 del payload → bytes PNG/SVG/matriz),
+renderizado perezoso en la primera visualización y trabajo de CPU en un pool de
+hilos o procesos. También arma las respuestas de imagen con ETag y Cache-Control
+"""
+
+import asyncio
+import hashlib
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Optional
+import logging
+
+from fastapi import Request, Response
+
+from metrics import metrics
+from qr_cache import TTLCache
+from qr_generator import DEFAULT_QR_CONFIG, QR_RENDERERS, png_data_uri
+
+logger = logging.getLogger(__name__)
+
+# Configuración del servicio de renderizado
+QR_RENDER_EXECUTOR = os.getenv("QR_RENDER_EXECUTOR", "thread")  # thread | process
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+QR_RENDER_CACHE_MAX_ENTRIES = int(os.getenv("QR_RENDER_CACHE_MAX_ENTRIES", "2000"))
+QR_RENDER_CACHE_TTL = int(os.getenv("QR_RENDER_CACHE_TTL", str(24 * 3600)))
+QR_IMAGE_MAX_AGE = int(os.getenv("QR_IMAGE_MAX_AGE", "600"))
+# Incluir el QR en base64 dentro de las respuestas JSON (compatibilidad); si es false solo se envía la URL
+QR_INLINE_BASE64 = os.getenv("QR_INLINE_BASE64", "true").lower() == "true"
+
+# Negociación por Accept cuando la URL no trae extensión
+ACCEPT_FORMATS = [("image/svg+xml", "svg"), ("image/png", "png"), ("application/json", "json")]
+
+
+def payload_key(payload: str) -> str:
+    """Clave de contenido de un payload QR"""
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class QRRenderService:
+    """Renderiza cada payload una sola vez y comparte el resultado entre peticiones"""
+
+    def __init__(
+        self,
+        executor_kind: str = QR_RENDER_EXECUTOR,
+        max_workers: int = QR_RENDER_WORKERS,
+        cache: Optional[TTLCache] = None,
+    ):
+        self.executor_kind = executor_kind
+        self.max_workers = max_workers
+        self.cache = cache or TTLCache(
+            name="qr_images",
+            max_entries=QR_RENDER_CACHE_MAX_ENTRIES,
+            default_ttl=QR_RENDER_CACHE_TTL,
+        )
+        self._executor: Optional[Executor] = None
+        # Renders en curso por clave: peticiones concurrentes del mismo payload esperan el mismo
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qr-render")
+            logger.info(f"🔳 Pool de renderizado QR: {self.executor_kind} x{self.max_workers}")
+        return self._executor
+
+    async def render(self, payload: str, fmt: str = "png") -> bytes:
+        """Bytes del QR en el formato pedido; renderiza en el pool solo si no está en caché"""
+        renderer, _ = QR_RENDERERS[fmt]
+        key = f"{fmt}:{payload_key(payload)}"
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, renderer, payload, DEFAULT_QR_CONFIG)
+        self._inflight[key] = future
+        try:
+            with metrics.timer(f"qr_render {fmt}"):
+                content = await asyncio.shield(future)
+        finally:
+            self._inflight.pop(key, None)
+
+        self.cache.set(key, content)
+        return content
+
+    async def render_png(self, payload: str) -> bytes:
+        return await self.render(payload, "png")
+
+    async def data_uri(self, payload: str) -> str:
+        """QR como data URI base64 (formato histórico de las respuestas JSON)"""
+        return png_data_uri(await self.render_png(payload))
+
+    async def image_response(self, request: Request, payload: str, fmt: Optional[str] = None) -> Response:
+        """
+        Respuesta HTTP con la imagen del QR
+        ETag derivado del contenido (payload + formato): If-None-Match responde 304 sin renderizar
+        """
+        fmt = fmt or negotiate_format(request.headers.get("accept", ""))
+        _, media_type = QR_RENDERERS[fmt]
+        etag = f'"{fmt}-{payload_key(payload)[:32]}"'
+        headers = {
+            "ETag": etag,
+            # El payload puede contener un pre-authorized code: solo caché del navegador
+            "Cache-Control": f"private, max-age={QR_IMAGE_MAX_AGE}",
+            "Vary": "Accept",
+        }
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=await self.render(payload, fmt), media_type=media_type, headers=headers)
+
+    def start(self):
+        """Iniciar el barrido del caché (evento startup)"""
+        self.cache.start_sweeper()
+
+    async def close(self):
+        """Detener el barrido y liberar el pool (evento shutdown)"""
+        await self.cache.stop_sweeper()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.max_workers,
+            "inflight": len(self._inflight),
+            "cache": self.cache.stats(),
+        }
+
+
+def negotiate_format(accept: str) -> str:
+    """Elegir formato según la cabecera Accept (PNG por defecto)"""
+    accept = accept.lower()
+    for media_type, fmt in ACCEPT_FORMATS:
+        if media_type in accept:
+            return fmt
+    return "png"
+
+
+# Instancia compartida del Controller
+qr_renderer = QRRenderService()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Signing Executor - Firma ES256 fuera del event loop
+Pool de hilos (por defecto) o de procesos para firmar access tokens y VCs JWT,
+con límite de trabajos en curso, rechazo cuando la cola está llena y métricas
+de profundidad de cola
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Optional
+import logging
+
+import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+from credential_signer import CredentialSigner
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración del pool de firma
+SIGNING_EXECUTOR = os.getenv("SIGNING_EXECUTOR", "thread")  # thread | process
+SIGNING_WORKERS = int(os.getenv("SIGNING_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Trabajos enviados al pool a la vez (backpressure hacia los llamadores)
+SIGNING_MAX_IN_FLIGHT = int(os.getenv("SIGNING_MAX_IN_FLIGHT", str(SIGNING_WORKERS * 2)))
+# Llamadas esperando turno antes de rechazar con SigningOverloadedError (503)
+SIGNING_MAX_QUEUE = int(os.getenv("SIGNING_MAX_QUEUE", "1000"))
+
+# Claves ya parseadas dentro de cada proceso del pool (kid → clave privada)
+_WORKER_KEYS: Dict[str, Any] = {}
+
+
+def _sign_in_worker(
+    private_pem: bytes,
+    kid: str,
+    algorithm: str,
+    payload: Dict[str, Any],
+    headers: Optional[Dict[str, Any]],
+) -> str:
+    """Firmar un payload en un proceso del pool (parsea la clave una vez por kid)"""
+    key = _WORKER_KEYS.get(kid)
+    if key is None:
+        key = _WORKER_KEYS[kid] = load_pem_private_key(private_pem, password=None)
+    return jwt.encode(payload, key, algorithm=algorithm, headers={**(headers or {}), "kid": kid})
+
+
+class SigningOverloadedError(Exception):
+    """La cola de firma está llena; el llamador debe reintentar más tarde"""
+
+
+class SigningExecutor:
+    """Despacha firmas de CredentialSigner a un pool con backpressure"""
+
+    def __init__(
+        self,
+        signer: CredentialSigner,
+        executor_kind: str = SIGNING_EXECUTOR,
+        max_workers: int = SIGNING_WORKERS,
+        max_in_flight: int = SIGNING_MAX_IN_FLIGHT,
+        max_queue: int = SIGNING_MAX_QUEUE,
+    ):
+        self.signer = signer
+        self.executor_kind = executor_kind
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+        self._in_flight = 0
+        # PEM serializado por kid para enviarlo a los procesos del pool
+        self._pem_by_kid: Dict[str, bytes] = {}
+        self.signed = 0
+        self.rejected = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="jwt-sign")
+            logger.info(f"🔏 Pool de firma: {self.executor_kind} x{self.max_workers}")
+        return self._executor
+
+    def _job(self, payload: Dict[str, Any], headers: Optional[Dict[str, Any]]) -> tuple:
+        """Función y argumentos para run_in_executor según el tipo de pool"""
+        if self.executor_kind != "process":
+            return (self.signer.sign, payload, headers)
+        key = self.signer.signing_key()
+        pem = self._pem_by_kid.get(key.kid)
+        if pem is None:
+            pem = self._pem_by_kid[key.kid] = key.private_pem()
+        return (_sign_in_worker, pem, key.kid, self.signer.algorithm, payload, headers)
+
+    def _publish_depth(self):
+        metrics.set_gauge("signing_queue_depth", self._waiting)
+        metrics.set_gauge("signing_in_flight", self._in_flight)
+
+    def _admit(self):
+        """Rechazar en lugar de encolar sin límite cuando el pool no da abasto"""
+        if self._waiting >= self.max_queue:
+            self.rejected += 1
+            metrics.increment("signing_rejected")
+            raise SigningOverloadedError(
+                f"Cola de firma llena ({self._waiting} en espera, máximo {self.max_queue})"
+            )
+
+    async def sign(self, payload: Dict[str, Any], headers: Optional[Dict[str, Any]] = None) -> str:
+        """Firmar un payload en el pool (misma salida que CredentialSigner.sign)"""
+        self._admit()
+        self._waiting += 1
+        self._publish_depth()
+        enqueued = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        metrics.observe("signing_queue_wait", time.perf_counter() - enqueued)
+
+        self._in_flight += 1
+        self._publish_depth()
+        try:
+            loop = asyncio.get_running_loop()
+            with metrics.timer("signing_job"):
+                token = await loop.run_in_executor(self.executor, *self._job(payload, headers))
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+            self._publish_depth()
+
+        self.signed += 1
+        metrics.increment("signing_tokens")
+        return token
+
+    async def close(self):
+        """Liberar el pool (evento shutdown)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.max_workers,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "signed": self.signed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Status List - Revocación de credenciales OpenID4VC con StatusList2021
+Cada credencial recibe un índice dentro de una lista de bits compartida
+(STATUS_LIST_SIZE credenciales por lista); la lista se publica como una
+StatusList2021Credential firmada con el bitstring comprimido (GZIP + base64).
+
+Los bits viven en SQLite (WAL) y en memoria: revocar cambia un bit, incrementa la
+versión de la lista y solo esa lista se vuelve a comprimir y firmar en la próxima
+descarga. El ETag se deriva de la versión, así que los verificadores revalidan con
+If-None-Match sin recibir la lista de nuevo
+"""
+
+import asyncio
+import base64
+import gzip
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Any, Optional
+import logging
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, Float, LargeBinary, select, func
+from sqlalchemy.exc import IntegrityError
+
+from db import create_sqlite_engine
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuración de las listas de estado
+STATUS_LIST_PATH = os.getenv("STATUS_LIST_PATH", "/var/lib/controller/status_lists.db")
+# 131072 bits = 16 KB sin comprimir (mínimo recomendado por StatusList2021 para privacidad de grupo)
+STATUS_LIST_SIZE = int(os.getenv("STATUS_LIST_SIZE", "131072"))
+STATUS_LIST_MAX_AGE = int(os.getenv("STATUS_LIST_MAX_AGE", "300"))
+# Validez de la lista firmada; se vuelve a firmar pasada la mitad aunque no haya cambios
+STATUS_LIST_VALIDITY = int(os.getenv("STATUS_LIST_VALIDITY", str(24 * 3600)))
+
+STATUS_PURPOSE_REVOCATION = "revocation"
+STATUS_LIST_CONTEXT = "https://w3id.org/vc/status-list/2021/v1"
+
+# Firma de un payload JWT → token compacto (SigningExecutor.sign)
+SignPayload = Callable[[Dict[str, Any]], Awaitable[str]]
+
+
+def encode_bitstring(bits: bytes) -> str:
+    """encodedList de StatusList2021: GZIP del bitstring y base64"""
+    return base64.b64encode(gzip.compress(bytes(bits), mtime=0)).decode("ascii")
+
+
+def decode_bitstring(encoded: str) -> bytes:
+    return gzip.decompress(base64.b64decode(encoded))
+
+
+def bit_is_set(bits: bytes, index: int) -> bool:
+    """El índice 0 es el bit más significativo del primer byte"""
+    return bool(bits[index // 8] & (0x80 >> (index % 8)))
+
+
+class _ListState:
+    """Copia en memoria de una lista y de su credencial firmada"""
+
+    __slots__ = ("bits", "version", "token", "etag", "signed_at", "checked_at")
+
+    def __init__(self, bits: bytes, version: int):
+        self.bits = bytearray(bits)
+        self.version = version
+        self.token: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.signed_at = 0.0
+        # Última comprobación de la versión contra la base (monotonic)
+        self.checked_at = time.monotonic()
+
+
+class StatusListService:
+    """Asignación de índices, revocación y publicación de listas StatusList2021"""
+
+    def __init__(
+        self,
+        base_url: str,
+        issuer: str,
+        sign: SignPayload,
+        path: str = STATUS_LIST_PATH,
+        list_size: int = STATUS_LIST_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.issuer = issuer
+        self._sign = sign
+        self.list_size = list_size
+
+        self._engine = create_sqlite_engine(path)
+        metadata = MetaData()
+        self._lists = Table(
+            "status_lists",
+            metadata,
+            Column("list_id", Integer, primary_key=True, autoincrement=True),
+            Column("purpose", String(32), nullable=False),
+            Column("size", Integer, nullable=False),
+            Column("next_index", Integer, nullable=False),
+            Column("version", Integer, nullable=False),
+            Column("bits", LargeBinary, nullable=False),
+            Column("created_at", String(64), nullable=False),
+        )
+        self._entries = Table(
+            "status_entries",
+            metadata,
+            Column("credential_id", String(255), primary_key=True),
+            Column("list_id", Integer, nullable=False),
+            Column("list_index", Integer, nullable=False),
+            Column("subject", String(255), nullable=True, index=True),
+            Column("revoked_at", Float, nullable=True),
+        )
+        metadata.create_all(self._engine)
+
+        self._states: Dict[int, _ListState] = {}
+        # Una firma por lista a la vez: descargas concurrentes esperan la misma
+        self._sign_locks: Dict[int, asyncio.Lock] = {}
+        self.allocated = 0
+        self.revoked = 0
+
+    def list_url(self, list_id: int) -> str:
+        return f"{self.base_url}/{list_id}"
+
+    def parse_list_url(self, list_url: str) -> Optional[int]:
+        """list_id de una URL de lista emitida por este servicio (None si es ajena)"""
+        prefix = f"{self.base_url}/"
+        if not list_url.startswith(prefix) or not list_url[len(prefix):].isdigit():
+            return None
+        return int(list_url[len(prefix):])
+
+    def credential_status(self, list_id: int, index: int) -> Dict[str, Any]:
+        """Objeto credentialStatus a incluir en la VC"""
+        list_url = self.list_url(list_id)
+        return {
+            "id": f"{list_url}#{index}",
+            "type": "StatusList2021Entry",
+            "statusPurpose": STATUS_PURPOSE_REVOCATION,
+            "statusListIndex": str(index),
+            "statusListCredential": list_url,
+        }
+
+    # -------------------------------------------------------------- asignación
+
+    async def allocate(self, credential_id: str, subject: Optional[str] = None) -> Dict[str, Any]:
+        """Reservar un índice para la credencial (idempotente por credential_id)"""
+        list_id, index = await asyncio.to_thread(self._allocate_sync, credential_id, subject)
+        self.allocated += 1
+        metrics.increment("status_list_allocations")
+        return self.credential_status(list_id, index)
+
+    def _allocate_sync(self, credential_id: str, subject: Optional[str]):
+        existing = self._get_entry_sync(credential_id)
+        if existing is not None:
+            return existing["list_id"], existing["list_index"]
+
+        lists = self._lists
+        try:
+            with self._engine.begin() as conn:
+                # UPDATE primero: toma el lock de escritura antes de leer (varios workers)
+                current = select(func.max(lists.c.list_id)).scalar_subquery()
+                claimed = conn.execute(
+                    lists.update()
+                    .where(lists.c.list_id == current, lists.c.next_index < lists.c.size)
+                    .values(next_index=lists.c.next_index + 1)
+                ).rowcount
+                if claimed:
+                    list_id, next_index = conn.execute(
+                        select(lists.c.list_id, lists.c.next_index).where(lists.c.list_id == current)
+                    ).one()
+                    index = next_index - 1
+                else:
+                    list_id = conn.execute(lists.insert().values(
+                        purpose=STATUS_PURPOSE_REVOCATION,
+                        size=self.list_size,
+                        next_index=1,
+                        version=0,
+                        bits=bytes(self.list_size // 8),
+                        created_at=datetime.utcnow().isoformat(),
+                    )).inserted_primary_key[0]
+                    index = 0
+                    logger.info(f"📋 Nueva lista de estado {list_id} ({self.list_size} entradas)")
+
+                conn.execute(self._entries.insert().values(
+                    credential_id=credential_id,
+                    list_id=list_id,
+                    list_index=index,
+                    subject=subject,
+                ))
+        except IntegrityError:
+            # Otro worker asignó la misma credencial en paralelo
+            existing = self._get_entry_sync(credential_id)
+            return existing["list_id"], existing["list_index"]
+        return list_id, index
+
+    def _get_entry_sync(self, credential_id: str) -> Optional[Dict[str, Any]]:
+        with self._engine.connect() as conn:
+            row = conn.execute(
+                select(self._entries).where(self._entries.c.credential_id == credential_id)
+            ).first()
+        return dict(row._mapping) if row else None
+
+    # -------------------------------------------------------------- revocación
+
+    async def revoke(self, credential_id: str) -> Optional[Dict[str, Any]]:
+        """Revocar una credencial; None si no tiene índice asignado"""
+        result = await asyncio.to_thread(self._revoke_sync, credential_id)
+        if result is None:
+            return None
+
+        list_id, index, version, already = result
+        state = self._states.get(list_id)
+        if state is not None and not already:
+            if state.version == version - 1:
+                # Actualización incremental: un bit, sin recargar la lista de la base
+                state.bits[index // 8] |= 0x80 >> (index % 8)
+                state.version = version
+                state.token = None
+            else:
+                # Otro worker también la modificó: recargar en la próxima consulta
+                self._states.pop(list_id, None)
+        if not already:
+            self.revoked += 1
+            metrics.increment("status_list_revocations")
+            logger.info(f"🚫 Credencial {credential_id} revocada (lista {list_id}, índice {index})")
+        return {
+            "credential_id": credential_id,
+            "revoked": True,
+            "already_revoked": already,
+            "credentialStatus": self.credential_status(list_id, index),
+        }
+
+    def _revoke_sync(self, credential_id: str):
+        with self._engine.begin() as conn:
+            entry = conn.execute(
+                self._entries.update()
+                .where(self._entries.c.credential_id == credential_id, self._entries.c.revoked_at.is_(None))
+                .values(revoked_at=time.time())
+            ).rowcount
+            row = conn.execute(
+                select(self._entries.c.list_id, self._entries.c.list_index)
+                .where(self._entries.c.credential_id == credential_id)
+            ).first()
+            if row is None:
+                return None
+            list_id, index = row
+            if not entry:
+                version = conn.execute(
+                    select(self._lists.c.version).where(self._lists.c.list_id == list_id)
+                ).scalar_one()
+                return list_id, index, version, True
+
+            bits = bytearray(conn.execute(
+                select(self._lists.c.bits).where(self._lists.c.list_id == list_id)
+            ).scalar_one())
+            bits[index // 8] |= 0x80 >> (index % 8)
+            conn.execute(
+                self._lists.update()
+                .where(self._lists.c.list_id == list_id)
+                .values(bits=bytes(bits), version=self._lists.c.version + 1)
+            )
+            version = conn.execute(
+                select(self._lists.c.version).where(self._lists.c.list_id == list_id)
+            ).scalar_one()
+        return list_id, index, version, False
+
+    # ---------------------------------------------------------------- consulta
+
+    async def _load_state(self, list_id: int, max_staleness: float = 0.0) -> Optional[_ListState]:
+        """
+        Estado en memoria de la lista, recargado si otro worker la cambió
+        ``max_staleness``: segundos durante los que se confía en la copia sin consultar la versión
+        """
+        state = self._states.get(list_id)
+        if state is not None and time.monotonic() - state.checked_at < max_staleness:
+            return state
+        version = await asyncio.to_thread(self._get_version_sync, list_id)
+        if version is None:
+            return None
+        if state is None or state.version != version:
+            bits, version = await asyncio.to_thread(self._get_bits_sync, list_id)
+            state = self._states[list_id] = _ListState(bits, version)
+        state.checked_at = time.monotonic()
+        return state
+
+    def _get_version_sync(self, list_id: int) -> Optional[int]:
+        with self._engine.connect() as conn:
+            return conn.execute(
+                select(self._lists.c.version).where(self._lists.c.list_id == list_id)
+            ).scalar_one_or_none()
+
+    def _get_bits_sync(self, list_id: int):
+        with self._engine.connect() as conn:
+            row = conn.execute(
+                select(self._lists.c.bits, self._lists.c.version).where(self._lists.c.list_id == list_id)
+            ).one()
+        return row.bits, row.version
+
+    async def is_revoked(self, list_id: int, index: int, max_staleness: float = 0.0) -> Optional[bool]:
+        """Bit de una credencial; None si la lista o el índice no existen"""
+        state = await self._load_state(list_id, max_staleness)
+        if state is None or not 0 <= index < len(state.bits) * 8:
+            return None
+        return bit_is_set(state.bits, index)
+
+    async def get_entry(self, credential_id: str) -> Optional[Dict[str, Any]]:
+        """Índice asignado y estado de revocación de una credencial"""
+        entry = await asyncio.to_thread(self._get_entry_sync, credential_id)
+        if entry is None:
+            return None
+        return {
+            "credential_id": credential_id,
+            "subject": entry["subject"],
+            "revoked": entry["revoked_at"] is not None,
+            "revoked_at": entry["revoked_at"],
+            "credentialStatus": self.credential_status(entry["list_id"], entry["list_index"]),
+        }
+
+    @staticmethod
+    def etag(list_id: int, token: str) -> str:
+        """
+        ETag fuerte del JWT servido: cambia al re-firmar (nuevo iat/exp) y difiere
+        entre workers que firmaron por separado, así un 304 nunca deja una lista vencida
+        """
+        return f'"sl-{list_id}-{hashlib.sha256(token.encode("ascii")).hexdigest()[:32]}"'
+
+    async def get_list_credential(self, list_id: int) -> Optional[Dict[str, Any]]:
+        """
+        StatusList2021Credential firmada (JWT) con su ETag; se firma de nuevo solo si la
+        lista cambió o pasó la mitad de la validez (ver STATUS_LIST_VALIDITY)
+        """
+        state = await self._load_state(list_id)
+        if state is None:
+            return None
+
+        lock = self._sign_locks.setdefault(list_id, asyncio.Lock())
+        async with lock:
+            if state.token is None or time.time() - state.signed_at > STATUS_LIST_VALIDITY / 2:
+                with metrics.timer("status_list_publish"):
+                    state.token = await self._sign(self._list_payload(list_id, state))
+                state.etag = self.etag(list_id, state.token)
+                state.signed_at = time.time()
+                metrics.increment("status_list_publications")
+        return {"token": state.token, "etag": state.etag, "version": state.version}
+
+    def _list_payload(self, list_id: int, state: _ListState) -> Dict[str, Any]:
+        list_url = self.list_url(list_id)
+        now = datetime.utcnow()
+        return {
+            "iss": self.issuer,
+            "sub": list_url,
+            "iat": int(now.timestamp()),
+            "exp": int((now + timedelta(seconds=STATUS_LIST_VALIDITY)).timestamp()),
+            "vc": {
+                "@context": ["https://www.w3.org/2018/credentials/v1", STATUS_LIST_CONTEXT],
+                "id": list_url,
+                "type": ["VerifiableCredential", "StatusList2021Credential"],
+                "issuer": self.issuer,
+                "issuanceDate": now.isoformat() + "Z",
+                "credentialSubject": {
+                    "id": f"{list_url}#list",
+                    "type": "StatusList2021",
+                    "statusPurpose": STATUS_PURPOSE_REVOCATION,
+                    "encodedList": encode_bitstring(state.bits),
+                },
+            },
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "list_size": self.list_size,
+            "lists_loaded": len(self._states),
+            "allocated": self.allocated,
+            "revoked": self.revoked,
+        }
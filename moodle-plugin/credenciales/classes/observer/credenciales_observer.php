@@ -28,18 +28,22 @@ class credenciales_observer {
         $url = 'http://python-controller:3000/api/issue-credential';
 
         // Configurar la petición cURL
+        // Prefer: respond-async -> el backend encola la emisión y responde 202 con un job_id,
+        // así el evento de Moodle no espera a ACA-Py ni a Fabric
+        $payload = json_encode($data);
         $ch = curl_init($url);
         curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
         curl_setopt($ch, CURLOPT_POST, true);
-        curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($data));
+        curl_setopt($ch, CURLOPT_POSTFIELDS, $payload);
         curl_setopt($ch, CURLOPT_HTTPHEADER, array(
             'Content-Type: application/json',
-            'Content-Length: ' . strlen(json_encode($data))
+            'Content-Length: ' . strlen($payload),
+            'Prefer: respond-async'
         ));
 
-        // Configurar timeout y manejo de errores
-        curl_setopt($ch, CURLOPT_TIMEOUT, 30);
-        curl_setopt($ch, CURLOPT_CONNECTTIMEOUT, 10);
+        // Configurar timeout y manejo de errores (solo se espera el encolado)
+        curl_setopt($ch, CURLOPT_TIMEOUT, 5);
+        curl_setopt($ch, CURLOPT_CONNECTTIMEOUT, 3);
 
         // Ejecutar la petición
         $response = curl_exec($ch);
@@ -47,6 +51,10 @@ class credenciales_observer {
         
         if (curl_errno($ch)) {
             error_log('Error en cURL: ' . curl_error($ch));
+        } else if ($httpCode === 202) {
+            $job = json_decode($response, true);
+            $jobid = isset($job['job_id']) ? $job['job_id'] : 'desconocido';
+            error_log('Credencial encolada para usuario: ' . $user->email . ' (trabajo ' . $jobid . ')');
         } else if ($httpCode !== 200) {
             error_log('Error HTTP: ' . $httpCode . ' - Respuesta: ' . $response);
         } else {